@@ -0,0 +1,285 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+End-to-end benchmark of the export.
+
+Builds a synthetic library (see fixtures.makeLibrary()) with its urls
+served by a local HTTP stub (see httpstub.HTTPStub), then times these
+stages, each in a fresh process so that its peak memory is its own:
+
+    getData       read the whole download_table into Track records,
+                  with getTrackList() (no pandas). Named after the
+                  dataframe read it replaced, to compare with baselines.
+    getAlbumList  read album ids and names, and build the album list.
+    processAlbum  export the largest album.
+    main          export the whole library.
+
+For each stage it records the time, rows/s, MB/s of exported audio and
+the peak RSS of the process. The best of --repeat runs is kept. Results
+are printed and saved as JSON with --output. Give the JSON of a previous
+release with --baseline to report stages that got slower than
+--tolerance, in which case the exit status is 1.
+
+Usage:
+    python bench/bench_export.py [-n ROWS] [-a ALBUMS] [-s SIZE_KB]
+            [-j JOBS] [-t TAG_JOBS] [-m MODE] [-r REPEAT]
+            [-o results.json] [--baseline old.json] [--tolerance 0.2]
+
+Update time: 2016-08-23 15:02:37.
+'''
+
+import sys,os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+BENCHDIR=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.dirname(BENCHDIR))
+import ximaexport
+from lib.workers import WorkerPool
+from fixtures import makeLibrary
+from httpstub import HTTPStub
+
+STAGES=['getData','getAlbumList','processAlbum','main']
+
+
+
+def peakRSS():
+    '''Peak resident memory of this process in KB, None if unknown'''
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform=='darwin':
+        rss//=1024
+    return rss
+
+
+def folderSize(folder):
+    '''Total size of audios exported to <folder>, covers left out'''
+    total=0
+    for root,dirs,files in os.walk(folder):
+        for ff in files:
+            if ff.endswith('.mp4'):
+                total+=os.path.getsize(os.path.join(root,ff))
+    return total
+
+
+#------------------------Stages, run in a child process------------------------
+def stageGetData(args):
+    db=sqlite3.connect(args.dbfile)
+    t0=time.time()
+    df=ximaexport.getTrackList(db)
+    dt=time.time()-t0
+    db.close()
+    return dt,len(df),0
+
+
+def stageGetAlbumList(args):
+    db=sqlite3.connect(args.dbfile)
+    t0=time.time()
+    df=ximaexport.getAlbumRows(db)
+    albumlist=ximaexport.getAlbumList(df,None)
+    dt=time.time()-t0
+    db.close()
+    return dt,len(df),0
+
+
+def stageProcessAlbum(args):
+    db=sqlite3.connect(args.dbfile)
+    albumid,df=max(ximaexport.iterAlbumTracks(db),key=lambda x: len(x[1]))
+    db.close()
+    indir=os.path.dirname(args.dbfile)
+
+    t0=time.time()
+    pool=WorkerPool(args.jobs)
+    ximaexport.processAlbum(df,indir,args.outdir,albumid,False,pool,\
+            exportmode=args.exportmode,covercache=None)
+    pool.close()
+    pool.join()
+    dt=time.time()-t0
+    return dt,len(df),folderSize(args.outdir)
+
+
+def stageMain(args):
+    db=sqlite3.connect(args.dbfile)
+    rows=db.execute('SELECT COUNT(*) FROM download_table').fetchone()[0]
+    db.close()
+
+    t0=time.time()
+    ximaexport.main(args.dbfile,args.outdir,None,False,args.jobs,\
+            exportmode=args.exportmode,cachedir=None,tagjobs=args.tagjobs)
+    dt=time.time()-t0
+    return dt,rows,folderSize(args.outdir)
+
+
+STAGEFUNCS={'getData': stageGetData, 'getAlbumList': stageGetAlbumList,\
+        'processAlbum': stageProcessAlbum, 'main': stageMain}
+
+
+def runStage(args):
+    '''Run one stage and save its result to args.result'''
+
+    #----Silence the export, the result goes to a file----
+    devnull=open(os.devnull,'w')
+    stdout=sys.stdout
+    sys.stdout=devnull
+    try:
+        dt,rows,nbytes=STAGEFUNCS[args.stage](args)
+    finally:
+        sys.stdout=stdout
+        devnull.close()
+
+    result={'seconds': dt, 'rows': rows, 'bytes': nbytes,\
+            'rows_per_s': rows/dt if dt>0 else None,\
+            'mb_per_s': nbytes/1024./1024/dt if dt>0 and nbytes else None,\
+            'peak_rss_kb': peakRSS()}
+    with open(args.result,'w') as fout:
+        json.dump(result,fout)
+
+
+#------------------------Driver------------------------
+def spawnStage(stage,dbfile,workdir,args):
+    '''Run <stage> in a child process, return its result dict'''
+
+    outdir=tempfile.mkdtemp(prefix='out',dir=workdir)
+    resultfile=os.path.join(workdir,'result.json')
+    cmd=[sys.executable,os.path.abspath(__file__),'--stage',stage,\
+            '--dbfile',dbfile,'--outdir',outdir,'--result',resultfile,\
+            '-j',str(args.jobs),'-t',str(args.tagjobs),\
+            '-m',args.exportmode]
+    try:
+        subprocess.check_call(cmd)
+        with open(resultfile,'r') as fin:
+            return json.load(fin)
+    finally:
+        shutil.rmtree(outdir,ignore_errors=True)
+        if os.path.exists(resultfile):
+            os.remove(resultfile)
+
+
+def compare(results,baseline,tolerance):
+    '''Print stages slower than in <baseline>, return their names'''
+
+    slower=[]
+    print('\nCompared to baseline (%s):' %baseline.get('time','?'))
+    for stage in STAGES:
+        new=results['stages'].get(stage)
+        old=baseline.get('stages',{}).get(stage)
+        if not new or not old or not old.get('rows_per_s'):
+            continue
+        ratio=new['rows_per_s']/old['rows_per_s']
+        flag=''
+        if ratio<1-tolerance:
+            flag='  <-- slower'
+            slower.append(stage)
+        print('%-14s %6.2fx rows/s%s' %(stage,ratio,flag))
+
+    return slower
+
+
+def printResults(results):
+    print('%-14s %10s %12s %10s %12s' %('stage','seconds','rows/s','MB/s',\
+            'peak RSS MB'))
+    for stage in STAGES:
+        rr=results['stages'].get(stage)
+        if rr is None:
+            continue
+        mbs='%.1f' %rr['mb_per_s'] if rr['mb_per_s'] else '-'
+        rss='%.1f' %(rr['peak_rss_kb']/1024.) if rr['peak_rss_kb'] else '-'
+        print('%-14s %10.3f %12.0f %10s %12s' %(stage,rr['seconds'],\
+                rr['rows_per_s'] or 0,mbs,rss))
+
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser(description=\
+            'End-to-end benchmark of the export of a synthetic library.')
+    parser.add_argument('-n','--rows',dest='rows',type=int,default=1000,\
+            help='Number of tracks.')
+    parser.add_argument('-a','--albums',dest='albums',type=int,default=20,\
+            help='Number of albums.')
+    parser.add_argument('-s','--size',dest='size',type=int,default=128,\
+            help='Mean size of each track in KB.')
+    parser.add_argument('--incomplete',dest='incomplete',type=float,\
+            default=0.05,help='Fraction of incomplete downloads.')
+    parser.add_argument('-j','--jobs',dest='jobs',type=int,default=1,\
+            help='Number of export threads.')
+    parser.add_argument('-t','--tag-jobs',dest='tagjobs',type=int,\
+            default=0,help='Number of tag processes, for the main stage.')
+    parser.add_argument('-m','--export-mode',dest='exportmode',\
+            default='copy',help='Export mode.')
+    parser.add_argument('-r','--repeat',dest='repeat',type=int,default=1,\
+            help='Runs per stage, the best is kept.')
+    parser.add_argument('--stages',dest='stages',nargs='+',\
+            choices=STAGES,default=STAGES,help='Stages to run.')
+    parser.add_argument('-o','--output',dest='output',default=None,\
+            help='Save results to this JSON file.')
+    parser.add_argument('--baseline',dest='baseline',default=None,\
+            help='JSON results of a previous run to compare to.')
+    parser.add_argument('--tolerance',dest='tolerance',type=float,\
+            default=0.2,help='Allowed loss of rows/s against the baseline.')
+    parser.add_argument('--workdir',dest='workdir',default=None,\
+            help='Folder to build the library in, kept after the run.')
+
+    #--------------Internal: run one stage--------------
+    parser.add_argument('--stage',dest='stage',choices=STAGES,\
+            help=argparse.SUPPRESS)
+    parser.add_argument('--dbfile',dest='dbfile',help=argparse.SUPPRESS)
+    parser.add_argument('--outdir',dest='outdir',help=argparse.SUPPRESS)
+    parser.add_argument('--result',dest='result',help=argparse.SUPPRESS)
+    args=parser.parse_args()
+
+    if args.stage is not None:
+        runStage(args)
+        sys.exit(0)
+
+    workdir=args.workdir or tempfile.mkdtemp(prefix='ximabench')
+    libdir=os.path.join(workdir,'library')
+    stub=HTTPStub(os.path.join(libdir,'srv'))
+    try:
+        print('Building library: %d tracks in %d albums, %d KB each'\
+                %(args.rows,args.albums,args.size))
+        info=makeLibrary(libdir,args.rows,args.albums,args.size*1024,\
+                args.incomplete,stub.url)
+        stub.start()
+
+        results={'time': time.strftime('%Y-%m-%d %H:%M:%S'),\
+                'version': ximaexport.__version__,\
+                'python': platform.python_version(),\
+                'platform': platform.platform(),\
+                'library': {'rows': info['rows'], 'albums': info['albums'],\
+                    'bytes': info['bytes'], 'downloaded': info['downloaded']},\
+                'options': {'jobs': args.jobs, 'tagjobs': args.tagjobs,\
+                    'exportmode': args.exportmode, 'repeat': args.repeat},\
+                'stages': {}}
+
+        for stage in args.stages:
+            runs=[spawnStage(stage,info['dbfile'],workdir,args)\
+                    for ii in range(max(1,args.repeat))]
+            results['stages'][stage]=min(runs,key=lambda x: x['seconds'])
+        results['http']={'requests': stub.requests, 'bytes': stub.sent}
+
+        printResults(results)
+        if args.output is not None:
+            with open(args.output,'w') as fout:
+                json.dump(results,fout,indent=2,sort_keys=True)
+            print('Results saved to %s' %args.output)
+
+        slower=[]
+        if args.baseline is not None:
+            with open(args.baseline,'r') as fin:
+                slower=compare(results,json.load(fin),args.tolerance)
+    finally:
+        stub.stop()
+        if args.workdir is None:
+            shutil.rmtree(workdir,ignore_errors=True)
+
+    sys.exit(1 if slower else 0)
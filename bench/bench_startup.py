@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Benchmark of the startup time of the CLI and GUI entry points.
+
+Each case is run in a fresh interpreter, several times, and the median
+wall time is reported:
+    cli --help:  python ximaexport.py --help
+    import cli:  import ximaexport
+    import gui:  load ximaexport-gui.py without running its main()
+
+The slowest imports of each case are listed too. On Python 3.7+ they are
+read from the "-X importtime" report. Older interpreters have no such
+option, then the imports are timed by a hook on __import__, whose times
+are cumulative (an import includes the ones it triggers).
+
+Usage:
+    python bench/bench_startup.py [-r REPEAT] [-k TOP] [--python PYTHON]
+
+Update time: 2016-09-16 10:22:08.
+'''
+
+import sys,os
+import time
+import json
+import argparse
+import subprocess
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES=[
+    ('cli --help', [os.path.join(ROOT,'ximaexport.py'),'--help']),
+    ('import cli', ['-c','import ximaexport']),
+    ('import gui', ['-c','import runpy; runpy.run_path("ximaexport-gui.py")']),
+    ]
+
+#-----Run <target> with __import__ timed, print the times as json-----
+HOOK='''
+import sys,time,json
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+times={}
+_import=builtins.__import__
+def timedImport(name,*args,**kwargs):
+    new=name not in sys.modules
+    t0=time.time()
+    try:
+        return _import(name,*args,**kwargs)
+    finally:
+        if new and name in sys.modules:
+            times[name]=max(times.get(name,0),time.time()-t0)
+builtins.__import__=timedImport
+sys.argv=%r
+try:
+    if sys.argv[0]=='-c':
+        exec(sys.argv[1])
+    else:
+        exec(compile(open(sys.argv[0]).read(),sys.argv[0],'exec'),\\
+                {'__name__': '__main__', '__file__': sys.argv[0]})
+except SystemExit:
+    pass
+builtins.__import__=_import
+sys.stderr.write('IMPORTTIMES'+json.dumps(times)+'\\n')
+'''
+
+
+
+def pythonVersion(python):
+    out=subprocess.check_output([python,'-c',\
+            'import sys; print("%d %d" %sys.version_info[:2])'])
+    return tuple(int(ii) for ii in out.split())
+
+
+def runOnce(python,args):
+    '''Wall time of running <args> in a new interpreter
+
+    The exit status is not checked: "ximaexport.py --help" exits with 1.
+    '''
+    with open(os.devnull,'w') as devnull:
+        t0=time.time()
+        subprocess.call([python]+args,cwd=ROOT,stdout=devnull,\
+                stderr=devnull)
+        return time.time()-t0
+
+
+def parseImportTime(text):
+    '''Self times in s of the modules in a "-X importtime" report'''
+    times={}
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields=line[len('import time:'):].split('|')
+        try:
+            times[fields[2].strip()]=int(fields[0])*1e-6
+        except (ValueError,IndexError):
+            continue
+    return times
+
+
+def importTimes(python,version,args):
+    '''Times in s of the imports of a run of <args>, by module'''
+    if version>=(3,7):
+        cmd=[python,'-X','importtime']+args
+    else:
+        cmd=[python,'-c',HOOK %args]
+    proc=subprocess.Popen(cmd,cwd=ROOT,stdout=subprocess.PIPE,\
+            stderr=subprocess.PIPE)
+    out,err=proc.communicate()
+    err=err.decode('utf8','replace')
+    if version>=(3,7):
+        return parseImportTime(err)
+    for line in err.splitlines():
+        if line.startswith('IMPORTTIMES'):
+            return json.loads(line[len('IMPORTTIMES'):])
+    return {}
+
+
+def median(values):
+    values=sorted(values)
+    nn=len(values)
+    if nn%2==1:
+        return values[nn//2]
+    return (values[nn//2-1]+values[nn//2])/2.
+
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser(description=\
+            'Benchmark the startup time of ximaexport.')
+    parser.add_argument('-r','--repeat',type=int,default=5,\
+            help='Runs per case.')
+    parser.add_argument('-k','--top',type=int,default=5,\
+            help='Number of slowest imports listed per case.')
+    parser.add_argument('--python',type=str,default=sys.executable,\
+            help='Interpreter to benchmark.')
+    args=parser.parse_args()
+
+    version=pythonVersion(args.python)
+    if version>=(3,7):
+        source='-X importtime, self time'
+    else:
+        source='__import__ hook, cumulative'
+    print('Python %d.%d: %s' %(version[0],version[1],args.python))
+    base=median([runOnce(args.python,['-c','pass'])\
+            for ii in range(args.repeat)])
+    print('%-12s %8.1f ms' %('bare',base*1e3))
+
+    for label,cmd in CASES:
+        dt=median([runOnce(args.python,cmd) for ii in range(args.repeat)])
+        print('%-12s %8.1f ms' %(label,dt*1e3))
+        times=importTimes(args.python,version,cmd)
+        top=sorted(times.items(),key=lambda x: x[1],reverse=True)
+        for name,tii in top[:args.top]:
+            print('    %-28s %8.1f ms  (%s)' %(name,tii*1e3,source))
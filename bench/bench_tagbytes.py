@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Benchmark of bytes written per exported and tagged track.
+
+Compares copying a track then tagging it in place (shutil.copy2() +
+writeMeta(), the old export path), against exportTagged(), which tags the
+audio in memory and writes the exported file once.
+
+Bytes written are read from the "write_bytes" counter of /proc/self/io,
+so this only reports them on Linux. Time per track is reported everywhere.
+The counter only counts a page once while it is dirty in the page cache,
+so re-writing a freshly copied file is mostly absorbed by the cache.
+With --sync, every step is flushed to disk, as happens on large exports
+where the copy is written back before it is tagged, and the counter shows
+the bytes that reach the disk.
+
+Usage:
+    python bench/bench_tagbytes.py [-n TRACKS] [-s SIZE_KB] [--sync]
+
+Update time: 2016-08-16 09:55:17.
+'''
+
+import sys,os
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ximaexport
+from fixtures import makeMP4
+
+
+
+def ioWritten():
+    '''Bytes written by this process so far, None if unknown'''
+    try:
+        with open('/proc/self/io','r') as fin:
+            for line in fin:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except IOError:
+        return None
+
+
+def sync(path):
+    with open(path,'rb+') as fout:
+        os.fsync(fout.fileno())
+
+
+def oldExport(src,dst,meta,dosync):
+    shutil.copy2(src,dst)
+    if dosync:
+        sync(dst)
+    ximaexport.writeMeta(dst,meta)
+    if dosync:
+        sync(dst)
+
+
+def newExport(src,dst,meta,dosync):
+    ximaexport.exportTagged(src,dst,meta,'copy')
+    if dosync:
+        sync(dst)
+
+
+def run(func,srcs,outdir,meta,dosync):
+    w0=ioWritten()
+    t0=time.time()
+    for ii,srcii in enumerate(srcs):
+        func(srcii,os.path.join(outdir,'%d.mp4' %ii),meta,dosync)
+    dt=time.time()-t0
+    w1=ioWritten()
+    written=None if w0 is None else w1-w0
+    return dt,written
+
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser(description=\
+            'Measure bytes written per exported and tagged track.')
+    parser.add_argument('-n','--tracks',dest='tracks',type=int,default=50,\
+            help='Number of tracks.')
+    parser.add_argument('-s','--size',dest='size',type=int,default=4096,\
+            help='Size of each track in KB.')
+    parser.add_argument('--sync',dest='sync',action='store_true',\
+            default=False, help='Flush each step to disk.')
+    args=parser.parse_args()
+
+    if not ximaexport.hasMutagen():
+        print('mutagen is required for this benchmark.')
+        sys.exit(1)
+
+    tmpdir=tempfile.mkdtemp(prefix='ximabench')
+    try:
+        srcdir=os.path.join(tmpdir,'src')
+        os.makedirs(srcdir)
+        srcs=[]
+        for ii in range(args.tracks):
+            srcii=os.path.join(srcdir,'%d' %ii)
+            with open(srcii,'wb') as fout:
+                fout.write(makeMP4(args.size*1024))
+            srcs.append(srcii)
+
+        coverfile=os.path.join(tmpdir,'cover.jpg')
+        with open(coverfile,'wb') as fout:
+            fout.write(b'\xff\xd8\xff\xe0'+b'\x00'*60000)
+        meta={'\xa9nam': u'Title', '\xa9ART': u'Artist',\
+                '\xa9alb': u'Album', 'cover': ximaexport.loadCover(coverfile)}
+
+        print('Tracks: %d x %d KB' %(args.tracks,args.size))
+        for label,func in [('copy + tag in place',oldExport),\
+                ('single pass',newExport)]:
+            outdir=tempfile.mkdtemp(dir=tmpdir)
+            dt,written=run(func,srcs,outdir,meta,args.sync)
+            if written is None:
+                wstr='n/a'
+            else:
+                wstr='%.1f KB' %(written/1024./args.tracks)
+            print('%-22s written/track: %12s   time/track: %.2f ms'\
+                    %(label,wstr,dt/args.tracks*1e3))
+            shutil.rmtree(outdir)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Microbenchmark of the per-track overhead in processAlbum().
+
+Compares reading track fields with seldf.iloc[ii].<field> per track and
+field (the old loop), against getTracks() and trackNames() which build
+records and file names once per album.
+
+Usage:
+    python bench/bench_tracks.py [-n ROWS] [-r REPEAT]
+
+Update time: 2016-07-27 10:21:05.
+'''
+
+import sys,os
+import time
+import argparse
+import pandas as pd
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ximaexport
+
+
+
+#---------------Build an album dataframe of <n> rows---------------
+def makeAlbum(n):
+    rows=[]
+    for ii in range(n):
+        rows.append((ii+1, u'Track %d: part?' %ii, 1000+ii, u'Artist/%d' %ii,\
+            10, 600, 1468000000+ii, u'http://example.com/%d.m4a' %ii,\
+            u'http://example.com/%d.aac' %ii, 5000000, 5000000,\
+            u'%032x' %ii, 1, u'Album', u'http://example.com/cover.jpg'))
+
+    return pd.DataFrame(data=rows,columns=ximaexport.FIELDS)
+
+
+def oldLoop(seldf):
+    '''Per-track field access and name building, as processAlbum used to'''
+    result=[]
+    for ii in range(len(seldf)):
+        title=seldf.iloc[ii].title
+        artist=seldf.iloc[ii].artist
+        downloaded=seldf.iloc[ii].downloaded
+        totalBytes=seldf.iloc[ii].totalBytes
+        downloadurl1=seldf.iloc[ii].downloadUrl
+        downloadurl2=seldf.iloc[ii].downloadAacUrl
+        filepath=seldf.iloc[ii].filepath
+        newname="%s-%s.mp4" %(title,artist)
+        newname=ximaexport.REPATTERN.sub(' ',newname)
+        result.append((newname,filepath,downloaded,totalBytes,\
+                downloadurl1,downloadurl2))
+    return result
+
+
+def newLoop(seldf):
+    '''Records and names built once per album'''
+    result=[]
+    tracks=ximaexport.getTracks(seldf)
+    newnames=ximaexport.trackNames(seldf)
+    for track,newname in zip(tracks,newnames):
+        result.append((newname,track.filepath,track.downloaded,\
+                track.totalBytes,track.downloadUrl,track.downloadAacUrl))
+    return result
+
+
+def timeit(func,arg,repeat):
+    best=None
+    for ii in range(repeat):
+        t0=time.time()
+        func(arg)
+        dt=time.time()-t0
+        best=dt if best is None else min(best,dt)
+    return best
+
+
+
+if __name__=='__main__':
+
+    parser=argparse.ArgumentParser(description=\
+            'Time the per-track overhead of processAlbum.')
+    parser.add_argument('-n','--rows',dest='rows',type=int,default=2000,\
+            help='Number of tracks in the album.')
+    parser.add_argument('-r','--repeat',dest='repeat',type=int,default=3,\
+            help='Repeat each measurement and keep the best.')
+    args=parser.parse_args()
+
+    seldf=makeAlbum(args.rows)
+    assert oldLoop(seldf)==newLoop(seldf)
+
+    told=timeit(oldLoop,seldf,args.repeat)
+    tnew=timeit(newLoop,seldf,args.repeat)
+
+    print('Tracks: %d' %args.rows)
+    print('iloc per field:   %8.2f us/track' %(told/args.rows*1e6))
+    print('records + names:  %8.2f us/track' %(tnew/args.rows*1e6))
+    print('Speedup:          %8.1fx' %(told/max(tnew,1e-9)))
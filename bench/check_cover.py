@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Check of the re-validation of cached album covers, against the stub.
+
+A cover is got 3 times from bench/httpstub.py, by caches with maxage=0
+so every call asks the server:
+    first:    downloaded and cached.
+    rerun:    answered 304 by the server, not downloaded again.
+    changed:  the cover changed on the server, downloaded again.
+
+Usage:
+    python bench/check_cover.py
+
+Update time: 2016-10-16 10:40:05.
+'''
+
+import sys,os
+import time
+import shutil
+import tempfile
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+from lib.cover import CoverCache
+from httpstub import HTTPStub
+
+
+
+def readFile(path):
+    with open(path,'rb') as fin:
+        return fin.read()
+
+
+def writeCover(path,data,mtime):
+    with open(path,'wb') as fout:
+        fout.write(data)
+    os.utime(path,(mtime,mtime))
+
+
+def checkCover(tmpdir,stub):
+    '''Get a cover 3 times, return the list of errors'''
+
+    srcpath=os.path.join(stub.root,'cover.jpg')
+    cachedir=os.path.join(tmpdir,'covers')
+    url='%s/cover.jpg' %stub.url
+    errors=[]
+
+    def get(label,data,requests,notmodified,sent):
+        # a new cache each time, as a new run of the export would
+        cache=CoverCache(cachedir,maxage=0)
+        path=cache.get(url)
+        got=(stub.requests,stub.notmodified,stub.sent)
+        if path is None or readFile(path)!=data:
+            errors.append('%s: wrong cover in the cache' %label)
+        if got!=(requests,notmodified,sent):
+            errors.append('%s: requests, 304s, bytes sent %s, expected %s'\
+                    %(label,got,(requests,notmodified,sent)))
+        print('%-8s %s' %(label,'FAILED' if errors else 'ok'))
+
+    old=b'\xff\xd8 old cover'*1000
+    writeCover(srcpath,old,time.time()-3600)
+    get('first',old,1,0,len(old))
+    get('rerun',old,2,1,len(old))
+
+    new=b'\xff\xd8 new cover'*1200
+    writeCover(srcpath,new,time.time())
+    get('changed',new,3,1,len(old)+len(new))
+
+    return errors
+
+
+
+if __name__=='__main__':
+
+    tmpdir=tempfile.mkdtemp(prefix='ximaexport')
+    servedir=os.path.join(tmpdir,'serve')
+    os.makedirs(servedir)
+    stub=HTTPStub(servedir).start()
+    try:
+        errors=checkCover(tmpdir,stub)
+    finally:
+        stub.stop()
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+    for ee in errors:
+        print(ee)
+    sys.exit(1 if errors else 0)
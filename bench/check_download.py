@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Check of the resumed downloads of incomplete audios, against the stub.
+
+Downloader.resume() completes a partial file from bench/httpstub.py:
+    range:     server resumes with 206, only the missing bytes are sent.
+    no range:  server ignores Range and answers 200, the download starts
+               over and must not be appended to the partial bytes.
+    complete:  partial file already complete, server answers 416.
+    mismatch:  size of the file differs from the expected total,
+               DownloadError is raised.
+
+Usage:
+    python bench/check_download.py
+
+Update time: 2016-10-16 11:26:50.
+'''
+
+import sys,os
+import struct
+import shutil
+import tempfile
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+from lib.download import Downloader, DownloadError
+from httpstub import HTTPStub
+
+SIZE=300000
+
+#-----Payload pattern of prime length, so a shifted offset shows-----
+DATA=(b''.join([struct.pack('B',ii) for ii in range(251)])*(SIZE//251+1))[:SIZE]
+
+#----label, bytes already downloaded, expected total, server ranges----
+CASES=[
+    ('range', SIZE//3, SIZE, True),
+    ('no range', SIZE//3, SIZE, False),
+    ('complete', SIZE, SIZE, True),
+    ('mismatch', SIZE//3, SIZE+1, True),
+    ]
+
+
+
+def readFile(path):
+    with open(path,'rb') as fin:
+        return fin.read()
+
+
+def checkCase(tmpdir,stub,label,offset,total,ranges):
+    '''Resume one download, return the list of errors'''
+
+    partial=os.path.join(tmpdir,'partial')
+    dest=os.path.join(tmpdir,'dest.m4a')
+    with open(partial,'wb') as fout:
+        fout.write(DATA[:offset])
+    if os.path.exists(dest):
+        os.remove(dest)
+
+    stub.ranges=ranges
+    sent0=stub.sent
+    downloader=Downloader()
+    errors=[]
+    try:
+        size=downloader.resume(['%s/audio.m4a' %stub.url],partial,dest,total)
+    except DownloadError as e:
+        size=None
+        if total==SIZE:
+            errors.append('%s: %s' %(label,e))
+    finally:
+        downloader.close()
+    sent=stub.sent-sent0
+
+    if total!=SIZE:
+        if size is not None:
+            errors.append('%s: size %d of %d accepted' %(label,size,total))
+        return errors
+
+    if size!=SIZE or readFile(dest)!=DATA:
+        errors.append('%s: wrong file downloaded, size %s' %(label,size))
+    if readFile(partial)!=DATA[:offset]:
+        errors.append('%s: partial file modified' %label)
+    expected=SIZE-offset if ranges else SIZE
+    if sent!=expected:
+        errors.append('%s: %d bytes sent, expected %d' %(label,sent,expected))
+    return errors
+
+
+
+if __name__=='__main__':
+
+    tmpdir=tempfile.mkdtemp(prefix='ximaexport')
+    servedir=os.path.join(tmpdir,'serve')
+    os.makedirs(servedir)
+    with open(os.path.join(servedir,'audio.m4a'),'wb') as fout:
+        fout.write(DATA)
+    stub=HTTPStub(servedir).start()
+    try:
+        errors=[]
+        for case in CASES:
+            errorsii=checkCase(tmpdir,stub,*case)
+            print('%-9s %s' %(case[0],'FAILED' if errorsii else 'ok'))
+            errors.extend(errorsii)
+    finally:
+        stub.stop()
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+    for ee in errors:
+        print(ee)
+    sys.exit(1 if errors else 0)
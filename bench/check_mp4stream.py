@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+'''
+Check of the tags written while streaming, against mutagen in place.
+
+For MP4 files with a chunk offset table, in the moov-first and the
+moov-last layouts, each file is exported twice:
+    in place:  copied, then tagged by writeMeta().
+    streamed:  tagged on the way by exportTagged() (lib.mp4stream), or
+               added to a zip archive by archiveTagged().
+Both must give the same bytes, and every "stco" offset of the output
+must point to the same audio data as in the source.
+
+Usage:
+    python bench/check_mp4stream.py
+
+Update time: 2016-10-14 11:05:39.
+'''
+
+import sys,os
+import struct
+import shutil
+import zipfile
+import tempfile
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+import ximaexport
+from lib.archive import Archive
+from fixtures import makeMP4
+
+#-----Payload pattern of prime length, so a shifted offset shows-----
+SEED=b''.join([struct.pack('B',ii) for ii in range(251)])
+
+META={'\xa9nam': u'标题 title', '\xa9ART': u'artist',\
+        '\xa9alb': u'album', 'comments': 'check'}
+
+CASES=[
+    ('moov first', dict(chunks=4)),
+    ('moov last', dict(chunks=4,moovlast=True)),
+    ]
+
+
+
+def chunkOffsets(data):
+    '''Offsets listed in the "stco" table of MP4 file <data>'''
+    idx=data.index(b'stco')
+    count=struct.unpack('>I',data[idx+8:idx+12])[0]
+    return list(struct.unpack('>%dI' %count,data[idx+12:idx+12+4*count]))
+
+
+def readFile(path):
+    with open(path,'rb') as fin:
+        return fin.read()
+
+
+def checkCase(tmpdir,label,kwargs):
+    '''Export one file in place and streamed, return the list of errors'''
+
+    src=os.path.join(tmpdir,'src.m4a')
+    data=makeMP4(50000,SEED,**kwargs)
+    with open(src,'wb') as fout:
+        fout.write(data)
+
+    #-----------------In place-----------------
+    inplace=os.path.join(tmpdir,'inplace.m4a')
+    shutil.copy(src,inplace)
+    ximaexport.writeMeta(inplace,META)
+    expected=readFile(inplace)
+
+    #-----------------Streamed-----------------
+    streamed=os.path.join(tmpdir,'streamed.m4a')
+    ximaexport.exportTagged(src,streamed,META,'copy')
+
+    arcpath=os.path.join(tmpdir,'out.zip')
+    archive=Archive(arcpath)
+    ximaexport.archiveTagged(src,'out.m4a',META,archive)
+    archive.close()
+    with zipfile.ZipFile(arcpath) as zf:
+        archived=zf.read('out.m4a')
+
+    errors=[]
+    for name,out in [('exportTagged',readFile(streamed)),\
+            ('archiveTagged',archived)]:
+        if out!=expected:
+            errors.append('%s: %s differs from writeMeta, offsets %s vs %s'\
+                    %(label,name,chunkOffsets(out),chunkOffsets(expected)))
+        for old,new in zip(chunkOffsets(data),chunkOffsets(out)):
+            if out[new:new+1000]!=data[old:old+1000]:
+                errors.append('%s: %s chunk at %d points to wrong data'\
+                        %(label,name,new))
+                break
+    return errors
+
+
+
+if __name__=='__main__':
+
+    if not ximaexport.hasMutagen():
+        print('mutagen is not installed, nothing to check')
+        sys.exit(0)
+
+    tmpdir=tempfile.mkdtemp(prefix='ximaexport')
+    try:
+        errors=[]
+        for label,kwargs in CASES:
+            errorsii=checkCase(tmpdir,label,kwargs)
+            print('%-12s %s' %(label,'FAILED' if errorsii else 'ok'))
+            errors.extend(errorsii)
+    finally:
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+    for ee in errors:
+        print(ee)
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,214 @@
+'''
+Synthetic test data for the benchmarks.
+
+Update time: 2016-10-17 14:05:52.
+'''
+import os
+import sys
+import struct
+import random
+import hashlib
+import sqlite3
+
+if sys.version_info[0]>=3:
+    from urllib.parse import quote
+else:
+    from urllib import quote
+
+
+
+#----------------------Minimal MP4 (AAC) files----------------------
+def _atom(name,data):
+    return struct.pack('>I',8+len(data))+name+data
+
+
+def _fullatom(name,version,flags,data):
+    return _atom(name,struct.pack('>I',(version<<24)|flags)+data)
+
+
+def makeMP4(size,seed=b'x',chunks=0,moovlast=False):
+    '''Make the bytes of a minimal MP4 audio file
+
+    <size>: int, size of the (dummy) audio payload in bytes.
+    <seed>: bytes, pattern repeated to fill the payload.
+    <chunks>: int, if > 0, split the payload into this many chunks, listed
+              in a "stco" chunk offset table, as in real files. Tagging
+              must then update the offsets.
+    <moovlast>: bool, if True, put moov after mdat (ftyp+mdat+moov), as
+                some encoders do.
+
+    Return: <data>: bytes, an ftyp+moov+mdat file with one AAC track,
+            which mutagen can read and tag.
+    '''
+
+    ftyp=_atom(b'ftyp',b'M4A \x00\x00\x00\x00M4A mp42isom')
+    mvhd=_fullatom(b'mvhd',0,0,struct.pack('>IIII',0,0,1000,10000)+b'\x00'*80)
+    tkhd=_fullatom(b'tkhd',0,7,b'\x00'*80)
+    mdhd=_fullatom(b'mdhd',0,0,struct.pack('>IIII',0,0,44100,441000)+\
+            b'\x00'*4)
+    hdlr=_fullatom(b'hdlr',0,0,b'\x00'*4+b'soun'+b'\x00'*13)
+    esds=_fullatom(b'esds',0,0,b'\x03\x19\x00\x00\x00\x04\x11\x40\x15'+\
+            b'\x00\x00\x00\x00\x01\xf4\x00\x00\x01\xf4\x00\x05\x02\x12\x10'+\
+            b'\x06\x01\x02')
+    mp4a=_atom(b'mp4a',b'\x00'*6+struct.pack('>H',1)+b'\x00'*8+\
+            struct.pack('>HHHHI',2,16,0,0,44100<<16)+esds)
+    stsd=_fullatom(b'stsd',0,0,struct.pack('>I',1)+mp4a)
+
+    def moovAtom(start):
+        '''moov, with chunks starting at file offset <start>'''
+        stbl=stsd
+        if chunks>0:
+            offsets=[start+ii*(size//chunks) for ii in range(chunks)]
+            stbl+=_fullatom(b'stco',0,0,struct.pack('>I',chunks)+\
+                    b''.join([struct.pack('>I',oo) for oo in offsets]))
+        minf=_atom(b'minf',_atom(b'stbl',stbl))
+        mdia=_atom(b'mdia',mdhd+hdlr+minf)
+        trak=_atom(b'trak',tkhd+mdia)
+        return _atom(b'moov',mvhd+trak)
+
+    nrep=size//len(seed)+1
+    mdat=_atom(b'mdat',(seed*nrep)[:size])
+
+    #-----moov has the same size whatever the offsets it lists-----
+    if moovlast:
+        return ftyp+mdat+moovAtom(len(ftyp)+8)
+    return ftyp+moovAtom(len(ftyp)+len(moovAtom(0))+8)+mdat
+
+
+
+#----------------------Synthetic Ximalaya library----------------------
+#--------Columns of download_table read by ximaexport, and their types--------
+TABLE_COLUMNS=[('title','TEXT'), ('trackId','INTEGER'), ('artist','TEXT'),\
+        ('likes','INTEGER'), ('duration','INTEGER'),\
+        ('createTime','INTEGER'), ('downloadUrl','TEXT'),\
+        ('downloadAacUrl','TEXT'), ('downloadedBytes','INTEGER'),\
+        ('totalBytes','INTEGER'), ('filepath','TEXT'), ('albumId','INTEGER'),\
+        ('albumName','TEXT'), ('albumImage','TEXT')]
+
+#---------Characters to put in titles, incl. invalid path symbols---------
+TITLE_WORDS=[u'\u7b2c', u'\u96c6', u'Part', u'Chapter', u'\u6545\u4e8b',\
+        u'Q&A', u'a/b', u'what?', u'"quoted"', u'x:y']
+
+#------One track in this many has a non-ASCII name in "Download/"------
+NONASCII_EVERY=40
+
+#------------Suffix of the non-ASCII names------------
+NONASCII_SUFFIX=u' \u97f3\u9891.m4a'
+
+
+def canEncode(text):
+    '''Check if the file system encoding can hold <text>'''
+    try:
+        text.encode(sys.getfilesystemencoding() or 'ascii')
+    except (UnicodeError,LookupError):
+        return False
+    return True
+
+
+def makeLibrary(root,rows,albums,size=128*1024,incomplete=0.05,\
+        baseurl=None,seed=0):
+    '''Build a ting.sqlite and a matching "Download" folder
+
+    <root>: str, folder to create the library in. It gets:
+            "ting.sqlite", with a download_table of <rows> rows,
+            "Download/", the downloaded audios, and
+            "srv/", the complete audios and the album covers, to be
+            served at <baseurl> (see httpstub.HTTPStub).
+    <rows>: int, number of tracks.
+    <albums>: int, number of albums. Tracks are spread unevenly over
+              the albums, as in a real library.
+    <size>: int, mean size of the audio payload of a track in bytes.
+    <incomplete>: float, fraction of tracks left incompletely downloaded.
+    <baseurl>: str or None, url serving "srv/". If None, file:// urls to
+               "srv/" are used.
+    <seed>: int, seed of the random generator, the same arguments give
+            the same library. Non-ASCII file names and titles are only
+            used if the file system encoding can hold them, as the
+            exported files are named after the titles.
+
+    Return: <info>: dict, with keys 'dbfile', 'rows', 'albums', 'bytes'
+            (total size of the complete audios) and 'downloaded' (total
+            size of files in "Download/").
+    '''
+
+    rand=random.Random(seed)
+    nonascii=canEncode(NONASCII_SUFFIX)
+    words=[ww for ww in TITLE_WORDS if nonascii or canEncode(ww)]
+    dldir=os.path.join(root,'Download')
+    srvdir=os.path.join(root,'srv')
+    for dd in (dldir,srvdir):
+        if not os.path.isdir(dd):
+            os.makedirs(dd)
+    if baseurl is None:
+        baseurl='file://'+os.path.abspath(srvdir)
+    baseurl=baseurl.rstrip('/')
+
+    dbfile=os.path.join(root,'ting.sqlite')
+    if os.path.exists(dbfile):
+        os.remove(dbfile)
+    db=sqlite3.connect(dbfile)
+    db.execute('CREATE TABLE download_table (%s)'\
+            %', '.join(['%s %s' %cc for cc in TABLE_COLUMNS]))
+
+    #--------------Uneven album sizes--------------
+    weights=[rand.paretovariate(1.5) for ii in range(albums)]
+    total=sum(weights)
+    counts=[max(1,int(rows*ww/total)) for ww in weights]
+    while sum(counts)>rows and max(counts)>1:
+        counts[counts.index(max(counts))]-=1
+    ii=0
+    while sum(counts)<rows:
+        counts[ii%albums]+=1
+        ii+=1
+
+    #--------------Album covers--------------
+    for aa in range(albums):
+        with open(os.path.join(srvdir,'cover%d.jpg' %aa),'wb') as fout:
+            fout.write(b'\xff\xd8\xff\xe0'+os.urandom(rand.randint(20,80)*1024))
+
+    totalbytes=0
+    downloaded=0
+    trackid=100000
+    for aa,countaa in enumerate(counts):
+        albumid=1000+aa
+        albumname=u'%s %d %s' %(rand.choice(words),aa,\
+                rand.choice(words))
+        artist=u'Artist %d' %(aa%max(1,albums//3))
+        image='%s/cover%d.jpg' %(baseurl,aa)
+        records=[]
+
+        for tt in range(countaa):
+            trackid+=1
+            sizett=max(1024,int(size*rand.uniform(0.5,1.5)))
+            data=makeMP4(sizett,seed=chr(65+trackid%26).encode('ascii'))
+            filepath=hashlib.md5(str(trackid).encode('ascii')).hexdigest()
+            if nonascii and trackid%NONASCII_EVERY==0:
+                filepath=filepath+NONASCII_SUFFIX
+            with open(os.path.join(srvdir,filepath),'wb') as fout:
+                fout.write(data)
+
+            #--------Incomplete downloads hold part of the file--------
+            if rand.random()<incomplete:
+                ndown=rand.randint(0,len(data)-1)
+            else:
+                ndown=len(data)
+            with open(os.path.join(dldir,filepath),'wb') as fout:
+                fout.write(data[:ndown])
+
+            title=u'%s %d %s' %(rand.choice(words),tt+1,\
+                    rand.choice(words))
+            url='%s/%s' %(baseurl,quote(filepath.encode('utf8')))
+            records.append((title,trackid,artist,rand.randint(0,5000),\
+                    sizett//4000,1460000000+trackid,url,url,ndown,\
+                    len(data),filepath,albumid,albumname,image))
+            totalbytes+=len(data)
+            downloaded+=ndown
+
+        db.executemany('INSERT INTO download_table VALUES (%s)'\
+                %', '.join(['?']*len(TABLE_COLUMNS)),records)
+
+    db.commit()
+    db.close()
+
+    return {'dbfile': dbfile, 'rows': rows, 'albums': albums,\
+            'bytes': totalbytes, 'downloaded': downloaded}
@@ -0,0 +1,161 @@
+'''
+Local HTTP server standing in for the Ximalaya servers in the benchmarks.
+
+Serves the files of a folder over keep-alive connections, with support
+of "Range: bytes=<start>-[<end>]" requests, so that downloads of
+incomplete audios can be resumed as from the real servers, and of
+conditional requests: files are sent with ETag and Last-Modified
+headers, and "If-None-Match" or "If-Modified-Since" requests for an
+unchanged file are answered 304, as for the album covers.
+
+Update time: 2016-10-16 10:12:47.
+'''
+import os
+import re
+import sys
+import threading
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+if sys.version_info[0]>=3:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+else:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+
+RANGEPATTERN=re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+
+class _Server(ThreadingMixIn,HTTPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version='HTTP/1.1'
+
+    def _error(self,code):
+        self.send_response(code)
+        self.send_header('Content-Length','0')
+        self.end_headers()
+
+    def _notModified(self,etag,mtime):
+        inm=self.headers.get('If-None-Match')
+        if inm is not None:
+            return etag in [tt.strip() for tt in inm.split(',')]
+        ims=self.headers.get('If-Modified-Since')
+        if ims:
+            parsed=parsedate_tz(ims)
+            return parsed is not None and mtime<=mktime_tz(parsed)
+        return False
+
+    def do_GET(self):
+        self.server.stub.requests+=1
+        relpath=unquote(self.path.split('?')[0]).lstrip('/')
+        path=os.path.join(self.server.stub.root,relpath)
+        if '..' in relpath.split('/') or not os.path.isfile(path):
+            return self._error(404)
+
+        stat=os.stat(path)
+        size=stat.st_size
+        etag='"%x-%x"' %(size,int(stat.st_mtime))
+        modified=formatdate(int(stat.st_mtime),usegmt=True)
+
+        #-------------------Conditional request-------------------
+        if self._notModified(etag,int(stat.st_mtime)):
+            self.server.stub.notmodified+=1
+            self.send_response(304)
+            self.send_header('ETag',etag)
+            self.send_header('Last-Modified',modified)
+            self.end_headers()
+            return
+
+        start,end=0,size-1
+        rangeheader=self.headers.get('Range')
+        if not self.server.stub.ranges:
+            # server ignoring Range, sends the whole file
+            rangeheader=None
+        if rangeheader:
+            match=RANGEPATTERN.match(rangeheader.strip())
+            if match is None or match.group(1)=='':
+                return self._error(416)
+            start=int(match.group(1))
+            if match.group(2):
+                end=min(end,int(match.group(2)))
+            if start>=size or start>end:
+                return self._error(416)
+            self.send_response(206)
+            self.send_header('Content-Range','bytes %d-%d/%d'\
+                    %(start,end,size))
+        else:
+            self.send_response(200)
+
+        length=end-start+1
+        self.send_header('Content-Length',str(length))
+        self.send_header('Content-Type','application/octet-stream')
+        self.send_header('ETag',etag)
+        self.send_header('Last-Modified',modified)
+        self.end_headers()
+        with open(path,'rb') as fin:
+            fin.seek(start)
+            left=length
+            while left>0:
+                chunk=fin.read(min(256*1024,left))
+                if not chunk:
+                    break
+                # counted first, so the client can't get ahead of it
+                self.server.stub.sent+=len(chunk)
+                self.wfile.write(chunk)
+                left-=len(chunk)
+
+    def log_message(self,*args):
+        pass
+
+
+
+class HTTPStub(object):
+    '''Serve a folder on localhost in a background thread
+
+    <root>: str, folder to serve.
+    <port>: int, port to listen on, 0 to pick a free one.
+
+    Set <ranges> to False to ignore Range headers, answering 200 with the
+    whole file as some servers do. <requests>, <notmodified> and <sent>
+    count the requests, the 304 replies and the bytes of file sent.
+
+    The server starts listening on creation, so url can be used right
+    away, e.g. to build the library it serves. Call start() to begin
+    answering requests and stop() to shut it down.
+    '''
+
+    def __init__(self,root,port=0):
+        self.root=os.path.abspath(root)
+        self.ranges=True
+        self.requests=0
+        self.notmodified=0
+        self.sent=0
+        self._server=_Server(('127.0.0.1',port),_Handler)
+        self._server.stub=self
+        self._thread=None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' %self._server.server_address[1]
+
+    def start(self):
+        self._thread=threading.Thread(target=self._server.serve_forever,\
+                name='httpstub')
+        self._thread.daemon=True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread=None
+        self._server.server_close()
@@ -0,0 +1,150 @@
+'''
+Export to a zip or tar archive, instead of a folder.
+
+Files are streamed into the archive from file objects, e.g. a
+TaggedStream of lib.mp4stream, so the exported tracks are never written
+to disk. Entries are stored without compression, as the AAC audio is
+already compressed. Zip archives use the Zip64 extensions when needed,
+tar archives the pax format, for large and unicode entries.
+
+Before Python 3.6, zipfile can't write an entry from a stream, and each
+zip entry is read into memory before it is written. Tar archives are
+streamed in all versions.
+
+Update time: 2016-09-27 16:40:05.
+'''
+import os
+import sys
+import time
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import threading
+from lib.iosched import adviseSequential, adviseDone
+
+ARCHIVE_FORMATS=('zip','tar')
+
+#----------------Buffer size to copy into the archive----------------
+BUFSIZE=1024*1024
+
+
+
+def archiveFormat(path):
+    '''Format of the archive <path>, from its extension
+
+    Raise: ValueError if not one of ARCHIVE_FORMATS.
+    '''
+    ext=os.path.splitext(path)[1].lower().lstrip('.')
+    if ext not in ARCHIVE_FORMATS:
+        raise ValueError('Archive must be a .zip or .tar file: %s' %path)
+    return ext
+
+
+def _text(name):
+    if isinstance(name,bytes):
+        return name.decode('utf8')
+    return name
+
+
+
+class ChunkReader(object):
+    '''File object calling <onchunk> with the number of bytes of each read'''
+
+    def __init__(self,fobj,onchunk=None):
+        self.fobj=fobj
+        self.onchunk=onchunk
+
+    def read(self,size=-1):
+        chunk=self.fobj.read(size)
+        if self.onchunk is not None and chunk:
+            self.onchunk(len(chunk))
+        return chunk
+
+
+
+class Archive(object):
+    '''Zip or tar archive the exported files are written to
+
+    <path>: str, path to a .zip or .tar file. Overwritten if exists.
+
+    Attributes: <tmpdir>: str, temp folder for the files that can't be
+                streamed, e.g. incomplete audios being downloaded.
+                Deleted by close().
+
+    add() is safe to call from the export worker threads, entries are
+    written one at a time.
+    '''
+
+    def __init__(self,path):
+        self.path=path
+        self.format=archiveFormat(path)
+        self._lock=threading.Lock()
+        if self.format=='zip':
+            self._archive=zipfile.ZipFile(path,'w',zipfile.ZIP_STORED,\
+                    allowZip64=True)
+        else:
+            self._archive=tarfile.open(path,'w',format=tarfile.PAX_FORMAT)
+        self.tmpdir=tempfile.mkdtemp(prefix='ximaexport')
+
+    def relpath(self,path):
+        '''Name in the archive of <path>, a file under <tmpdir>'''
+        return os.path.relpath(path,self.tmpdir)
+
+    def add(self,arcname,fobj,size,mtime=None):
+        '''Write <size> bytes read from file object <fobj> as <arcname>
+
+        <arcname>: str, path of the entry, relative to the archive root.
+        <fobj>: file object to read the data from.
+        <size>: int, number of bytes to read from <fobj>.
+        <mtime>: float or None, modification time of the entry. If None,
+                 use the current time.
+        '''
+
+        arcname=_text(arcname).replace(os.sep,'/')
+        if mtime is None:
+            mtime=time.time()
+
+        with self._lock:
+            if self.format=='tar':
+                tarinfo=tarfile.TarInfo(arcname)
+                tarinfo.size=size
+                tarinfo.mtime=mtime
+                tarinfo.mode=0o644
+                self._archive.addfile(tarinfo,fobj)
+                return
+
+            zipinfo=zipfile.ZipInfo(arcname,time.localtime(mtime)[:6])
+            zipinfo.compress_type=zipfile.ZIP_STORED
+            zipinfo.external_attr=0o644<<16
+            if sys.version_info>=(3,6):
+                zipinfo.file_size=size
+                with self._archive.open(zipinfo,'w') as fout:
+                    shutil.copyfileobj(fobj,fout,BUFSIZE)
+            else:
+                self._archive.writestr(zipinfo,fobj.read(size))
+
+    def addFile(self,path,arcname,onchunk=None):
+        '''Write file <path> as <arcname>
+
+        <onchunk>: callable or None, called with the number of bytes of
+                   each chunk read. It may raise to abort.
+        '''
+        st=os.stat(path)
+        with open(path,'rb') as fin:
+            adviseSequential(fin)
+            self.add(arcname,ChunkReader(fin,onchunk),st.st_size,st.st_mtime)
+            adviseDone(fin)
+
+    def close(self,remove=False):
+        '''Finish the archive
+
+        <remove>: bool, if True, delete the archive, e.g. if incomplete.
+        '''
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive=None
+        shutil.rmtree(self.tmpdir,ignore_errors=True)
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
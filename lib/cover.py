@@ -0,0 +1,176 @@
+'''
+On-disk cache of album cover images.
+
+Covers are keyed by their url. Each cached image <key>.img is stored
+with a <key>.json sidecar holding the url, ETag and Last-Modified headers
+and the time it was last validated. Stale covers are re-validated with a
+conditional request, so an unchanged cover is not downloaded again. The
+cache is capped in size, evicting the least recently used covers.
+
+Update time: 2016-08-09 16:55:02.
+'''
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+
+if sys.version_info[0]>=3:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+else:
+    from urllib2 import Request, urlopen, HTTPError
+
+#------------------Default cache location------------------
+COVER_CACHE_DIR=os.path.join(os.path.expanduser('~'),'.ximaexport','covers')
+
+#--------------Default cap of cache size, in bytes--------------
+COVER_CACHE_SIZE=200*1024*1024
+
+#------Seconds a cached cover is used without re-validating it------
+COVER_MAX_AGE=24*3600
+
+#-------------------Timeout of requests-------------------
+TIMEOUT=30
+
+
+
+class CoverCache(object):
+    '''Cache of album cover images
+
+    <cachedir>: str, folder to save cached images to.
+    <maxsize>: int, max total size of cached images in bytes.
+    <maxage>: int, seconds a cover is used without asking the server
+              if it changed.
+    '''
+
+    def __init__(self,cachedir=COVER_CACHE_DIR,maxsize=COVER_CACHE_SIZE,\
+            maxage=COVER_MAX_AGE):
+        self.cachedir=cachedir
+        self.maxsize=maxsize
+        self.maxage=maxage
+        self._lock=threading.Lock()
+
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def _paths(self,url):
+        key=hashlib.sha1(url.encode('utf8')).hexdigest()
+        imgpath=os.path.join(self.cachedir,key+'.img')
+        metapath=os.path.join(self.cachedir,key+'.json')
+        return imgpath,metapath
+
+    def _readMeta(self,metapath):
+        try:
+            with open(metapath,'r') as fin:
+                return json.load(fin)
+        except (IOError,ValueError):
+            return None
+
+    def _writeMeta(self,metapath,meta):
+        with open(metapath,'w') as fout:
+            json.dump(meta,fout)
+
+    def get(self,url):
+        '''Get the path to the cached cover of <url>
+
+        <url>: str, url of the cover image.
+
+        Return: <path>: str, path to the cached image, or None if it could
+                not be downloaded and is not in the cache.
+
+        The lock is only held to read and write the cache folder, not
+        during requests, so a slow server does not hold up the covers of
+        other albums.
+        '''
+
+        if not url:
+            return None
+
+        imgpath,metapath=self._paths(url)
+        with self._lock:
+            meta=self._readMeta(metapath)
+            cached=meta is not None and os.path.exists(imgpath)
+
+            #-------------Fresh enough, no request at all-------------
+            if cached and time.time()-meta.get('checked',0)<self.maxage:
+                self._touch(imgpath)
+                return imgpath
+
+        #----------------Conditional request----------------
+        request=Request(url)
+        if cached:
+            if meta.get('etag'):
+                request.add_header('If-None-Match',meta['etag'])
+            if meta.get('modified'):
+                request.add_header('If-Modified-Since',meta['modified'])
+
+        try:
+            response=urlopen(request,timeout=TIMEOUT)
+            data=response.read()
+            headers=response.info()
+            response.close()
+        except HTTPError as e:
+            if e.code==304 and cached:
+                with self._lock:
+                    meta['checked']=time.time()
+                    self._writeMeta(metapath,meta)
+                    self._touch(imgpath)
+                return imgpath
+            return imgpath if cached else None
+        except Exception:
+            # offline, keep using the cached copy
+            return imgpath if cached else None
+
+        with self._lock:
+            tmppath=imgpath+'.tmp'
+            with open(tmppath,'wb') as fout:
+                fout.write(data)
+            if os.path.exists(imgpath):
+                os.remove(imgpath)
+            os.rename(tmppath,imgpath)
+
+            meta={'url': url, 'etag': headers.get('ETag'),\
+                    'modified': headers.get('Last-Modified'),\
+                    'checked': time.time()}
+            self._writeMeta(metapath,meta)
+
+            self._evict(keep=imgpath)
+
+        return imgpath
+
+    def _touch(self,path):
+        try:
+            os.utime(path,None)
+        except OSError:
+            pass
+
+    def _evict(self,keep=None):
+        '''Remove least recently used covers until below maxsize'''
+
+        entries=[]
+        total=0
+        for ff in os.listdir(self.cachedir):
+            if not ff.endswith('.img'):
+                continue
+            pathii=os.path.join(self.cachedir,ff)
+            try:
+                stat=os.stat(pathii)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime,stat.st_size,pathii))
+            total+=stat.st_size
+
+        entries.sort()
+        for mtime,size,pathii in entries:
+            if total<=self.maxsize:
+                break
+            if pathii==keep:
+                continue
+            for pp in (pathii,pathii[:-4]+'.json'):
+                try:
+                    os.remove(pp)
+                except OSError:
+                    pass
+            total-=size
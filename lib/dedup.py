@@ -0,0 +1,303 @@
+'''
+Content-hash deduplication of the source files of an export.
+
+The same audio is often found more than once in the database, from
+re-downloads or albums listed twice. Source files are compared in three
+steps, each only for the files still colliding after the previous one:
+    1. size, from the index of the "Download" folder, no file is read.
+    2. partial hash: sha1 of the first and last PARTIAL_SIZE bytes.
+    3. full hash: sha1 of the whole file.
+Files referred to by several tracks are duplicates without hashing.
+
+Hashes are cached in a json file, keyed by the path of the file and
+only valid for the same size and mtime, so later runs do not read the
+files again.
+
+Update time: 2016-09-20 15:06:47.
+'''
+import os
+import sys
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from lib.fileops import exportFile
+from lib.journal import partName, commitFile
+
+#-------------------What to do with duplicates-------------------
+DEDUP_MODES=['off','link','report']
+
+#------------------Default location of the hash cache------------------
+HASH_CACHE_FILE=os.path.join(os.path.expanduser('~'),'.ximaexport',\
+        'hashes.json')
+
+#----------Bytes hashed at each end of a file for the partial hash----------
+PARTIAL_SIZE=64*1024
+
+HASH_BUFSIZE=1024*1024
+
+#------------Report of duplicates, saved in the output folder------------
+REPORT_NAME='ximaexport-duplicates.json'
+
+
+
+def _key(path):
+    '''Path as unicode, the type of the keys read from json'''
+    if isinstance(path,bytes):
+        return path.decode(sys.getfilesystemencoding() or 'utf8','replace')
+    return path
+
+
+
+class HashCache(object):
+    '''Persistent cache of file hashes
+
+    <path>: str, json file to save the cache to.
+
+    Entries are keyed by file path, and hold [size, mtime, partial, full].
+    A hash is only returned if the file still has the same size and mtime.
+    Methods are safe to call from several threads.
+    '''
+
+    def __init__(self,path=HASH_CACHE_FILE):
+        self.path=path
+        self.entries={}
+        self.hits=0
+        self.misses=0
+        self._lock=threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path,'r') as fin:
+                self.entries=json.load(fin)
+        except (IOError,ValueError):
+            self.entries={}
+
+    def save(self):
+        '''Write the cache, dropping entries of files that are gone'''
+        with self._lock:
+            entries=dict([(kk,vv) for kk,vv in self.entries.items()\
+                    if os.path.exists(kk)])
+        try:
+            folder=os.path.dirname(self.path)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            tmppath=self.path+'.tmp'
+            with open(tmppath,'w') as fout:
+                json.dump(entries,fout)
+            commitFile(tmppath,self.path)
+        except (IOError,OSError):
+            pass
+
+    def get(self,path,size,mtime,kind):
+        '''Get the cached <kind> ('partial' or 'full') hash, None if unknown'''
+        with self._lock:
+            entry=self.entries.get(_key(path))
+        if entry is None or entry[0]!=size or entry[1]!=mtime:
+            return None
+        return entry[2] if kind=='partial' else entry[3]
+
+    def put(self,path,size,mtime,kind,value):
+        with self._lock:
+            entry=self.entries.get(_key(path))
+            if entry is None or entry[0]!=size or entry[1]!=mtime:
+                entry=[size,mtime,None,None]
+                self.entries[_key(path)]=entry
+            entry[2 if kind=='partial' else 3]=value
+
+
+
+def partialHash(path,size,blocksize=PARTIAL_SIZE):
+    '''sha1 of the first and last <blocksize> bytes of a file
+
+    For files of at most 2*<blocksize> bytes, this is the sha1 of the
+    whole file, same as fullHash().
+    '''
+    hh=hashlib.sha1()
+    with open(path,'rb') as fin:
+        if size<=2*blocksize:
+            hh.update(fin.read())
+        else:
+            hh.update(fin.read(blocksize))
+            fin.seek(size-blocksize)
+            hh.update(fin.read(blocksize))
+    return hh.hexdigest()
+
+
+def fullHash(path,bufsize=HASH_BUFSIZE):
+    hh=hashlib.sha1()
+    with open(path,'rb') as fin:
+        while True:
+            chunk=fin.read(bufsize)
+            if not chunk:
+                break
+            hh.update(chunk)
+    return hh.hexdigest()
+
+
+def hashFile(path,size,mtime,kind,cache=None):
+    '''Get the <kind> ('partial' or 'full') hash of a file
+
+    Return: <hash>: str, hex digest, or None if the file can't be read.
+    '''
+
+    if cache is not None:
+        value=cache.get(path,size,mtime,kind)
+        if value is not None:
+            cache.hits+=1
+            return value
+        cache.misses+=1
+
+    # small files are hashed whole by partialHash()
+    if kind=='full' and size<=2*PARTIAL_SIZE:
+        kind='partial'
+    try:
+        if kind=='partial':
+            value=partialHash(path,size)
+        else:
+            value=fullHash(path)
+    except (IOError,OSError):
+        return None
+
+    if cache is not None:
+        cache.put(path,size,mtime,kind,value)
+        if size<=2*PARTIAL_SIZE:
+            cache.put(path,size,mtime,'full',value)
+    return value
+
+
+def _groups(items,keyfunc):
+    '''Group <items> by <keyfunc>, keeping their order'''
+    groups=OrderedDict()
+    for item in items:
+        groups.setdefault(keyfunc(item),[]).append(item)
+    return list(groups.values())
+
+
+def findDuplicates(files,cache=None):
+    '''Find files with the same content
+
+    <files>: list of (key, path, size, mtime), the first of identical
+             files is kept as the original.
+    <cache>: HashCache or None, cache of the hashes.
+
+    Return: <dups>: OrderedDict, key -> key of its original, for every
+            file identical to an earlier one, in the order of <files>.
+
+    Update time: 2016-09-20 15:06:47.
+    '''
+
+    order=dict([(ff[0],ii) for ii,ff in enumerate(files)])
+
+    def hashKey(kind):
+        def func(samefile):
+            key,path,size,mtime=samefile[0]
+            value=hashFile(path,size,mtime,kind,cache)
+            # unreadable files are never duplicates
+            return value if value is not None else (None,path)
+        return func
+
+    dups={}
+    for samesize in _groups(files,lambda x: x[2]):
+        if len(samesize)<2:
+            continue
+        #--------Same file, or candidates to hash--------
+        samefiles=_groups(samesize,lambda x: x[1])
+        identical=[]
+        if len(samefiles)==1:
+            identical.append(samefiles)
+        else:
+            for samepart in _groups(samefiles,hashKey('partial')):
+                if len(samepart)==1:
+                    identical.append(samepart)
+                else:
+                    identical.extend(_groups(samepart,hashKey('full')))
+
+        for group in identical:
+            keys=[ff[0] for samefile in group for ff in samefile]
+            keys.sort(key=order.get)
+            for kk in keys[1:]:
+                dups[kk]=keys[0]
+
+    return OrderedDict(sorted(dups.items(),key=lambda x: order[x[0]]))
+
+
+
+class DuplicateSet(object):
+    '''Duplicates of an export, linked once their originals are exported
+
+    <dups>: dict, key -> key of its original, from findDuplicates().
+
+    Methods are safe to call from the export worker threads.
+    '''
+
+    def __init__(self,dups):
+        self.dups=dups
+        self.dests={}
+        self.pending=[]
+        self._lock=threading.Lock()
+
+    def __len__(self):
+        return len(self.dups)
+
+    def add(self,key,dest,title=None):
+        '''Record the file a track is exported to
+
+        Return: True if the track is a duplicate, it is then not to be
+                exported, but linked by link() later.
+        '''
+        with self._lock:
+            self.dests[key]=dest
+            if key in self.dups:
+                self.pending.append((key,dest,title))
+                return True
+        return False
+
+    def link(self,report=False):
+        '''Link the duplicates to the exported files of their originals
+
+        <report>: bool, if True, only report the duplicates, without
+                  writing them.
+
+        Return: <results>: list of dicts, with keys 'title', 'dest',
+                'original' (exported file of the original) and 'status':
+                'linked' (hard linked), 'copied' (copied, if hard links
+                are not supported), 'reported' (<report> is True), or
+                'failed' (the original was not exported, or the link
+                failed).
+        '''
+
+        results=[]
+        for key,dest,title in self.pending:
+            original=self.dests.get(self.dups[key])
+            result={'title': title, 'dest': dest, 'original': original}
+            results.append(result)
+            if report:
+                result['status']='reported'
+                continue
+            if original is None or not os.path.exists(original):
+                result['status']='failed'
+                continue
+            try:
+                if hasattr(os.path,'samefile') and os.path.exists(dest)\
+                        and os.path.samefile(dest,original):
+                    result['status']='linked'
+                    continue
+                tmppath=partName(dest)
+                used=exportFile(original,tmppath,'hardlink')
+                commitFile(tmppath,dest)
+                result['status']='linked' if used=='hardlink' else 'copied'
+            except (IOError,OSError):
+                result['status']='failed'
+        return results
+
+
+def saveReport(results,outdir):
+    '''Save the results of DuplicateSet.link() to <outdir>/REPORT_NAME'''
+    path=os.path.join(outdir,REPORT_NAME)
+    with open(path,'w') as fout:
+        json.dump(results,fout,indent=1)
+    return path
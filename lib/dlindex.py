@@ -0,0 +1,197 @@
+'''
+Index of the files in the "Download" folder.
+
+The folder is walked once at startup, and the size, mtime and inode of
+every file are kept in a dict keyed by its path relative to the folder.
+Checking the source of a track is then a dict lookup, instead of a stat
+per track, which is slow on USB and network mounts.
+
+Update time: 2016-08-26 10:41:19.
+'''
+import os
+import sys
+
+#---------os.scandir() in python 3.5+, or the scandir backport---------
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir=None
+
+
+
+def statFile(path):
+    '''Get (size, mtime, inode) of a file, None if it does not exist'''
+    try:
+        st=os.stat(path)
+    except OSError:
+        return None
+    return st.st_size,st.st_mtime,st.st_ino
+
+
+def _text(path):
+    '''Path as unicode, as the file paths read from sqlite
+
+    Python 2 walks a folder given as bytes with bytes names, which never
+    match the unicode paths of the database if not ASCII. Left as bytes
+    if not decodable.
+    '''
+    if isinstance(path,bytes):
+        try:
+            return path.decode(sys.getfilesystemencoding() or 'utf8')
+        except UnicodeDecodeError:
+            return path
+    return path
+
+
+def normPath(relpath):
+    '''Normalize a relative path as used for keys of the index'''
+    return os.path.normpath(_text(relpath).replace('/',os.sep))
+
+
+
+class DownloadIndex(object):
+    '''Sizes, mtimes and inodes of files in the "Download" folder
+
+    <dldir>: str, path to the "Download" folder. If it does not exist,
+             the index is empty.
+
+    Attributes: <entries>: dict, relative path -> (size, mtime, inode).
+                Paths are unicode, walked from the unicode <dldir>.
+    '''
+
+    def __init__(self,dldir):
+        self.dldir=_text(dldir)
+        self.entries={}
+        if os.path.isdir(self.dldir):
+            if scandir is not None:
+                self._scan(self.dldir,u'')
+            else:
+                self._walk(self.dldir,u'')
+
+    def _scan(self,folder,prefix):
+        '''Walk with scandir(), file types come from the directory listing'''
+        subdirs=[]
+        for entry in scandir(folder):
+            try:
+                relpath=os.path.join(prefix,entry.name) if prefix\
+                        else entry.name
+                if entry.is_dir():
+                    subdirs.append((entry.path,relpath))
+                elif entry.is_file():
+                    st=entry.stat()
+                    self.entries[relpath]=(st.st_size,st.st_mtime,\
+                            entry.inode())
+            except (OSError,UnicodeError):
+                # a name not in the file system encoding, under a unicode
+                # folder on Python 2: no row of the database can match it
+                continue
+        for path,relpath in subdirs:
+            self._scan(path,relpath)
+
+    def _walk(self,folder,prefix):
+        '''Fallback walk with os.listdir() and a stat per file
+
+        Not os.walk(), which fails on names not in the file system
+        encoding under a unicode folder on Python 2.
+        '''
+        for name in os.listdir(folder):
+            try:
+                path=os.path.join(folder,name)
+                relpath=os.path.join(prefix,name) if prefix else name
+            except UnicodeError:
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                self._walk(path,relpath)
+                continue
+            stat=statFile(path)
+            if stat is not None:
+                self.entries[relpath]=stat
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stat(self,relpath):
+        '''Get (size, mtime, inode) of <relpath>, None if not in the folder'''
+        return self.entries.get(normPath(relpath))
+
+    def path(self,relpath):
+        '''Absolute path of <relpath>'''
+        return os.path.join(self.dldir,normPath(relpath))
+
+    def exists(self,relpath):
+        return normPath(relpath) in self.entries
+
+    def orphans(self,relpaths):
+        '''Files in the folder not referenced by the database
+
+        <relpaths>: iterable of str, file paths of all rows of the database.
+
+        Return: <orphans>: sorted list of relative paths.
+        '''
+        referenced=set(normPath(rr) for rr in relpaths if rr)
+        return sorted(set(self.entries)-referenced)
+
+
+
+class MultiIndex(object):
+    '''Index of the "Download" folders of several libraries
+
+    <indexes>: list of DownloadIndex.
+
+    Files are looked up by absolute path, as in a merged library (see
+    lib.merge). Has the same methods as DownloadIndex.
+
+    Attributes: <referenced>: set of absolute paths of files referenced
+                by rows left out of the merged library, so they are not
+                reported as orphans.
+    '''
+
+    def __init__(self,indexes):
+        self.indexes=indexes
+        self.referenced=set()
+
+    def __len__(self):
+        return sum([len(ii) for ii in self.indexes])
+
+    def _find(self,path):
+        '''Get (index, relative path) of <path>, (None, None) if not found'''
+        path=os.path.normpath(_text(path))
+        for indexii in self.indexes:
+            prefix=os.path.join(indexii.dldir,'')
+            if path.startswith(prefix):
+                return indexii,path[len(prefix):]
+        return None,None
+
+    def stat(self,path):
+        index,relpath=self._find(path)
+        if index is None:
+            return None
+        return index.stat(relpath)
+
+    def path(self,path):
+        return path
+
+    def exists(self,path):
+        return self.stat(path) is not None
+
+    def orphans(self,paths):
+        '''Files in the folders not referenced by any library
+
+        <paths>: iterable of str, absolute file paths of all rows of the
+                 merged library.
+
+        Return: <orphans>: sorted list of absolute paths.
+        '''
+        referenced=set(os.path.normpath(_text(pp)) for pp in paths if pp)
+        referenced.update([os.path.normpath(_text(pp))\
+                for pp in self.referenced])
+        orphans=[]
+        for indexii in self.indexes:
+            for relpath in indexii.entries:
+                path=indexii.path(relpath)
+                if path not in referenced:
+                    orphans.append(path)
+        return sorted(orphans)
@@ -0,0 +1,245 @@
+'''
+Resumable downloads of incomplete audios.
+
+Downloads are resumed from the bytes already on disk with HTTP Range
+requests, over keep-alive connections reused per host. The number of
+downloads running at the same time is capped.
+
+Update time: 2016-08-12 11:30:45.
+'''
+import os
+import sys
+import shutil
+import threading
+from lib.progress import Cancelled
+
+if sys.version_info[0]>=3:
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.parse import urlsplit, urljoin
+    from urllib.request import urlopen
+else:
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urlparse import urlsplit, urljoin
+    from urllib2 import urlopen
+
+#-----------Default max number of concurrent downloads-----------
+MAX_DOWNLOADS=4
+
+#-------------------Timeout of requests-------------------
+TIMEOUT=30
+
+#----------------Buffer size to write response----------------
+BUFSIZE=256*1024
+
+MAX_REDIRECTS=5
+
+
+
+class DownloadError(Exception):
+    pass
+
+
+
+class Downloader(object):
+    '''Resumable downloader with per-host keep-alive connections
+
+    <maxdownloads>: int, max number of downloads running at the same time.
+    <timeout>: int, timeout of connections in seconds.
+
+    Safe to share between the export worker threads.
+    '''
+
+    def __init__(self,maxdownloads=MAX_DOWNLOADS,timeout=TIMEOUT):
+        self.timeout=timeout
+        self._sem=threading.BoundedSemaphore(max(1,maxdownloads))
+        self._idle={}
+        self._lock=threading.Lock()
+
+    #-------------------Connection pool-------------------
+    def _getConn(self,scheme,netloc):
+        with self._lock:
+            conns=self._idle.get((scheme,netloc))
+            if conns:
+                return conns.pop(),True
+        if scheme=='https':
+            conn=HTTPSConnection(netloc,timeout=self.timeout)
+        else:
+            conn=HTTPConnection(netloc,timeout=self.timeout)
+        return conn,False
+
+    def _putConn(self,scheme,netloc,conn):
+        with self._lock:
+            self._idle.setdefault((scheme,netloc),[]).append(conn)
+
+    def close(self):
+        '''Close all idle connections'''
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle={}
+
+    #-------------------Requests-------------------
+    def _request(self,url,offset):
+        '''Send a GET request, reusing an idle connection to the host
+
+        Return: (conn, response, scheme, netloc).
+        '''
+
+        for ii in range(MAX_REDIRECTS+1):
+            parts=urlsplit(url)
+            scheme,netloc=parts.scheme,parts.netloc
+            path=parts.path or '/'
+            if parts.query:
+                path='%s?%s' %(path,parts.query)
+
+            headers={}
+            if offset>0:
+                headers['Range']='bytes=%d-' %offset
+
+            #----Retry once on a stale keep-alive connection----
+            for attempt in range(2):
+                conn,reused=self._getConn(scheme,netloc)
+                try:
+                    conn.request('GET',path,headers=headers)
+                    response=conn.getresponse()
+                    break
+                except (HTTPException,IOError,OSError):
+                    conn.close()
+                    if not reused or attempt==1:
+                        raise
+
+            if response.status in (301,302,303,307,308):
+                location=response.getheader('Location')
+                response.read()
+                conn.close()
+                if not location:
+                    raise DownloadError('Redirect without location: %s' %url)
+                url=urljoin(url,location)
+                continue
+
+            return conn,response,scheme,netloc
+
+        raise DownloadError('Too many redirects: %s' %url)
+
+    def fetch(self,url,dest,offset=0,onchunk=None):
+        '''Download <url> into <dest>, resuming at byte <offset>
+
+        <url>: str, url to download.
+        <dest>: str, path to the file to write. If <offset> > 0, <dest>
+                must hold the first <offset> bytes already.
+        <offset>: int, number of bytes already downloaded.
+        <onchunk>: callable or None, called with the number of bytes of
+                   each chunk received. It may raise to abort.
+
+        Return: <size>: int, size of <dest> after the download.
+        '''
+
+        if urlsplit(url).scheme not in ('http','https'):
+            return self._fetchOther(url,dest,onchunk)
+
+        conn,response,scheme,netloc=self._request(url,offset)
+        try:
+            if response.status==206:
+                #---------Check server resumed at our offset---------
+                crange=response.getheader('Content-Range','')
+                try:
+                    start=int(crange.split()[1].split('-')[0])
+                except (IndexError,ValueError):
+                    start=-1
+                if start!=offset:
+                    raise DownloadError('Bad Content-Range "%s" for %s'\
+                            %(crange,url))
+                mode='ab'
+            elif response.status==200:
+                # Range ignored by server, start over
+                mode='wb'
+            elif response.status==416 and offset>0:
+                # nothing left to download
+                response.read()
+                self._putConn(scheme,netloc,conn)
+                return os.path.getsize(dest)
+            else:
+                raise DownloadError('HTTP %d for %s' %(response.status,url))
+
+            with open(dest,mode) as fout:
+                while True:
+                    chunk=response.read(BUFSIZE)
+                    if not chunk:
+                        break
+                    fout.write(chunk)
+                    if onchunk is not None:
+                        onchunk(len(chunk))
+        except:
+            conn.close()
+            raise
+
+        if response.getheader('Connection','').lower()=='close':
+            conn.close()
+        else:
+            self._putConn(scheme,netloc,conn)
+
+        return os.path.getsize(dest)
+
+    def _fetchOther(self,url,dest,onchunk=None):
+        '''Download urls of other schemes (e.g. file://), not resumable'''
+        response=urlopen(url,timeout=self.timeout)
+        try:
+            with open(dest,'wb') as fout:
+                while True:
+                    chunk=response.read(BUFSIZE)
+                    if not chunk:
+                        break
+                    fout.write(chunk)
+                    if onchunk is not None:
+                        onchunk(len(chunk))
+        finally:
+            response.close()
+        return os.path.getsize(dest)
+
+    def resume(self,urls,partial,dest,total,onchunk=None):
+        '''Complete an incomplete download
+
+        <urls>: list of str, urls to try in turn.
+        <partial>: str or None, path to the incompletely downloaded file.
+                   Its bytes are reused, it is not modified.
+        <dest>: str, path to save the complete file to.
+        <total>: int or None, expected size of the complete file.
+        <onchunk>: callable or None, see fetch(). Cancelled raised by it
+                   is re-raised, other urls are not tried.
+
+        Return: <size>: int, size of the downloaded file.
+
+        Raise: DownloadError if all urls failed, or the size does not match
+               <total>.
+        '''
+
+        errors=[]
+        with self._sem:
+            for url in urls:
+                if not url:
+                    continue
+
+                #-------Start from the bytes already downloaded-------
+                offset=0
+                if partial is not None and os.path.exists(partial):
+                    shutil.copyfile(partial,dest)
+                    offset=os.path.getsize(dest)
+                    if total and offset>total:
+                        offset=0
+
+                try:
+                    size=self.fetch(url,dest,offset,onchunk)
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    errors.append('%s: %s' %(url,e))
+                    continue
+
+                if total and size!=total:
+                    errors.append('%s: got %d of %d bytes' %(url,size,total))
+                    continue
+
+                return size
+
+        raise DownloadError('; '.join(errors) or 'No url to download')
@@ -0,0 +1,177 @@
+'''
+File export operations: copy, hardlink, symlink and reflink.
+
+Update time: 2016-08-05 14:37:20.
+'''
+import os
+import sys
+import errno
+import shutil
+from lib.iosched import adviseSequential, adviseDone
+
+#-----------------Supported export modes-----------------
+EXPORT_MODES=['copy','hardlink','symlink','reflink','auto']
+
+#------Modes where the exported file shares data with the source------
+#------Metadata must not be written to these, or the source changes------
+LINK_MODES=('hardlink','symlink')
+
+#-------------Buffer size of the plain read/write copy-------------
+COPY_BUFSIZE=1024*1024
+
+#--------ioctl request number of FICLONE, from linux/fs.h--------
+FICLONE=0x40049409
+
+#------Errors meaning "not supported here", fall back to the next method------
+_UNSUPPORTED=set([errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EPERM,\
+        errno.EBADF, errno.ENOTTY, getattr(errno,'EOPNOTSUPP',95),\
+        getattr(errno,'ENOTSUP',95)])
+
+
+
+def _copyKernel(fin,fout,size,onchunk=None):
+    '''Copy inside the kernel with copy_file_range() or sendfile()
+
+    Return: True if copied, False if not supported for these files.
+    '''
+
+    infd=fin.fileno()
+    outfd=fout.fileno()
+
+    if hasattr(os,'copy_file_range'):
+        func=lambda off,n: os.copy_file_range(infd,outfd,n)
+    elif hasattr(os,'sendfile') and sys.platform.startswith('linux'):
+        func=lambda off,n: os.sendfile(outfd,infd,off,n)
+    else:
+        return False
+
+    offset=0
+    while offset<size:
+        try:
+            sent=func(offset,min(COPY_BUFSIZE*8,size-offset))
+        except OSError as e:
+            if offset==0 and e.errno in _UNSUPPORTED:
+                return False
+            raise
+        if sent==0:
+            break
+        offset+=sent
+        if onchunk is not None:
+            onchunk(sent)
+
+    return True
+
+
+def copyFile(src,dst,onchunk=None):
+    '''Copy file content and stat info, like shutil.copy2()
+
+    <onchunk>: callable or None, called with the number of bytes of each
+               chunk copied, e.g. to report progress. It may raise to
+               abort the copy.
+
+    Uses copy_file_range() or sendfile() when available, so data does not
+    go through user space. Falls back to a buffered read/write copy.
+    The source is read with the hints of lib.iosched.
+    '''
+
+    size=os.path.getsize(src)
+    with open(src,'rb') as fin:
+        adviseSequential(fin)
+        with open(dst,'wb') as fout:
+            if not _copyKernel(fin,fout,size,onchunk):
+                while True:
+                    chunk=fin.read(COPY_BUFSIZE)
+                    if not chunk:
+                        break
+                    fout.write(chunk)
+                    if onchunk is not None:
+                        onchunk(len(chunk))
+        adviseDone(fin)
+    shutil.copystat(src,dst)
+
+    return
+
+
+def reflinkFile(src,dst):
+    '''Clone a file with the FICLONE ioctl (btrfs, xfs, ...)
+
+    The clone shares data extents with the source until either is
+    modified, so it is safe to write metadata into it afterwards.
+
+    Raise: IOError or OSError if not supported.
+    '''
+
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOSYS,'reflink not supported on this platform')
+
+    with open(src,'rb') as fin:
+        with open(dst,'wb') as fout:
+            try:
+                fcntl.ioctl(fout.fileno(),FICLONE,fin.fileno())
+            except (IOError,OSError):
+                fout.close()
+                os.remove(dst)
+                raise
+    shutil.copystat(src,dst)
+
+    return
+
+
+def _removeIfExists(path):
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def exportFile(src,dst,mode='copy',onchunk=None):
+    '''Export file <src> to <dst>
+
+    <src>: str, abspath to source file.
+    <dst>: str, abspath to exported file. Overwritten if exists.
+    <mode>: str, one of EXPORT_MODES:
+            'copy': copy data, in kernel if possible.
+            'hardlink': hard link to the source.
+            'symlink': symbolic link to the source.
+            'reflink': copy-on-write clone of the source.
+            'auto': reflink if possible, otherwise copy.
+            If a mode is not supported for the given files (e.g. hard link
+            across file systems), falls back to copy.
+    <onchunk>: callable or None, passed to copyFile() when copying.
+
+    Return: <used>: str, the mode actually used.
+
+    Update time: 2016-08-05 14:37:20.
+    '''
+
+    if mode not in EXPORT_MODES:
+        raise ValueError('Unknown export mode: %s' %mode)
+
+    if mode=='hardlink' and hasattr(os,'link'):
+        try:
+            _removeIfExists(dst)
+            os.link(src,dst)
+            return 'hardlink'
+        except OSError:
+            pass
+
+    if mode=='symlink' and hasattr(os,'symlink'):
+        try:
+            _removeIfExists(dst)
+            os.symlink(os.path.abspath(src),dst)
+            return 'symlink'
+        except OSError:
+            pass
+
+    if mode in ('reflink','auto'):
+        try:
+            _removeIfExists(dst)
+            reflinkFile(src,dst)
+            return 'reflink'
+        except (IOError,OSError):
+            pass
+
+    _removeIfExists(dst)
+    copyFile(src,dst,onchunk)
+
+    return 'copy'
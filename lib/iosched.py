@@ -0,0 +1,127 @@
+'''
+Scheduling of the file I/O of an export, for disks that hate seeking.
+
+Exporting from a USB hard disk or an SD card reader is limited by seeks
+more than by bandwidth: tracks read in database order, by several
+threads at once, jump all over the "Download" folder. The scheduler:
+    1. orders the tracks of an album by the inode of their source file,
+       which on most file systems follows the order files were written
+       in, so close to their order on disk.
+    2. caps the number of files read from, or written to, each device
+       (st_dev) at the same time, so a slow disk streams one or two files
+       instead of seeking between <jobs> of them, while exports to
+       other devices go on.
+    3. advises the kernel that sources are read sequentially, and that
+       their pages can be dropped once copied, see adviseSequential()
+       and adviseDone(). This needs os.posix_fadvise (Python 3.3+, unix),
+       else it is skipped.
+
+Update time: 2016-10-11 09:31:58.
+'''
+import os
+import threading
+
+#-------Default max files read or written at once per device-------
+DEVICE_JOBS=0
+
+
+
+def adviseSequential(fobj):
+    '''Tell the kernel file <fobj> is read from start to end'''
+    if hasattr(os,'posix_fadvise'):
+        try:
+            os.posix_fadvise(fobj.fileno(),0,0,os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def adviseDone(fobj):
+    '''Tell the kernel the cached pages of file <fobj> are not needed
+
+    Called once a source is copied, so exporting a large library does not
+    push everything else out of the page cache.
+    '''
+    if hasattr(os,'posix_fadvise'):
+        try:
+            os.posix_fadvise(fobj.fileno(),0,0,os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+def inodeOrder(stats):
+    '''Order to read files in, by inode
+
+    <stats>: list of (size, mtime, inode) or None, stats of the files,
+             e.g. from DownloadIndex.stat().
+
+    Return: <order>: list of int, indices into <stats>. Files with no
+            stat or inode keep their relative order, at the end.
+    '''
+
+    def key(ii):
+        stat=stats[ii]
+        if stat is None or not stat[2]:
+            return (1,0,ii)
+        return (0,stat[2],ii)
+
+    return sorted(range(len(stats)),key=key)
+
+
+
+class IOScheduler(object):
+    '''Per-device limits of the concurrent file exports
+
+    <devicejobs>: int, max number of files read or written at once on
+                  each device. If <=0, there is no limit, only the order
+                  of the tracks is changed.
+
+    Methods are safe to call from the export worker threads.
+    '''
+
+    def __init__(self,devicejobs=DEVICE_JOBS):
+        self.devicejobs=devicejobs
+        self._devices={}
+        self._slots={}
+        self._lock=threading.Lock()
+
+    def device(self,path):
+        '''st_dev of the folder of <path>, None if it can't be stat'ed'''
+        folder=os.path.dirname(os.path.abspath(path))
+        with self._lock:
+            if folder in self._devices:
+                return self._devices[folder]
+        try:
+            dev=os.stat(folder).st_dev
+        except OSError:
+            dev=None
+        with self._lock:
+            self._devices[folder]=dev
+        return dev
+
+    def _slot(self,dev):
+        with self._lock:
+            slot=self._slots.get(dev)
+            if slot is None:
+                slot=threading.BoundedSemaphore(self.devicejobs)
+                self._slots[dev]=slot
+            return slot
+
+    def acquire(self,src,dst):
+        '''Wait for a free slot on the devices of <src> and <dst>
+
+        Return: <token>: to pass to release() once the file is exported,
+                possibly from another thread.
+        '''
+        if self.devicejobs<=0:
+            return []
+        devs=set([self.device(src),self.device(dst)])
+        devs.discard(None)
+        # always in the same order, so two exports can't deadlock
+        token=[self._slot(dd) for dd in sorted(devs)]
+        for slot in token:
+            slot.acquire()
+        return token
+
+    def release(self,token):
+        for slot in reversed(token):
+            slot.release()
@@ -0,0 +1,155 @@
+'''
+Write-ahead journal of an export, to resume it after a crash.
+
+Each track moves through the states:
+    'planned':   about to be exported, its temp file may be incomplete.
+    'copied':    the temp file holds the complete audio, untagged.
+    'tagged':    the temp file holds the complete audio, tagged.
+    'committed': the temp file was renamed to the exported file.
+
+Files are written to a temp name next to the exported file (see
+partName()) and renamed into place in one step, so an exported file is
+never half written. Every change of state is appended to the journal
+file in the output folder as a json line [trackId, state, dest], where
+<dest> is the exported file relative to the output folder. A track is
+identified by its trackId and <dest>, as it may be listed under several
+albums.
+
+Update time: 2016-10-17 09:46:21.
+'''
+import os
+import json
+import time
+import threading
+
+JOURNAL_NAME='.ximaexport-journal'
+
+STATES=('planned','copied','tagged','committed')
+
+#-------Max seconds between syncs of the journal file to disk-------
+FSYNC_INTERVAL=2.
+
+
+
+def partName(path,tag=None):
+    '''Temp name a file is written to before renamed to <path>
+
+    <tag>: int, str or None, trackId of the track written. Rows of an
+           album may export to the same file, their temp files must
+           differ as they can be written at the same time.
+    '''
+    folder,name=os.path.split(path)
+    if tag is None:
+        return os.path.join(folder,'.%s.part' %name)
+    return os.path.join(folder,'.%s.%s.part' %(name,tag))
+
+
+def commitFile(tmppath,path):
+    '''Rename <tmppath> to <path> in one step, replacing <path>'''
+    if hasattr(os,'replace'):
+        os.replace(tmppath,path)
+        return
+    if os.name=='nt' and os.path.lexists(path):
+        os.remove(path)
+    os.rename(tmppath,path)
+
+
+
+class Journal(object):
+    '''Journal of the states of tracks exported to a folder
+
+    <outdir>: str, output folder. The journal is saved as
+              <outdir>/.ximaexport-journal.
+    <resume>: bool, if True, continue from the states in an existing
+              journal. If False, start a new journal, deleting the temp
+              files left by unfinished tracks of the old one.
+
+    Methods are safe to call from the export worker threads.
+    '''
+
+    def __init__(self,outdir,resume=False):
+        self.outdir=outdir
+        self.path=os.path.join(outdir,JOURNAL_NAME)
+        self.entries={}
+        self._lock=threading.Lock()
+        self._lastsync=time.time()
+
+        self.load()
+        if not resume:
+            self.cleanup()
+            self.entries={}
+        self._compact()
+        self._fout=open(self.path,'a')
+
+    def load(self):
+        '''Replay the journal file, if exists'''
+        if not os.path.exists(self.path):
+            return
+        with open(self.path,'r') as fin:
+            for line in fin:
+                try:
+                    trackid,state,dest=json.loads(line)
+                except ValueError:
+                    # line cut short by a crash
+                    continue
+                self.entries[(trackid,dest)]=state
+
+    def cleanup(self):
+        '''Delete temp files of tracks not committed'''
+        for (trackid,dest),state in self.entries.items():
+            if state=='committed':
+                continue
+            tmppath=partName(os.path.join(self.outdir,dest),trackid)
+            if os.path.lexists(tmppath):
+                try:
+                    os.remove(tmppath)
+                except OSError:
+                    pass
+
+    def _compact(self):
+        '''Rewrite the journal with the last state of each track only'''
+        tmppath=self.path+'.tmp'
+        with open(tmppath,'w') as fout:
+            for (trackid,dest),state in self.entries.items():
+                fout.write(json.dumps([trackid,state,dest])+'\n')
+            fout.flush()
+            os.fsync(fout.fileno())
+        commitFile(tmppath,self.path)
+
+    def relpath(self,path):
+        '''Path relative to the output folder, as stored in the journal'''
+        return os.path.relpath(path,self.outdir)
+
+    def get(self,trackid,dest):
+        '''Get the state of a track exported to <dest>, None if not in
+        the journal'''
+        with self._lock:
+            return self.entries.get((trackid,dest))
+
+    def record(self,trackid,state,dest):
+        '''Append a change of state of a track'''
+        if state not in STATES:
+            raise ValueError('Unknown state: %s' %state)
+        line=json.dumps([trackid,state,dest])+'\n'
+        with self._lock:
+            self.entries[(trackid,dest)]=state
+            self._fout.write(line)
+            self._fout.flush()
+            if time.time()-self._lastsync>FSYNC_INTERVAL:
+                os.fsync(self._fout.fileno())
+                self._lastsync=time.time()
+
+    def close(self,remove=False):
+        '''Sync and close the journal file
+
+        <remove>: bool, if True, delete the journal, e.g. once all
+                  tracks are exported.
+        '''
+        with self._lock:
+            if self._fout is not None:
+                self._fout.flush()
+                os.fsync(self._fout.fileno())
+                self._fout.close()
+                self._fout=None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
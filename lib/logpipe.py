@@ -0,0 +1,131 @@
+'''
+Log pipeline between the export threads and the GUI.
+
+LogPipe replaces sys.stdout in the GUI. Writes are split into lines and
+kept until the GUI polls them with drain(), once per frame, so the text
+widget gets one insert per frame however fast the export prints.
+Runs of the same line are collapsed into one, and at most <maxlines>
+lines are handed out per drain, the skipped ones being counted. The
+full, uncollapsed log is written to a file on disk.
+
+Update time: 2016-09-09 14:48:02.
+'''
+import os
+import io
+import time
+import threading
+
+#------------------Folder of the GUI log files------------------
+LOG_DIR=os.path.join(os.path.expanduser('~'),'.ximaexport','logs')
+
+#-------------Max number of lines handed out per drain-------------
+MAX_LINES_PER_DRAIN=200
+
+
+
+def _text(string):
+    '''Convert a printed string to unicode'''
+    if isinstance(string,bytes):
+        try:
+            return string.decode('utf8')
+        except UnicodeDecodeError:
+            return string.decode('gbk','replace')
+    return string
+
+
+def newLogFile(logdir=LOG_DIR,prefix='ximaexport-gui'):
+    '''Path to a new log file in <logdir>, None if it can't be created'''
+    try:
+        if not os.path.isdir(logdir):
+            os.makedirs(logdir)
+    except OSError:
+        return None
+    return os.path.join(logdir,'%s-%s.log' %(prefix,\
+            time.strftime('%Y%m%d-%H%M%S')))
+
+
+
+class LogPipe(object):
+    '''File-like sink of printed text, drained in batches
+
+    <logfile>: str or None, file to append the full log to.
+    <maxlines>: int, max number of lines returned by a drain().
+
+    write() is safe to call from any thread.
+    '''
+
+    def __init__(self,logfile=None,maxlines=MAX_LINES_PER_DRAIN):
+        self.logfile=logfile
+        self.maxlines=maxlines
+        self._lock=threading.Lock()
+        self._partial=u''
+        self._lines=[]
+        self._last=None
+        self._repeat=0
+        self._fout=None
+        if logfile is not None:
+            try:
+                self._fout=io.open(logfile,'a',encoding='utf-8')
+            except (IOError,OSError):
+                self.logfile=None
+
+    def write(self,string):
+        string=_text(string)
+        with self._lock:
+            if self._fout is not None:
+                self._fout.write(string)
+            lines=(self._partial+string).split(u'\n')
+            self._partial=lines.pop()
+            for ll in lines:
+                self._addLine(ll)
+
+    def _addLine(self,line):
+        if line==self._last and line.strip():
+            self._repeat+=1
+            return
+        self._endRepeat()
+        self._last=line
+        self._lines.append(line)
+
+    def _endRepeat(self):
+        if self._repeat>0:
+            self._lines.append(u'    (last line repeated %d times)'\
+                    %self._repeat)
+            self._repeat=0
+
+    def flush(self):
+        with self._lock:
+            if self._fout is not None:
+                self._fout.flush()
+
+    def drain(self):
+        '''Get the text written since the last drain, in one string
+
+        Return: <text>: unicode, complete lines only. If more than
+                <maxlines> lines are pending, the oldest are replaced by
+                a line telling how many were skipped.
+        '''
+
+        with self._lock:
+            self._endRepeat()
+            lines=self._lines
+            self._lines=[]
+            if self._fout is not None:
+                self._fout.flush()
+
+        if len(lines)==0:
+            return u''
+        if len(lines)>self.maxlines:
+            skipped=len(lines)-self.maxlines
+            note=u'    ... %d lines skipped' %skipped
+            if self.logfile is not None:
+                note=u'%s, see %s' %(note,_text(self.logfile))
+            lines=[note]+lines[-self.maxlines:]
+
+        return u'\n'.join(lines)+u'\n'
+
+    def close(self):
+        with self._lock:
+            if self._fout is not None:
+                self._fout.close()
+                self._fout=None
@@ -0,0 +1,113 @@
+'''
+Manifest of exported tracks, for incremental exports.
+
+The manifest is a json file saved in the output folder. For each exported
+track it records, keyed by "<trackId>:<dest>" as a track may be listed
+under several albums, each exported to a file of its own:
+    'src': relative path of the source file in the "Download" folder.
+    'size', 'mtime': size and modification time of the source file.
+    'dest': path of the exported file, relative to the output folder.
+    'destsize': size of the exported file.
+    'tagged': bool, whether metadata was written to the exported file.
+
+Update time: 2016-10-17 10:31:08.
+'''
+import os
+import json
+import threading
+
+MANIFEST_NAME='.ximaexport-manifest.json'
+
+
+
+def _key(trackid,dest):
+    return '%s:%s' %(trackid,dest)
+
+
+
+class Manifest(object):
+    '''Persistent record of exported tracks
+
+    <outdir>: str, output folder. The manifest is saved as
+              <outdir>/.ximaexport-manifest.json.
+
+    Methods are safe to call from the export worker threads.
+    '''
+
+    def __init__(self,outdir):
+        self.outdir=outdir
+        self.path=os.path.join(outdir,MANIFEST_NAME)
+        self.entries={}
+        self._lock=threading.Lock()
+        self.load()
+
+    def load(self):
+        '''Read the manifest file, if exists'''
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path,'r') as fin:
+                entries=json.load(fin)
+        except (IOError,ValueError):
+            # corrupted manifest, re-export everything
+            self.entries={}
+            return
+
+        #-------Manifests of older releases are keyed by trackId-------
+        self.entries={}
+        for kk,vv in entries.items():
+            if kk.isdigit() and 'dest' in vv:
+                kk=_key(kk,vv['dest'])
+            self.entries[kk]=vv
+
+    def save(self):
+        '''Write the manifest file, replacing the old one in one rename'''
+        tmppath=self.path+'.tmp'
+        with self._lock:
+            with open(tmppath,'w') as fout:
+                json.dump(self.entries,fout)
+        if os.name=='nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmppath,self.path)
+
+    def relpath(self,path):
+        '''Path relative to the output folder, as stored in the manifest'''
+        return os.path.relpath(path,self.outdir)
+
+    def isCurrent(self,trackid,src,size,mtime,dest,tagged):
+        '''Check if a track was exported from the same source
+
+        <trackid>: int, trackId of the track.
+        <src>: str, relative path of the source in the "Download" folder.
+        <size>, <mtime>: size and mtime of the source file.
+        <dest>: str, path of the exported file, relative to output folder.
+        <tagged>: bool, if True, also require the metadata to have
+                  been written.
+
+        Return: True if the exported file is still up to date.
+        '''
+        with self._lock:
+            entry=self.entries.get(_key(trackid,dest))
+        if entry is None:
+            return False
+        if entry['src']!=src or entry['size']!=size or\
+                entry['mtime']!=mtime or entry['dest']!=dest:
+            return False
+        if tagged and not entry['tagged']:
+            return False
+
+        #--------Exported file removed or modified since--------
+        try:
+            destsize=os.path.getsize(os.path.join(self.outdir,dest))
+        except OSError:
+            return False
+
+        return destsize==entry['destsize']
+
+    def update(self,trackid,src,size,mtime,dest,tagged):
+        '''Record an exported track'''
+        destsize=os.path.getsize(os.path.join(self.outdir,dest))
+        with self._lock:
+            self.entries[_key(trackid,dest)]={'src': src, 'size': size,\
+                    'mtime': mtime, 'dest': dest, 'destsize': destsize,\
+                    'tagged': tagged}
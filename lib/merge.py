@@ -0,0 +1,118 @@
+'''
+Merge of the libraries of several devices into one.
+
+Each "ting.sqlite" database, with the "Download" folder next to it, is
+the library of one phone. Rows of download_table found in several
+libraries are merged by trackId, keeping the row with the best copy of
+the audio: a complete download first, then the largest file on disk.
+On ties, the row of the earlier database is kept. Rows without trackId
+are all kept.
+
+The merged rows are saved to a temporary database with the same
+download_table as a single library, except that 'filepath' holds the
+absolute path of the source file. Source files are looked up in a
+MultiIndex of all the "Download" folders.
+
+Update time: 2016-09-23 11:12:40.
+'''
+import os
+import sqlite3
+from lib.dlindex import DownloadIndex, MultiIndex
+from lib.query import connectDB, whereClause
+
+
+
+def tableColumns(db,table='download_table'):
+    '''Names of the columns of <table>, in order'''
+    return [rr[1] for rr in db.execute('PRAGMA table_info(%s)' %table)]
+
+
+def rowScore(stat,totalbytes):
+    '''Sort key of the copies of a track, the largest is the best'''
+    if stat is None:
+        return (False,0)
+    return (stat[0]>=(totalbytes or 0),stat[0])
+
+
+def mergeDatabases(dbfiles,where=None,immutable=True):
+    '''Merge the download_table of several databases
+
+    <dbfiles>: list of str, paths to the "ting.sqlite" database files,
+               opened read-only.
+    <where>: lib.query.TrackFilter or None, rows to merge.
+    <immutable>: bool, open the databases as immutable, see
+                 lib.query.connectDB().
+
+    Return: (db, dlindex): sqlite3 connection to the temporary merged
+            database, deleted once closed, and MultiIndex of the
+            "Download" folders.
+
+    The merged table has the columns of all the databases, those missing
+    from a database are NULL in its rows, e.g. if the iOS and Android
+    apps do not save the same columns.
+
+    Raise: sqlite3.Error if a database can't be read.
+
+    Update time: 2016-09-23 11:12:40.
+    '''
+
+    indexes=[]
+    columns=[]
+    best={}
+    clause,params=whereClause(where)
+
+    #--------------Find the best row of each track--------------
+    for ii,dbfile in enumerate(dbfiles):
+        indir=os.path.split(os.path.abspath(dbfile))[0]
+        dlindex=DownloadIndex(os.path.join(indir,'Download'))
+        indexes.append(dlindex)
+
+        src=connectDB(dbfile,immutable)
+        try:
+            for cc in tableColumns(src):
+                if cc not in columns:
+                    columns.append(cc)
+            rows=src.execute('SELECT rowid, trackId, filepath, totalBytes '\
+                    'FROM download_table %s' %clause,params)
+            for rowid,trackid,filepath,totalbytes in rows:
+                stat=dlindex.stat(filepath) if filepath else None
+                score=rowScore(stat,totalbytes)
+                key=trackid if trackid is not None else (ii,rowid)
+                if key not in best or score>best[key][0]:
+                    best[key]=(score,ii,rowid)
+        finally:
+            src.close()
+
+    multiindex=MultiIndex(indexes)
+
+    #----------------Copy the best rows----------------
+    db=sqlite3.connect('')
+    db.execute('CREATE TABLE download_table (%s)' %', '.join(columns))
+    fileidx=columns.index('filepath')
+
+    for ii,dbfile in enumerate(dbfiles):
+        keep=set([rowid for score,jj,rowid in best.values() if jj==ii])
+        src=connectDB(dbfile,immutable)
+        try:
+            srccolumns=tableColumns(src)
+            select=[cc if cc in srccolumns else 'NULL' for cc in columns]
+            # all rows, to know the files referenced by the others
+            rows=src.execute('SELECT rowid, %s FROM download_table'\
+                    %', '.join(select))
+            merged=[]
+            for row in rows:
+                row=list(row)
+                rowid=row.pop(0)
+                if row[fileidx]:
+                    row[fileidx]=indexes[ii].path(row[fileidx])
+                    if rowid not in keep:
+                        multiindex.referenced.add(row[fileidx])
+                if rowid in keep:
+                    merged.append(row)
+            db.executemany('INSERT INTO download_table VALUES (%s)'\
+                    %', '.join(['?']*len(columns)),merged)
+        finally:
+            src.close()
+    db.commit()
+
+    return db,multiindex
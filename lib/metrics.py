@@ -0,0 +1,277 @@
+'''
+Timers and counters of the stages of an export, and profiling of a run.
+
+For each stage of STAGES, the number of calls, seconds, bytes and
+failures are counted. Stages are timed where they run, e.g. in the
+export threads, so their seconds add up to more than the wall time of
+a concurrent export, and may nest: 'tag' is part of 'export' when the
+metadata is written while copying.
+
+Metrics are collected once a Metrics is set with setMetrics(), as the
+console formatter of lib.tools. Otherwise timer() returns a timer doing
+nothing, and the export runs as before.
+
+Jobs run in the processes of the tag stage can't report to the Metrics
+of the main process: they are timed as a whole by timedCall(), their
+'tag' stage is not counted.
+
+Update time: 2016-10-08 16:44:21.
+'''
+import os
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+from lib.journal import commitFile
+from lib.planner import formatSize
+
+#-----------------Stages of an export, in order-----------------
+STAGES=OrderedDict([
+    ('load', 'read rows from the database'),
+    ('albums', 'list and filter the albums'),
+    ('dedup', 'find duplicated source files'),
+    ('cover', 'get and load album covers'),
+    ('download', 'download incomplete audios'),
+    ('export', 'copy, link or stream audios, with metadata'),
+    ('tag', 'write metadata with mutagen'),
+    ('print', 'print console messages'),
+    ])
+
+METRICS_FORMATS=['json','prom']
+
+#-----------Prefix of the metrics in the Prometheus textfile-----------
+PROM_PREFIX='ximaexport'
+
+
+
+class Metrics(object):
+    '''Calls, seconds, bytes and failures of each stage
+
+    Methods are safe to call from the export worker threads.
+    '''
+
+    def __init__(self):
+        self.started=time.time()
+        self.stages=OrderedDict([(ss,[0,0.,0,0]) for ss in STAGES])
+        self._lock=threading.Lock()
+
+    def add(self,stage,seconds=0.,nbytes=0,failed=False,calls=1):
+        '''Count <calls> calls of <stage>, taking <seconds>'''
+        with self._lock:
+            entry=self.stages.setdefault(stage,[0,0.,0,0])
+            entry[0]+=calls
+            entry[1]+=seconds
+            entry[2]+=nbytes or 0
+            entry[3]+=1 if failed else 0
+
+    def timer(self,stage):
+        return _Timer(self,stage)
+
+    def toDict(self):
+        '''Get the metrics as a json serializable dict'''
+        with self._lock:
+            stages=OrderedDict([(ss,{'calls': vv[0], 'seconds': vv[1],\
+                    'bytes': vv[2], 'failures': vv[3]})\
+                    for ss,vv in self.stages.items()])
+        return {'started': self.started,\
+                'seconds': time.time()-self.started,\
+                'stages': stages}
+
+    def toPrometheus(self):
+        '''Get the metrics in the Prometheus text format'''
+        data=self.toDict()
+        lines=[]
+        for key,mtype,doc in [
+                ('calls','counter','Calls of each stage of the export.'),
+                ('seconds','counter','Seconds spent in each stage.'),
+                ('bytes','counter','Bytes processed by each stage.'),
+                ('failures','counter','Failed calls of each stage.')]:
+            name='%s_stage_%s_total' %(PROM_PREFIX,key)
+            lines.append('# HELP %s %s' %(name,doc))
+            lines.append('# TYPE %s %s' %(name,mtype))
+            for ss,vv in data['stages'].items():
+                lines.append('%s{stage="%s"} %s' %(name,ss,repr(vv[key])))
+        name='%s_run_seconds' %PROM_PREFIX
+        lines.append('# HELP %s Wall time of the run.' %name)
+        lines.append('# TYPE %s gauge' %name)
+        lines.append('%s %s' %(name,repr(data['seconds'])))
+        name='%s_run_start_timestamp_seconds' %PROM_PREFIX
+        lines.append('# HELP %s Start time of the run.' %name)
+        lines.append('# TYPE %s gauge' %name)
+        lines.append('%s %s' %(name,repr(data['started'])))
+        return '\n'.join(lines)+'\n'
+
+    def summaryLines(self):
+        '''Lines of the summary table, stages never called are left out'''
+        lines=['%-9s %7s %9s %10s %8s' %('Stage','Calls','Seconds',\
+                'Bytes','Failures')]
+        with self._lock:
+            for ss,(calls,seconds,nbytes,failures) in self.stages.items():
+                if calls==0:
+                    continue
+                lines.append('%-9s %7d %9.2f %10s %8d' %(ss,calls,seconds,\
+                        formatSize(nbytes) if nbytes else '-',failures))
+        return lines
+
+    def save(self,path,fmt=None):
+        '''Write the metrics to file <path>, replacing it in one rename
+
+        <fmt>: str or None, one of METRICS_FORMATS. If None, 'prom' for a
+               .prom file, as read by the textfile collector of the
+               Prometheus node exporter, else 'json'.
+        '''
+        if fmt is None:
+            fmt=metricsFormat(path)
+        if fmt=='prom':
+            text=self.toPrometheus()
+        else:
+            text=json.dumps(self.toDict(),indent=1)
+        tmppath=path+'.tmp'
+        with open(tmppath,'w') as fout:
+            fout.write(text)
+        commitFile(tmppath,path)
+
+
+
+class _Timer(object):
+    '''Context timing a call of a stage, a failure if it raises
+
+    Set <bytes> to the bytes processed, <failed> to count a failure
+    without raising.
+    '''
+
+    def __init__(self,metrics,stage):
+        self.metrics=metrics
+        self.stage=stage
+        self.bytes=0
+        self.failed=False
+
+    def __enter__(self):
+        self._t0=time.time()
+        return self
+
+    def __exit__(self,etype,value,tb):
+        self.metrics.add(self.stage,time.time()-self._t0,self.bytes,\
+                self.failed or etype is not None)
+        return False
+
+
+
+class _NullTimer(object):
+    '''Timer doing nothing, when no metrics are collected'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,etype,value,tb):
+        return False
+
+_NULL_TIMER=_NullTimer()
+
+
+def metricsFormat(path):
+    ext=os.path.splitext(path)[1].lower().lstrip('.')
+    return 'prom' if ext=='prom' else 'json'
+
+
+#--------------------Metrics used by timer() below--------------------
+_metrics=None
+
+
+def getMetrics():
+    return _metrics
+
+
+def setMetrics(metrics):
+    '''Set the Metrics the stages are counted in, None to stop counting'''
+    global _metrics
+    _metrics=metrics
+
+
+def timer(stage):
+    '''Get a context timing a call of <stage>'''
+    if _metrics is None:
+        return _NULL_TIMER
+    return _Timer(_metrics,stage)
+
+
+def record(stage,seconds=0.,nbytes=0,failed=False):
+    '''Count a call of <stage> timed elsewhere'''
+    if _metrics is not None:
+        _metrics.add(stage,seconds,nbytes,failed)
+
+
+def timedIter(stage,iterable):
+    '''Iterate <iterable>, counting the time to get each item in <stage>'''
+    iterator=iter(iterable)
+    while True:
+        with timer(stage):
+            try:
+                item=next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def timedCall(func,*args):
+    '''Call func(*args)
+
+    Return: (result, seconds).
+
+    Module level, so it can be run in the processes of the tag stage.
+    '''
+    t0=time.time()
+    result=func(*args)
+    return result,time.time()-t0
+
+
+
+class Profiler(object):
+    '''cProfile of a run, in all its threads
+
+    Threads started after start() are profiled each by a Profile of
+    their own, all are merged by save(). Processes of the tag stage are
+    not profiled.
+    '''
+
+    def __init__(self):
+        import cProfile
+        self._cprofile=cProfile
+        self.profiles=[]
+        self._lock=threading.Lock()
+
+    def _new(self):
+        profile=self._cprofile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+    def _threadHook(self,frame,event,arg):
+        '''Profile function of new threads, replaced by their Profile'''
+        sys.setprofile(None)
+        self._new().enable()
+
+    def start(self):
+        threading.setprofile(self._threadHook)
+        self._new().enable()
+
+    def stop(self):
+        threading.setprofile(None)
+        for profile in self.profiles:
+            profile.disable()
+
+    def save(self,path):
+        '''Write the merged profiles to <path>, read by pstats or snakeviz'''
+        import pstats
+        stats=None
+        for profile in self.profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats=pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats is not None:
+            stats.dump_stats(path)
@@ -0,0 +1,218 @@
+'''
+Write tags to a MP4 file while copying it, in a single pass.
+
+Only the top-level atoms other than "mdat" (ftyp, moov, ...) are held in
+memory, with each "mdat" replaced by an empty placeholder. Tags are
+written into this small skeleton, which also updates the chunk offsets
+in moov. The output is then written once, streaming the audio data of
+each "mdat" from the source in between the tagged atoms, or read as a
+file object through TaggedStream.
+
+Files with an mdat before moov are not streamed, see tagLayout().
+
+Update time: 2016-08-16 09:55:17.
+'''
+import os
+import struct
+import shutil
+from io import BytesIO
+from lib.iosched import adviseSequential, adviseDone
+
+#----------------Buffer size to stream audio data----------------
+BUFSIZE=1024*1024
+
+
+
+class MP4StreamError(Exception):
+    pass
+
+
+
+def readAtoms(fobj,filesize):
+    '''Read headers of top-level atoms
+
+    <fobj>: file object, opened in binary mode.
+    <filesize>: int, size of file.
+
+    Return: <atoms>: list of (name, offset, headersize, size).
+    '''
+
+    atoms=[]
+    offset=0
+    while offset+8<=filesize:
+        fobj.seek(offset)
+        size,name=struct.unpack('>I4s',fobj.read(8))
+        headersize=8
+        if size==1:
+            size=struct.unpack('>Q',fobj.read(8))[0]
+            headersize=16
+        elif size==0:
+            size=filesize-offset
+        if size<headersize or offset+size>filesize:
+            raise MP4StreamError('Bad atom %r at %d' %(name,offset))
+        atoms.append((name,offset,headersize,size))
+        offset+=size
+
+    return atoms
+
+
+def _copyRange(fin,fout,offset,size,onchunk=None):
+    fin.seek(offset)
+    left=size
+    while left>0:
+        chunk=fin.read(min(BUFSIZE,left))
+        if not chunk:
+            raise MP4StreamError('Unexpected end of file')
+        fout.write(chunk)
+        left-=len(chunk)
+        if onchunk is not None:
+            onchunk(len(chunk))
+
+
+def tagLayout(fin,filesize,tagfunc):
+    '''Write tags into the skeleton of a MP4 file
+
+    <fin>: file object of the source MP4 file, opened in binary mode.
+    <filesize>: int, size of the source file.
+    <tagfunc>: callable, see tagStream().
+
+    Return: <segments>: list of (data, offset, size) making up the tagged
+            file, in order. <data> is the bytes to write, or None for
+            <size> bytes of audio data at <offset> in the source file.
+
+    Raise: MP4StreamError if the file does not look like a MP4 file, or
+           if an mdat comes before moov.
+
+    Only files with moov before every mdat are streamed. Tagging shifts
+    the chunk offsets pointing after moov, and in the skeleton, where an
+    mdat before moov is cut down to its header, that would wrongly
+    include offsets into the audio data. Callers fall back to tagging a
+    copy in place.
+    '''
+
+    atoms=readAtoms(fin,filesize)
+    names=[aa[0] for aa in atoms]
+    if b'moov' not in names or b'mdat' not in names:
+        raise MP4StreamError('No moov or mdat atom')
+    if names.index(b'mdat')<names.index(b'moov'):
+        raise MP4StreamError('mdat before moov')
+
+    #----------Skeleton, with mdat payload left out----------
+    skeleton=BytesIO()
+    mdats=[]
+    extra=0
+    for name,offset,headersize,size in atoms:
+        if name==b'mdat':
+            skeleton.write(struct.pack('>I4s',8,b'mdat'))
+            mdats.append((offset,size))
+            extra+=size-8
+        else:
+            _copyRange(fin,skeleton,offset,size)
+
+    skeleton.seek(0)
+    tagfunc(skeleton,extra)
+
+    #------------Tagged atoms, and audio data in between------------
+    data=skeleton.getvalue()
+    newatoms=readAtoms(skeleton,len(data))
+    if [aa[0] for aa in newatoms].count(b'mdat')!=len(mdats):
+        raise MP4StreamError('Layout of atoms changed by tagging')
+
+    segments=[]
+    for name,offset,headersize,size in newatoms:
+        if name==b'mdat':
+            mdatoffset,mdatsize=mdats.pop(0)
+            segments.append((None,mdatoffset,mdatsize))
+        else:
+            segments.append((data[offset:offset+size],0,size))
+
+    return segments
+
+
+def tagStream(src,dst,tagfunc,onchunk=None):
+    '''Copy MP4 file <src> to <dst>, writing tags on the way
+
+    <src>: str, path to source MP4 file.
+    <dst>: str, path to output file.
+    <tagfunc>: callable, tagfunc(fileobj,extra) loads the file object
+               with mutagen, sets the tags and saves them back to it.
+               <extra> is the number of audio bytes left out of
+               <fileobj> after the moov atom, e.g. to compute the padding
+               as for the full file.
+    <onchunk>: callable or None, called with the number of bytes of each
+               chunk of audio data streamed. It may raise to abort.
+
+    Raise: MP4StreamError if <src> does not look like a MP4 file.
+    '''
+
+    filesize=os.path.getsize(src)
+    with open(src,'rb') as fin:
+        segments=tagLayout(fin,filesize,tagfunc)
+
+        #---------Write tagged atoms and stream the payload---------
+        adviseSequential(fin)
+        with open(dst,'wb') as fout:
+            for data,offset,size in segments:
+                if data is None:
+                    _copyRange(fin,fout,offset,size,onchunk)
+                else:
+                    fout.write(data)
+        adviseDone(fin)
+
+    shutil.copymode(src,dst)
+
+    return
+
+
+
+class TaggedStream(object):
+    '''Read-only file object of a MP4 file with tags written
+
+    <fin>: file object of the source MP4 file, opened in binary mode. It
+           must stay open while the stream is read.
+    <tagfunc>: callable, see tagStream().
+    <onchunk>: callable or None, called with the number of bytes of each
+               chunk of audio data read. It may raise to abort.
+
+    Attributes: <size>: int, size of the tagged file.
+
+    The tagged file is never written to disk: reading the stream gives
+    the bytes tagStream() would write, e.g. to add it to an archive.
+
+    Raise: MP4StreamError if the file does not look like a MP4 file.
+    '''
+
+    def __init__(self,fin,tagfunc,onchunk=None):
+        fin.seek(0,os.SEEK_END)
+        self.fin=fin
+        self.segments=tagLayout(fin,fin.tell(),tagfunc)
+        self.size=sum([ss[2] for ss in self.segments])
+        self.onchunk=onchunk
+        self._seg=0
+        self._pos=0
+
+    def read(self,size=-1):
+        chunks=[]
+        while self._seg<len(self.segments) and size!=0:
+            data,offset,length=self.segments[self._seg]
+            nn=length-self._pos
+            if size>0:
+                nn=min(nn,size,BUFSIZE)
+            if data is not None:
+                chunk=data[self._pos:self._pos+nn]
+            else:
+                self.fin.seek(offset+self._pos)
+                chunk=self.fin.read(nn)
+                if not chunk:
+                    raise MP4StreamError('Unexpected end of file')
+                if self.onchunk is not None:
+                    self.onchunk(len(chunk))
+            chunks.append(chunk)
+            self._pos+=len(chunk)
+            if size>0:
+                size-=len(chunk)
+            if self._pos>=length:
+                self._seg+=1
+                self._pos=0
+
+        return b''.join(chunks)
@@ -0,0 +1,165 @@
+'''
+Helpers of the dry-run export planner.
+
+A plan lists, for every track to export, its source in the "Download"
+folder and its destination in the output folder, with the bytes to
+write and whether it must be downloaded first. It is built without
+writing to the output folder (see ximaexport.makePlan()), checked for
+name collisions and free space, and saved as json to be executed as-is
+by a later run.
+
+Update time: 2016-08-30 16:12:05.
+'''
+import os
+import json
+import time
+import tempfile
+
+PLAN_VERSION=1
+
+#-------Bytes read and written to measure the disk throughput-------
+PROBE_SIZE=32*1024*1024
+PROBE_BUFSIZE=1024*1024
+
+
+
+def existingParent(path):
+    '''Nearest folder of <path> that exists, <path> itself if it does'''
+    path=os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent=os.path.dirname(path)
+        if parent==path:
+            break
+        path=parent
+    return path
+
+
+def diskFree(path):
+    '''Free bytes on the disk holding <path>, None if unknown
+
+    <path> may not exist yet, then its nearest existing parent is used.
+    '''
+
+    path=existingParent(path)
+    try:
+        from shutil import disk_usage
+        return disk_usage(path).free
+    except ImportError:
+        pass
+    except OSError:
+        return None
+
+    #-----------Python 2: statvfs() on unix-----------
+    if hasattr(os,'statvfs'):
+        st=os.statvfs(path)
+        return st.f_bavail*st.f_frsize
+    return None
+
+
+def findCollisions(dests):
+    '''Find tracks exported to the same file
+
+    <dests>: list of (key, dest), where <dest> is the path of the
+             exported file, relative to the output folder.
+
+    Return: <collisions>: list of (dest, keys), for each destination
+            shared by more than one track. Paths are compared case
+            insensitively, as on the FAT/exFAT disks the exports are
+            often written to.
+    '''
+
+    groups={}
+    for key,dest in dests:
+        kk=os.path.normcase(dest).lower()
+        groups.setdefault(kk,[]).append((key,dest))
+
+    collisions=[]
+    for kk in sorted(groups):
+        if len(groups[kk])>1:
+            keys=[aa for aa,bb in groups[kk]]
+            collisions.append((groups[kk][0][1],keys))
+
+    return collisions
+
+
+def measureThroughput(srcs,outdir,maxbytes=PROBE_SIZE):
+    '''Measure how fast files are copied to the output disk
+
+    <srcs>: list of str, source files to read a sample of.
+    <outdir>: str, output folder. A probe file, deleted right after, is
+              written to it, or to its nearest existing parent.
+    <maxbytes>: int, bytes to read and write.
+
+    Return: <rate>: float, bytes per second of reading then writing the
+            sample, None if it could not be measured.
+    '''
+
+    #------------------Read a sample------------------
+    data=[]
+    nread=0
+    t0=time.time()
+    for srcii in srcs:
+        if nread>=maxbytes:
+            break
+        try:
+            with open(srcii,'rb') as fin:
+                while nread<maxbytes:
+                    chunk=fin.read(min(PROBE_BUFSIZE,maxbytes-nread))
+                    if not chunk:
+                        break
+                    data.append(chunk)
+                    nread+=len(chunk)
+        except (IOError,OSError):
+            continue
+    tread=time.time()-t0
+    if nread==0:
+        return None
+
+    #------------Write it to the output disk------------
+    try:
+        fd,probe=tempfile.mkstemp(prefix='.ximaexport-probe',\
+                dir=existingParent(outdir))
+    except (IOError,OSError):
+        return None
+    try:
+        t0=time.time()
+        with os.fdopen(fd,'wb') as fout:
+            for chunk in data:
+                fout.write(chunk)
+            fout.flush()
+            os.fsync(fout.fileno())
+        twrite=time.time()-t0
+    finally:
+        os.remove(probe)
+
+    return nread/max(tread+twrite,1e-6)
+
+
+def savePlan(plan,path):
+    with open(path,'w') as fout:
+        json.dump(plan,fout,indent=1,sort_keys=True)
+
+
+def loadPlan(path):
+    '''Read a saved plan
+
+    Raise: ValueError if the file is not a plan of a supported version.
+    '''
+    with open(path,'r') as fin:
+        plan=json.load(fin)
+    if not isinstance(plan,dict) or plan.get('version')!=PLAN_VERSION:
+        raise ValueError('Not an export plan: %s' %path)
+    return plan
+
+
+def formatSize(nbytes):
+    for unit in ['B','KB','MB','GB']:
+        if abs(nbytes)<1024.:
+            return '%.1f %s' %(nbytes,unit)
+        nbytes/=1024.
+    return '%.1f TB' %nbytes
+
+
+def formatTime(seconds):
+    seconds=int(round(seconds))
+    return '%d:%02d:%02d' %(seconds//3600,seconds%3600//60,seconds%60)
@@ -0,0 +1,144 @@
+'''
+Progress events and cancellation of an export.
+
+Progress counts albums, tracks and bytes done, and sends them as event
+dicts to a callback, e.g. the put() of a Queue read by the GUI. Every
+event has the keys:
+    'type': 'start', 'album', 'track', 'bytes', 'done' or 'cancelled'.
+    'album', 'albums': index (1-based) of the current album, and number
+                       of albums.
+    'track', 'tracks': number of tracks done, and number of tracks.
+    'bytes', 'totalbytes': bytes done, and bytes to export.
+    'rate': current throughput in bytes/s.
+    'name': album name ('album' events) or track title ('track' events),
+            else None.
+'bytes' events are sent at most every <interval> seconds.
+
+CancelToken is shared by the export threads, which check it between
+tracks and between the chunks of copies and downloads.
+
+Update time: 2016-09-06 20:15:33.
+'''
+import time
+import threading
+
+#-------------Min seconds between two 'bytes' events-------------
+PROGRESS_INTERVAL=0.2
+
+#-------Weight of the newest measure in the smoothed throughput-------
+RATE_WEIGHT=0.3
+
+
+
+class Cancelled(Exception):
+    pass
+
+
+
+class CancelToken(object):
+    '''Flag asking a running export to stop'''
+
+    def __init__(self):
+        self._event=threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def isCancelled(self):
+        return self._event.is_set()
+
+    def wait(self,timeout):
+        '''Sleep <timeout> seconds, or until cancelled
+
+        Return: True if cancelled.
+        '''
+        self._event.wait(timeout)
+        return self._event.is_set()
+
+    def check(self):
+        '''Raise Cancelled if the export was cancelled'''
+        if self._event.is_set():
+            raise Cancelled('Export cancelled')
+
+
+
+class Progress(object):
+    '''Counter of the progress of an export, emitting events
+
+    <callback>: callable or None, called with each event dict, from the
+                thread reporting the progress.
+    <interval>: float, min seconds between two 'bytes' events.
+
+    Methods are safe to call from the export worker threads.
+    '''
+
+    def __init__(self,callback=None,interval=PROGRESS_INTERVAL):
+        self.callback=callback
+        self.interval=interval
+        self.album=self.albums=0
+        self.track=self.tracks=0
+        self.bytes=self.totalbytes=0
+        self.rate=0.
+        self._lock=threading.Lock()
+        self._lasttime=self._lastemit=time.time()
+        self._lastbytes=0
+
+    def _event(self,etype,name=None):
+        return {'type': etype, 'album': self.album, 'albums': self.albums,\
+                'track': self.track, 'tracks': self.tracks,\
+                'bytes': self.bytes, 'totalbytes': self.totalbytes,\
+                'rate': self.rate, 'name': name}
+
+    def _emit(self,event):
+        if self.callback is not None:
+            self.callback(event)
+
+    def _updateRate(self,now):
+        dt=now-self._lasttime
+        if dt>=self.interval:
+            rate=(self.bytes-self._lastbytes)/dt
+            self.rate=RATE_WEIGHT*rate+(1-RATE_WEIGHT)*self.rate
+            self._lasttime=now
+            self._lastbytes=self.bytes
+
+    def start(self,albums,tracks,totalbytes):
+        with self._lock:
+            self.albums=albums
+            self.tracks=tracks
+            self.totalbytes=totalbytes
+            self._lasttime=self._lastemit=time.time()
+            event=self._event('start')
+        self._emit(event)
+
+    def startAlbum(self,idx,name):
+        with self._lock:
+            self.album=idx
+            event=self._event('album',name)
+        self._emit(event)
+
+    def addBytes(self,nbytes):
+        '''Count bytes copied or downloaded'''
+        event=None
+        with self._lock:
+            self.bytes+=nbytes
+            now=time.time()
+            self._updateRate(now)
+            if now-self._lastemit>=self.interval:
+                self._lastemit=now
+                event=self._event('bytes')
+        if event is not None:
+            self._emit(event)
+
+    def trackDone(self,title,nbytes=0):
+        '''Count a track done, with its <nbytes> not counted yet'''
+        with self._lock:
+            self.track+=1
+            self.bytes+=nbytes
+            self._updateRate(time.time())
+            event=self._event('track',title)
+        self._emit(event)
+
+    def finish(self,cancelled=False):
+        with self._lock:
+            event=self._event('cancelled' if cancelled else 'done')
+        self._emit(event)
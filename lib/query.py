@@ -0,0 +1,179 @@
+'''
+Read-only access to the "ting.sqlite" database, and filters of its rows.
+
+Databases are opened read-only. With Python 3.4+ they are opened with
+a "mode=ro&immutable=1" URI, so SQLite skips the locking and journal
+checks of every query. The database must then not be modified while
+it is open, e.g. by the app on a mounted phone. Python 2 can't open
+URIs: the database is opened as usual, and made read-only with
+"PRAGMA query_only".
+
+TrackFilter selects rows of download_table in the WHERE clause of the
+queries, so rows filtered out are never read into python.
+
+Update time: 2016-09-30 10:18:26.
+'''
+import os
+import sys
+import time
+import sqlite3
+
+
+
+def connectDB(dbfile,immutable=True):
+    '''Open a database read-only
+
+    <dbfile>: str, path to the database file.
+    <immutable>: bool, if True, tell SQLite the file is not modified while
+                 open (Python 3.4+ only). Use False if it may be, e.g. to
+                 watch it for changes.
+
+    Return: <db>: sqlite3 connection.
+
+    Raise: sqlite3.OperationalError if the file does not exist.
+    '''
+
+    if sys.version_info>=(3,4):
+        from pathlib import Path
+        uri='%s?mode=ro' %Path(os.path.abspath(dbfile)).as_uri()
+        if immutable:
+            uri+='&immutable=1'
+        return sqlite3.connect(uri,uri=True)
+
+    #-----Python 2: no uri, don't create a missing file either-----
+    if not os.path.isfile(dbfile):
+        raise sqlite3.OperationalError('unable to open database file: %s'\
+                %dbfile)
+    db=sqlite3.connect(dbfile)
+    db.execute('PRAGMA query_only=ON')
+    return db
+
+
+def parseRange(text):
+    '''Parse a trackId range "N", "N-M", "N-" or "-M"
+
+    Return: (first, last), either None if open.
+
+    Raise: ValueError if not a range.
+    '''
+    first,sep,last=text.strip().partition('-')
+    first=int(first) if first.strip() else None
+    if not sep:
+        return first,first
+    last=int(last) if last.strip() else None
+    return first,last
+
+
+def parseSince(text):
+    '''Parse a date "YYYY-MM-DD" or a createTime value
+
+    Return: <createtime>: int, in milliseconds since the epoch, as saved
+            in the createTime column.
+
+    Raise: ValueError if not a date or int.
+    '''
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    return int(time.mktime(time.strptime(text,'%Y-%m-%d'))*1000)
+
+
+def placeholders(values):
+    return ', '.join(['?']*len(values))
+
+
+
+class TrackFilter(object):
+    '''Filter of the rows of download_table
+
+    <albums>: list of str or None, names of the albums to select.
+    <albumids>: list of int or None, ids of the albums to select. A row
+                matches if its album is in either <albums> or <albumids>.
+    <complete>: bool, if True, only select rows completely downloaded,
+                according to the database (downloadedBytes>=totalBytes).
+    <trackids>: list of (first, last) or None, trackId ranges to select,
+                see parseRange().
+    <since>: int or None, only select rows with createTime >= <since>.
+
+    Rows must match all the given criteria. With no criteria, all rows
+    are selected.
+    '''
+
+    def __init__(self,albums=None,albumids=None,complete=False,\
+            trackids=None,since=None):
+        self.albums=list(albums or [])
+        self.albumids=list(albumids or [])
+        self.complete=complete
+        self.trackids=list(trackids or [])
+        self.since=since
+
+    def withAlbums(self,albums):
+        '''Copy of the filter, selecting also the albums named <albums>'''
+        if isinstance(albums,(str,type(u''))):
+            albums=[albums]
+        return TrackFilter(self.albums+list(albums),self.albumids,\
+                self.complete,self.trackids,self.since)
+
+    def withTracks(self,trackids):
+        '''Copy of the filter, selecting the trackId ranges <trackids>
+        instead of its own'''
+        return TrackFilter(self.albums,self.albumids,self.complete,\
+                trackids,self.since)
+
+    def isEmpty(self):
+        return not (self.albums or self.albumids or self.complete or\
+                self.trackids or self.since is not None)
+
+    def where(self):
+        '''Get the WHERE clause of the filter
+
+        Return: (clause, params): <clause> is '' if the filter is empty,
+                else 'WHERE ...' with '?' placeholders for <params>.
+        '''
+
+        terms=[]
+        params=[]
+
+        albums=[]
+        if self.albums:
+            albums.append('albumName IN (%s)' %placeholders(self.albums))
+            params.extend(self.albums)
+        if self.albumids:
+            albums.append('albumId IN (%s)' %placeholders(self.albumids))
+            params.extend(self.albumids)
+        if albums:
+            terms.append('(%s)' %' OR '.join(albums))
+
+        if self.complete:
+            terms.append('downloadedBytes>=totalBytes')
+
+        ranges=[]
+        for first,last in self.trackids:
+            if first is not None and last is not None:
+                ranges.append('trackId BETWEEN ? AND ?')
+                params.extend([first,last])
+            elif first is not None:
+                ranges.append('trackId>=?')
+                params.append(first)
+            elif last is not None:
+                ranges.append('trackId<=?')
+                params.append(last)
+        if ranges:
+            terms.append('(%s)' %' OR '.join(ranges))
+
+        if self.since is not None:
+            terms.append('createTime>=?')
+            params.append(self.since)
+
+        if not terms:
+            return '',[]
+        return 'WHERE %s' %' AND '.join(terms),params
+
+
+
+def whereClause(filters):
+    '''WHERE clause and params of a TrackFilter or None'''
+    if filters is None:
+        return '',[]
+    return filters.where()
@@ -0,0 +1,93 @@
+'''
+Process pool to export and tag audios in.
+
+Writing metadata with mutagen parses the atoms and embeds the cover of
+every file, which is CPU bound and serialized by the GIL in the export
+threads. The tag stage runs these jobs in worker processes instead, and
+hands their results back to the main process.
+
+Update time: 2016-08-19 17:20:48.
+'''
+import threading
+import multiprocessing
+
+
+
+def _call(func,args):
+    '''Run a job in a worker process, return (ok, result or message)'''
+    try:
+        return True,func(*args)
+    except Exception as e:
+        return False,'%s: %s' %(type(e).__name__,e)
+
+
+
+class TagStage(object):
+    '''Pool of processes consuming export and tag jobs
+
+    <procs>: int or None, number of worker processes. If None, use one
+             per CPU core.
+    <maxpending>: int or None, max number of jobs submitted but not
+                  finished yet. submit() blocks when reached, so the
+                  export threads are throttled by the tag processes.
+                  Default to 4*<procs>.
+
+    Jobs are submitted with submit(func,args,callback). <func> and <args>
+    are pickled to the worker processes, so <func> must be a module level
+    function. callback(result) is called in the main process, from a
+    thread of the pool, once the job returns.
+    Create the stage before starting any other thread, as the worker
+    processes are forked from the calling process.
+    Call close() to wait for all submitted jobs to finish. An exception
+    raised by a job or a callback is re-raised by close().
+    '''
+
+    def __init__(self,procs=None,maxpending=None):
+        if procs is None:
+            try:
+                procs=multiprocessing.cpu_count()
+            except NotImplementedError:
+                procs=1
+        self.procs=max(1,int(procs))
+        if maxpending is None:
+            maxpending=4*self.procs
+        self.errors=[]
+        self._slots=threading.BoundedSemaphore(max(1,maxpending))
+        self._pool=multiprocessing.Pool(self.procs)
+
+    def submit(self,func,args,callback=None):
+        self._slots.acquire()
+
+        def done(result):
+            try:
+                ok,value=result
+                if not ok:
+                    raise RuntimeError(value)
+                if callback is not None:
+                    callback(value)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self._slots.release()
+
+        try:
+            self._pool.apply_async(_call,(func,args),callback=done)
+        except:
+            self._slots.release()
+            raise
+
+    def close(self):
+        '''Wait for all submitted jobs and stop the worker processes'''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool=None
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def terminate(self):
+        '''Stop the worker processes, dropping pending jobs'''
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool=None
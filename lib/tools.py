@@ -1,10 +1,18 @@
 '''
 Utility functions.
 
-Update time: 2016-03-24 11:11:46.
+Update time: 2016-09-13 10:05:51.
 '''
 import os
+import sys
 import re
+import json
+import threading
+from textwrap import TextWrapper
+from lib.metrics import timer
+
+#-----Serialize prints from concurrent export workers-----
+_printlock=threading.RLock()
 
 
 
@@ -20,101 +28,163 @@ def enu(text):
     else:
         return text
 
+def decodeArg(text):
+    '''Decode a command line argument, bytes in python 2, to unicode'''
+    if isinstance(text,bytes):
+        return text.decode(sys.getfilesystemencoding() or 'utf8','replace')
+    return text
 
-def printHeader(s, level=1, length=70, prefix='# <XimaExport>:'):
-    from textwrap import TextWrapper
 
-    decs={1: '=', 2: '-', 3: '.'}
-    indents={1: 0, 2: 4, 3: 8}
-
-    dec=decs[level]
-    ind=indents[level]
-    indstr=' '*int(ind)
-
-    wrapper=TextWrapper()
-    wrapper.width=length-ind
-    wrapper.initial_indent=indstr
-    wrapper.subsequent_indent=indstr
-
-    #-------------Get delimiter line-------------
-    hline='%s%s' %(' '*int(ind),dec*int(length-ind)) 
-
-    #--------------------Wrap texts--------------------
-    strings=wrapper.wrap('%s %s' %(prefix,s))
-
-    #----------------------Print----------------------
-    try:
-        print('\n'+hline)
-    except:
-        print('\n'+hline.encode('ascii','replace'))
-    for ss in strings:
-        try:
-            print(ss)
-        except:
-            print(ss.encode('ascii','replace'))
-    #print(hline)
+#-----------------Modes of the console/log formatter-----------------
+FORMAT_MODES=['text','quiet','json']
 
-    return
+#------Whitespace TextWrapper replaces, short texts are wrapped as is------
+_SPECIALWS=re.compile(r'[\t\n\x0b\x0c\r]')
 
-def printNumHeader(s, idx, num, level=1, length=70, prefix='# <XimaExport>:'):
-    from textwrap import TextWrapper
 
-    decs={1: '=', 2: '-', 3: '.'}
-    indents={1: 0, 2: 4, 3: 8}
-
-    dec=decs[level]
-    ind=indents[level]
-    indstr=' '*int(ind)
-
-    wrapper=TextWrapper()
-    wrapper.width=length-ind
-    wrapper.initial_indent=indstr
-    wrapper.subsequent_indent=indstr
-
-    #-------------Get delimiter line-------------
-    decl=int((length-ind-2-len(str(idx))-len(str(num)))/2.)
-    decl=decl*dec
-
-    hline1='%s%s %d/%d %s' %(' '*int(ind),decl,idx,num,decl) 
-    #hline2='%s%s' %(' '*int(ind),dec*int(length-ind)) 
-
-    #--------------------Wrap texts--------------------
-    strings=wrapper.wrap('%s %s' %(prefix,s))
-
-    #----------------------Print----------------------
-    try:
-        print('\n'+hline1)
-    except:
-        print('\n'+hline1.encode('ascii','replace'))
-    for ss in strings:
-        try:
-            print(ss)
-        except:
-            print(ss.encode('ascii','replace'))
-    #print(hline2)
 
-    return
+class Formatter(object):
+    '''Formatter of the console/log messages
 
+    <mode>: str, one of FORMAT_MODES:
+            'text': the usual indented and wrapped text.
+            'quiet': print nothing, messages are not even formatted.
+            'json': one json object per message, with keys 'type'
+                    ('header', 'numheader', 'ind' or 'table'), 'level',
+                    'text', and 'index' and 'total' for 'numheader'.
 
-def printInd(s, level=1, length=70, prefix=''):
-    from textwrap import TextWrapper
+    Text wrappers are built once per width and indent, and reused by all
+    messages. Texts fitting on one line skip the wrapping. Prints are
+    serialized, so messages of concurrent export workers are not
+    interleaved.
+    '''
+
+    decs={1: '=', 2: '-', 3: '.'}
+    headerindents={1: 0, 2: 4, 3: 8}
     indents={1: 0, 2: 4, 3: 8, 4: 12, 5: 16}
 
-    ind=indents[level]
-    indstr=' '*int(ind)
+    def __init__(self,mode='text'):
+        if mode not in FORMAT_MODES:
+            raise ValueError('Unknown format mode: %s' %mode)
+        self.mode=mode
+        self._wrappers={}
+
+    def _wrapper(self,width,ind):
+        wrapper=self._wrappers.get((width,ind))
+        if wrapper is None:
+            indstr=' '*int(ind)
+            wrapper=TextWrapper(width=width,initial_indent=indstr,\
+                    subsequent_indent=indstr)
+            self._wrappers[(width,ind)]=wrapper
+        return wrapper
+
+    def _wrap(self,text,width,ind):
+        '''Wrap <text> as TextWrapper would, lines fitting <width> as is'''
+        if len(text)+ind<=width and text.strip() and\
+                not text[-1].isspace() and not _SPECIALWS.search(text):
+            return [' '*int(ind)+text]
+        return self._wrapper(width,ind).wrap(text)
+
+    def _print(self,string):
+        with timer('print'),_printlock:
+            try:
+                print(string)
+            except:
+                print(string.encode('ascii','replace'))
+
+    def _printJson(self,mtype,s,level,**extra):
+        if isinstance(s,bytes):
+            s=s.decode('utf8','replace')
+        record={'type': mtype, 'level': level, 'text': u'%s' %s}
+        record.update(extra)
+        with timer('print'),_printlock:
+            print(json.dumps(record))
+
+    def header(self,s,level=1,length=70,prefix='# <XimaExport>:'):
+        if self.mode=='quiet':
+            return
+        if self.mode=='json':
+            return self._printJson('header',s,level)
+
+        ind=self.headerindents[level]
+
+        #-------------Get delimiter line-------------
+        hline='%s%s' %(' '*int(ind),self.decs[level]*int(length-ind))
+
+        #--------------------Wrap texts--------------------
+        strings=self._wrap('%s %s' %(prefix,s),length-ind,ind)
+
+        self._print('\n'.join(['\n'+hline]+strings))
+
+    def numHeader(self,s,idx,num,level=1,length=70,\
+            prefix='# <XimaExport>:'):
+        if self.mode=='quiet':
+            return
+        if self.mode=='json':
+            return self._printJson('numheader',s,level,index=idx,total=num)
 
-    wrapper=TextWrapper()
-    wrapper.width=length
-    wrapper.initial_indent=indstr
-    wrapper.subsequent_indent=indstr
+        ind=self.headerindents[level]
 
-    string=wrapper.fill('%s %s' %(prefix,s))
-    try:
-        print('\n'+string)
-    except:
-        print('\n'+string.encode('ascii','replace'))
+        #-------------Get delimiter line-------------
+        decl=int((length-ind-2-len(str(idx))-len(str(num)))/2.)
+        decl=decl*self.decs[level]
+        hline1='%s%s %d/%d %s' %(' '*int(ind),decl,idx,num,decl)
+
+        #--------------------Wrap texts--------------------
+        strings=self._wrap('%s %s' %(prefix,s),length-ind,ind)
+
+        self._print('\n'.join(['\n'+hline1]+strings))
+
+    def ind(self,s,level=1,length=70,prefix=''):
+        if self.mode=='quiet':
+            return
+        if self.mode=='json':
+            return self._printJson('ind',s,level)
+
+        strings=self._wrap('%s %s' %(prefix,s),length,self.indents[level])
+        self._print('\n'+'\n'.join(strings))
+
+    def table(self,lines,level=1):
+        '''Print the lines of a table as they are, indented'''
+        if self.mode=='quiet':
+            return
+        if self.mode=='json':
+            return self._printJson('table',u'\n'.join(lines),level)
+
+        indstr=' '*int(self.indents[level])
+        self._print('\n'+'\n'.join([indstr+ll for ll in lines]))
+
+
+#-------------Formatter used by the print functions below-------------
+_formatter=Formatter()
+
+
+def getFormatter():
+    return _formatter
+
+
+def setFormatter(formatter):
+    '''Set the formatter used by printHeader(), printInd(), ...
+
+    <formatter>: Formatter, or str, a mode of FORMAT_MODES.
+    '''
+    global _formatter
+    if not isinstance(formatter,Formatter):
+        formatter=Formatter(formatter)
+    _formatter=formatter
+
+
+def printHeader(s, level=1, length=70, prefix='# <XimaExport>:'):
+    _formatter.header(s,level,length,prefix)
+
+def printNumHeader(s, idx, num, level=1, length=70, prefix='# <XimaExport>:'):
+    _formatter.numHeader(s,idx,num,level,length,prefix)
+
+def printInd(s, level=1, length=70, prefix=''):
+    _formatter.ind(s,level,length,prefix)
 
-    return 
+def printTable(lines, level=1):
+    _formatter.table(lines,level)
 
 
 #-------------------Read in text file and store data-------------------
@@ -0,0 +1,204 @@
+'''
+Watch a library for new downloads, to export them as they come.
+
+The watcher polls, every <interval> seconds, a cheap signature of the
+library: the size, mtime and inode of each "ting.sqlite" file and of its
+write-ahead log, the "PRAGMA data_version" of the database, and the
+mtime of the "Download" folder. data_version changes when the app, or
+another process, commits to the database, mtime and inode when the
+file is written or replaced, e.g. by rsync. Nothing else is read while
+the library is idle.
+
+A change is only acted upon once the signature has been stable for
+<debounce> seconds, so a sync copying many files triggers one export,
+or after <maxwait> seconds if it keeps changing.
+
+The tracks to export are then found by comparing snapshots of the rows
+and source files, see trackSnapshot() and changedTracks().
+
+Databases are watched with immutable=False (see lib.query.connectDB()),
+as they are expected to change while open.
+
+Update time: 2016-10-04 14:37:52.
+'''
+import os
+import time
+import sqlite3
+from lib.query import connectDB, whereClause
+
+#-----------------Seconds between two polls-----------------
+POLL_INTERVAL=2.
+
+#----------Seconds without change before exporting----------
+DEBOUNCE=5.
+
+#--------Max seconds to wait for the library to settle--------
+MAX_WAIT=60.
+
+#------Max trackId ranges to select, else the whole library------
+MAX_RANGES=200
+
+
+
+def _stat(path):
+    try:
+        st=os.stat(path)
+    except OSError:
+        return None
+    return st.st_size,st.st_mtime,st.st_ino
+
+
+
+class LibraryWatcher(object):
+    '''Poller of the changes of a library
+
+    <dbfiles>: list of str, paths to the "ting.sqlite" database files.
+    <interval>: float, seconds between two polls.
+    <debounce>: float, seconds the library must be unchanged before a
+                change is reported.
+    <maxwait>: float, max seconds between the first change and its
+               report, if the library keeps changing.
+    '''
+
+    def __init__(self,dbfiles,interval=POLL_INTERVAL,debounce=DEBOUNCE,\
+            maxwait=MAX_WAIT):
+        self.dbfiles=dbfiles
+        self.interval=interval
+        self.debounce=debounce
+        self.maxwait=maxwait
+        self._dbs={}
+        self.baseline=None
+
+    def _dataVersion(self,dbfile,stat):
+        '''data_version of <dbfile>, reopened if the file was replaced'''
+        db,inode=self._dbs.get(dbfile,(None,None))
+        if stat is None or stat[2]!=inode:
+            if db is not None:
+                db.close()
+            db=None
+        try:
+            if db is None:
+                db=connectDB(dbfile,immutable=False)
+                self._dbs[dbfile]=(db,stat and stat[2])
+            return db.execute('PRAGMA data_version').fetchone()[0]
+        except (sqlite3.Error,TypeError):
+            # missing file, or SQLite older than 3.8.4
+            self._dbs.pop(dbfile,None)
+            return None
+
+    def signature(self):
+        '''Get the current signature of the library'''
+        sig=[]
+        for dbfile in self.dbfiles:
+            stat=_stat(dbfile)
+            dldir=os.path.join(os.path.dirname(os.path.abspath(dbfile)),\
+                    'Download')
+            sig.append((stat,_stat(dbfile+'-wal'),\
+                    self._dataVersion(dbfile,stat),_stat(dldir)))
+        return sig
+
+    def mark(self):
+        '''Take the current state as the one changes are compared to
+
+        Call it before reading the library, so changes made while
+        reading are reported by the next wait().
+        '''
+        self.baseline=self.signature()
+
+    def wait(self,cancel=None):
+        '''Wait for the library to change, then settle
+
+        <cancel>: CancelToken or None, stop waiting once cancelled.
+
+        Return: True if the library changed since mark(), False if
+                cancelled.
+        '''
+
+        last=self.baseline
+        first=lastchange=None
+        while True:
+            if cancel is not None:
+                if cancel.wait(self.interval):
+                    return False
+            else:
+                time.sleep(self.interval)
+
+            sig=self.signature()
+            now=time.time()
+            if sig!=last:
+                last=sig
+                lastchange=now
+                if first is None:
+                    first=now
+            if first is not None and (now-lastchange>=self.debounce or\
+                    now-first>=self.maxwait):
+                return True
+
+    def close(self):
+        for db,inode in self._dbs.values():
+            db.close()
+        self._dbs={}
+
+
+
+def trackSnapshot(db,dlindex,where=None):
+    '''State of the tracks of a library, to compare with a later one
+
+    <db>: sqlite3 connection to the library.
+    <dlindex>: DownloadIndex or MultiIndex of the "Download" folder(s).
+    <where>: lib.query.TrackFilter or None, rows to include.
+
+    Return: <snapshot>: dict, trackId -> (row, stat): all the columns of
+            the row, and (size, mtime, inode) of its source file or None.
+            Rows without trackId are keyed by (None, rowid).
+    '''
+
+    clause,params=whereClause(where)
+    cursor=db.execute('SELECT rowid, * FROM download_table %s' %clause,\
+            params)
+    columns=[cc[0] for cc in cursor.description]
+    idxid=columns.index('trackId')
+    idxpath=columns.index('filepath')
+
+    snapshot={}
+    for row in cursor:
+        key=row[idxid] if row[idxid] is not None else (None,row[0])
+        stat=dlindex.stat(row[idxpath]) if row[idxpath] else None
+        snapshot[key]=(tuple(row[1:]),stat)
+    return snapshot
+
+
+def changedTracks(old,new):
+    '''trackIds of the tracks new or changed between two snapshots
+
+    Return: <trackids>: sorted list of int, or None if a row without
+            trackId changed: it can only be exported with the whole
+            library. Removed tracks are ignored.
+    '''
+
+    trackids=[]
+    for key,value in new.items():
+        if old.get(key)==value:
+            continue
+        if isinstance(key,tuple):
+            return None
+        trackids.append(key)
+    return sorted(trackids)
+
+
+def trackRanges(trackids,maxranges=MAX_RANGES):
+    '''Join sorted trackIds into ranges of consecutive ids
+
+    Return: <ranges>: list of (first, last), or None if more than
+            <maxranges>.
+    '''
+
+    ranges=[]
+    for tid in trackids:
+        if ranges and tid==ranges[-1][1]+1:
+            ranges[-1]=(ranges[-1][0],tid)
+        else:
+            ranges.append((tid,tid))
+    if len(ranges)>maxranges:
+        return None
+    return ranges
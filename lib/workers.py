@@ -0,0 +1,76 @@
+'''
+Bounded worker pool used to run export jobs concurrently.
+
+Update time: 2016-07-20 10:02:13.
+'''
+import sys
+import threading
+
+if sys.version_info[0]>=3:
+    import queue as Queue
+else:
+    import Queue
+
+
+
+class WorkerPool(object):
+    '''Fixed size pool of threads consuming jobs from a bounded queue
+
+    <jobs>: int, number of worker threads. If <=1, jobs are run
+            inline in the calling thread, which gives exactly the serial
+            behaviour.
+
+    Jobs are submitted with submit(func,*args). The queue holds at most
+    2*<jobs> pending jobs, so a producer reading the database is throttled
+    by the workers instead of queueing up the whole library.
+    Call join() to wait for all submitted jobs to finish. An exception
+    raised by a job is re-raised by join(), as it would be in a serial run.
+    '''
+
+    def __init__(self,jobs=1):
+        self.jobs=max(1,int(jobs))
+        self.errors=[]
+        self._threads=[]
+
+        if self.jobs>1:
+            self._q=Queue.Queue(maxsize=2*self.jobs)
+            for ii in range(self.jobs):
+                tii=threading.Thread(target=self._work,name='export-%d' %ii)
+                tii.daemon=True
+                tii.start()
+                self._threads.append(tii)
+
+    def _work(self):
+        while True:
+            job=self._q.get()
+            try:
+                if job is None:
+                    return
+                func,args=job
+                func(*args)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self._q.task_done()
+
+    def submit(self,func,*args):
+        if self.jobs>1:
+            self._q.put((func,args))
+        else:
+            func(*args)
+
+    def join(self):
+        '''Wait for all jobs submitted so far'''
+        if self.jobs>1:
+            self._q.join()
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def close(self):
+        '''Wait for pending jobs and stop the worker threads'''
+        if self.jobs>1 and self._threads:
+            for tii in self._threads:
+                self._q.put(None)
+            for tii in self._threads:
+                tii.join()
+            self._threads=[]
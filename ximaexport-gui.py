@@ -19,14 +19,16 @@ Update time: 2016-07-12 11:18:42.
 
 
 import sys,os
-from ttk import Style, Combobox
+from ttk import Style, Combobox, Progressbar
 from tkFileDialog import askopenfilename, askdirectory
 import tkMessageBox
 import ximaexport
+from lib.progress import CancelToken
+from lib.planner import formatSize
+from lib.logpipe import LogPipe, newLogFile
+from lib.query import connectDB
 import Queue
 import threading
-import sqlite3
-import pandas as pd
 if sys.version_info[0]>=3:
     import tkinter as tk
     from tkinter import Frame
@@ -37,57 +39,52 @@ else:
 
 stdout=sys.stdout
 
+#--------------Milliseconds between polls of the log--------------
+POLL_INTERVAL=100
+
+#---------Max number of lines kept in the message widget---------
+MAX_TEXT_LINES=5000
+
 def printch(x):
     print(x.decode('gbk'))
 dgbk=lambda x: x.decode('gbk')
 
 
-class Redirector(object):
-    def __init__(self,q):
-        self.q=q
-
-    def write(self,string):
-        self.q.put(string)
-
-    '''
-    def flush(self):
-        with self.q.mutex:
-            self.q.queue.clear()
-    '''
-
-
-
-
 class WorkThread(threading.Thread):
-    def __init__(self,name,exitflag,stateq):
+    def __init__(self,name,exitflag,stateq,progressq):
         threading.Thread.__init__(self)
         self.name=name
         self.exitflag=exitflag
-        self._stop=threading.Event()
+        self.cancel=CancelToken()
         self.stateq=stateq
+        self.progressq=progressq
 
     def run(self):
         #print('\nStart processing...')
         printch('\nʼ...')
-        if not self._stop.is_set():
-            ximaexport.main(*self.args)
+        try:
+            if not self.cancel.isCancelled():
+                ximaexport.main(*self.args,onprogress=self.progressq.put,\
+                        cancel=self.cancel)
+        finally:
             self.stateq.put('done')
 
     def stop(self):
+        '''Ask the export to stop, it returns within a second'''
         self.exitflag=True
-        self._stop.set()
+        self.cancel.cancel()
 
 
 
 class MainFrame(Frame):
-    def __init__(self,parent,stdoutq):
+    def __init__(self,parent,logpipe):
         Frame.__init__(self,parent)
 
         self.parent=parent
         self.width=750
         self.height=450
         self.title=ximaexport.__version__
-        self.stdoutq=stdoutq
+        self.logpipe=logpipe
         
         self.initUI()
 
@@ -97,10 +94,12 @@ class MainFrame(Frame):
 
         self.path_frame=self.addPathFrame()
         self.action_frame=self.addActionFrame()
+        self.progress_frame=self.addProgressFrame()
         self.message_frame=self.addMessageFrame()
         self.printStr()
 
         self.stateq=Queue.Queue()
+        self.progressq=Queue.Queue()
 
 
     def centerWindow(self):
@@ -122,15 +121,18 @@ class MainFrame(Frame):
 
 
     def printStr(self):
-        while self.stdoutq.qsize() and self.exit==False:
-            try:
-                msg=self.stdoutq.get()
-                self.text.update()
-                self.text.insert(tk.END,msg)
+        '''Show the log printed since last poll, in one insert'''
+        if self.exit==False:
+            text=self.logpipe.drain()
+            if text:
+                self.text.insert(tk.END,text)
+
+                #--------Keep the last MAX_TEXT_LINES lines only--------
+                nlines=int(self.text.index('end-1c').split('.')[0])
+                if nlines>MAX_TEXT_LINES:
+                    self.text.delete('1.0','%d.0' %(nlines-MAX_TEXT_LINES+1))
                 self.text.see(tk.END)
-            except Queue.Empty:
-                pass
-        self.after(100,self.printStr)
+        self.after(POLL_INTERVAL,self.printStr)
 
 
 
@@ -202,8 +204,8 @@ class MainFrame(Frame):
     def probeAlbums(self):
         dbfile=self.db_entry.get()
         try:
-            db=sqlite3.connect(dbfile)
-            df=ximaexport.getData(db)
+            db=connectDB(dbfile)
+            df=ximaexport.getAlbumRows(db)
             self.albumlist=ximaexport.getAlbumList(df,None)   #(id, name)
             self.albumnames=['All']+[ii[1] for ii in self.albumlist] #names to display
             self.albummenu['values']=tuple(self.albumnames)
@@ -250,6 +252,14 @@ class MainFrame(Frame):
         self.albummenu.current(0)
         self.albummenu.bind('<<ComboboxSelected>>',self.setAlbum)
         self.albummenu.pack(side=tk.LEFT,padx=8)
+
+        #-------------------Jobs options-------------------
+        jobslabel=tk.Label(subframe,text=dgbk(':'),\
+                bg='#bbb')
+        jobslabel.pack(side=tk.LEFT, padx=8)
+
+        self.jobs=tk.Spinbox(subframe,from_=1,to=32,width=4)
+        self.jobs.pack(side=tk.LEFT,padx=8)
         
         #-------------------Quit button-------------------
         quit_button=tk.Button(subframe,text=dgbk('˳'),\
@@ -257,11 +267,9 @@ class MainFrame(Frame):
         quit_button.pack(side=tk.RIGHT,padx=8)
 
         #-------------------Stop button-------------------
-        '''
-        self.stop_button=tk.Button(subframe,text='Stop',\
-                command=self.stop)
+        self.stop_button=tk.Button(subframe,text=dgbk('ֹͣ'),\
+                command=self.stop,state=tk.DISABLED)
         self.stop_button.pack(side=tk.RIGHT,padx=8)
-        '''
                 
         #-------------------Start button-------------------
         self.start_button=tk.Button(subframe,text=dgbk('ʼ'),\
@@ -321,13 +329,22 @@ class MainFrame(Frame):
         self.start_button.configure(state=tk.DISABLED)
         self.help_button.configure(state=tk.DISABLED)
         self.albummenu.configure(state=tk.DISABLED)
+        self.jobs.configure(state=tk.DISABLED)
+        self.stop_button.configure(state=tk.NORMAL)
         self.messagelabel.configure(text=dgbk('Ϣ (...)'))
+        self.progressbar.configure(value=0)
+        self.progresslabel.configure(text='')
 
         album=None if self.album=='All' else self.album
 
-        args=[dbfile,outdir,album,True]
+        try:
+            jobs=max(1,int(self.jobs.get()))
+        except ValueError:
+            jobs=1
 
-        self.workthread=WorkThread('work',False,self.stateq)
+        args=[dbfile,outdir,album,True,jobs]
+
+        self.workthread=WorkThread('work',False,self.stateq,self.progressq)
         self.workthread.deamon=True
 
         self.workthread.args=args
@@ -336,6 +353,7 @@ class MainFrame(Frame):
 
 
     def reset(self):
+        self.showProgress()
         while self.stateq.qsize() and self.exit==False:
             try:
                 msg=self.stateq.get()
@@ -345,18 +363,65 @@ class MainFrame(Frame):
                     self.start_button.configure(state=tk.NORMAL)
                     self.help_button.configure(state=tk.NORMAL)
                     self.albummenu.configure(state='readonly')
+                    self.jobs.configure(state=tk.NORMAL)
+                    self.stop_button.configure(state=tk.DISABLED)
                     self.messagelabel.configure(text=dgbk('Ϣ'))
+                    self.showProgress()
                     return
             except Queue.Empty:
                 pass
-        self.after(100,self.reset)
+        self.after(POLL_INTERVAL,self.reset)
 
 
     
+    def showProgress(self):
+        '''Show the latest progress event, older ones are dropped'''
+        event=None
+        while self.progressq.qsize():
+            try:
+                event=self.progressq.get_nowait()
+            except Queue.Empty:
+                break
+        if event is None:
+            return
+
+        if event['totalbytes']>0:
+            fraction=float(event['bytes'])/event['totalbytes']
+        elif event['tracks']>0:
+            fraction=float(event['track'])/event['tracks']
+        else:
+            fraction=0.
+        self.progressbar.configure(value=min(1.,fraction)*1000)
+
+        text=dgbk('ר %d/%d    Ƶ %d/%d    %s / %s    %s/s')\
+                %(event['album'],event['albums'],event['track'],\
+                event['tracks'],formatSize(event['bytes']),\
+                formatSize(event['totalbytes']),formatSize(event['rate']))
+        if event['type']=='cancelled':
+            text=text+dgbk('    ֹͣ')
+        self.progresslabel.configure(text=text)
+
+
     def stop(self):
-        #self.workthread.stop()
-        pass
-        
+        if hasattr(self,'workthread') and self.workthread.is_alive():
+            self.workthread.stop()
+            self.stop_button.configure(state=tk.DISABLED)
+            self.messagelabel.configure(text=dgbk('Ϣ (ֹͣ...)'))
+
+
+    def addProgressFrame(self):
+        frame=Frame(self)
+        frame.pack(fill=tk.X,side=tk.TOP,expand=0,padx=8,pady=5)
+
+        self.progressbar=Progressbar(frame,orient=tk.HORIZONTAL,\
+                mode='determinate',maximum=1000)
+        self.progressbar.pack(side=tk.TOP,fill=tk.X)
+
+        self.progresslabel=tk.Label(frame,text='',anchor=tk.W)
+        self.progresslabel.pack(side=tk.TOP,fill=tk.X)
+
+        return frame
+
 
     def addMessageFrame(self):
         frame=Frame(self)
@@ -381,14 +446,19 @@ class MainFrame(Frame):
 
 def main():
 
-    stdoutq=Queue.Queue()
-    sys.stdout=Redirector(stdoutq)
+    logpipe=LogPipe(newLogFile())
+    sys.stdout=logpipe
+    if logpipe.logfile is not None:
+        #print('Log file: %s' %logpipe.logfile)
+        printch('־ļ:')
+        print('   '+logpipe.logfile)
 
     root=tk.Tk()
-    mainframe=MainFrame(root,stdoutq)
+    mainframe=MainFrame(root,logpipe)
     mainframe.pack()
 
     root.mainloop()
+    logpipe.close()
 
 
 if __name__=='__main__':
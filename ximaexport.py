@@ -19,24 +19,60 @@ __version__='XimaExport v1.0'
 
 #----------------------Import----------------------
 import sys,os
-import shutil
-import pandas as pd
+import time
 import sqlite3
+import atexit
+import tempfile
 import argparse
-from lib.tools import printHeader, printInd, printNumHeader
+from lib.tools import printHeader, printInd, printNumHeader, printTable
 from lib import tools
+from lib.workers import WorkerPool
+from lib.manifest import Manifest
+from lib.fileops import exportFile, reflinkFile, EXPORT_MODES, LINK_MODES
+from lib.mp4stream import tagStream, TaggedStream, MP4StreamError
+from lib.cover import CoverCache, COVER_CACHE_DIR
+from lib.download import Downloader, MAX_DOWNLOADS
+from lib.tagstage import TagStage
+from lib.dlindex import DownloadIndex, statFile
+from lib.merge import mergeDatabases
+from lib.archive import Archive, archiveFormat
+from lib.query import connectDB, TrackFilter, whereClause, parseRange,\
+        parseSince
+from lib.metrics import Metrics, Profiler, timer, timedIter, timedCall,\
+        record, getMetrics, setMetrics
+from lib.iosched import IOScheduler, DEVICE_JOBS, inodeOrder
+from lib.watch import LibraryWatcher, POLL_INTERVAL, DEBOUNCE,\
+        trackSnapshot, changedTracks, trackRanges
+from lib.progress import Progress, Cancelled
+from lib.journal import Journal, partName, commitFile
+from lib.planner import PLAN_VERSION, diskFree, findCollisions,\
+        measureThroughput, savePlan, loadPlan, formatSize, formatTime
+from lib.dedup import DEDUP_MODES, HashCache, DuplicateSet, findDuplicates,\
+        saveReport
 from urllib import urlretrieve
 import re
-try:
-    import mutagen
-    HAS_MUTAGEN=True
-except:
-    HAS_MUTAGEN=False
+from itertools import groupby
+from collections import OrderedDict, namedtuple
+
+#----pandas and mutagen are slow to import, they are imported on use----
+_HAS_MUTAGEN=None
+
+def hasMutagen():
+    '''Check if mutagen is available, importing it on the first call'''
+    global _HAS_MUTAGEN
+    if _HAS_MUTAGEN is None:
+        try:
+            import mutagen
+            _HAS_MUTAGEN=True
+        except:
+            _HAS_MUTAGEN=False
+    return _HAS_MUTAGEN
 
 if sys.version_info[0]>=3:
     #---------------------Python3---------------------
     from urllib.parse import unquote
     from urllib.parse import urlparse
+    unicode=str
 else:
     #--------------------Python2.7--------------------
     from urllib import unquote
@@ -48,8 +84,23 @@ else:
 #------------Replace invalid symbols in paths------------
 REPATTERN=re.compile(r'[\,/,:,*,?,",<,>,|,\\]',re.UNICODE)
 
-#-------Fetch a column from pandas dataframe-------
-fetchField=lambda x, f: x[f].unique().tolist()
+#------Rows are either a pandas dataframe, or a list of records------
+def isFrame(data):
+    return hasattr(data,'columns') and hasattr(data,'iloc')
+
+
+def takeRows(data,rows):
+    '''Select rows at positions <rows> of a dataframe or list of records'''
+    if isFrame(data):
+        return data.take(rows)
+    return [data[ii] for ii in rows]
+
+
+#-------Fetch unique values of a column, in order-------
+def fetchField(data,field):
+    if isFrame(data):
+        return data[field].unique().tolist()
+    return list(OrderedDict.fromkeys([getattr(rr,field) for rr in data]))
 
 dgbk=lambda x: x.decode('gbk')
 
@@ -64,33 +115,73 @@ def convertPath(url):
     return path
 
 
+#--------------Build an index of albums in database----------------
+def buildAlbumIndex(df):
+    '''Build an index of albums in a dataframe in one pass
+
+    <df>: dataframe, with at least the 'albumId' and 'albumName' columns,
+          or list of records with these fields, e.g. Track or AlbumRow.
+
+    Return: <index>: OrderedDict, keys are album ids in the order of their
+            first appearance in <df>. Values are dicts with keys:
+                'name': album name, from the 1st row of the album.
+                'image': album cover url, None if no 'albumImage' column.
+                'rows': list of row positions of the album in <df>.
+
+    Update time: 2016-07-25 15:12:40.
+    '''
+
+    if not isFrame(df):
+        ids=[rr.albumId for rr in df]
+        names=[rr.albumName for rr in df]
+        images=[getattr(rr,'albumImage',None) for rr in df]
+    else:
+        ids=df.albumId.values
+        names=df.albumName.values
+        if 'albumImage' in df:
+            images=df.albumImage.values
+        else:
+            images=[None]*len(df)
+
+    index=OrderedDict()
+    for pos,(idii,nameii,imageii) in enumerate(zip(ids,names,images)):
+        entry=index.get(idii)
+        if entry is None:
+            entry={'name': nameii, 'image': imageii, 'rows': []}
+            index[idii]=entry
+        entry['rows'].append(pos)
+
+    return index
+
+
 #--------------Get album id and name list in database----------------
-def getAlbumList(df,album,verbose=True):
+def getAlbumList(df,album,verbose=True,index=None):
     '''Get album id and name list in database
 
     <album>: select album from database.
               If None, select all albums.
               If str, select album <album>.
+    <index>: OrderedDict or None, album index of <df> from
+             buildAlbumIndex(). Built if not given.
 
     Return: <result>: list, with elements of (id, album_name).
 
-	Update time: 2016-07-12 11:36:07.
+	Update time: 2016-07-25 15:12:40.
     '''
 
-    #-----------------Get all albums-----------------
-    allids=fetchField(df,'albumId')
+    if index is None:
+        index=buildAlbumIndex(df)
 
     #---------------Select target album---------------
     if album is None:
-        ids=allids
-    if type(album) is str or type(album) is unicode:
-        seldf=df[df.albumName==album]
-        ids=fetchField(seldf,'albumId')
+        ids=list(index.keys())
+    else:
+        ids=[kk for kk,vv in index.items() if vv['name']==album]
 
 	#--------------------Get names--------------------
     result=[]
     for ff in ids:
-        result.append([ff,df[df.albumId==ff].albumName.iloc[0]])
+        result.append([ff,index[ff]['name']])
 
     #----------------------Return----------------------
     if album is None:
@@ -104,56 +195,245 @@ def getAlbumList(df,album,verbose=True):
 
 
 #------------------------Get tables from sqlite------------------------
+
+#-----Columns read from download_table, and their dataframe names-----
+COLUMNS=[('rowid','rowid'), ('title','title'), ('trackId','trackId'),\
+        ('artist','artist'), ('likes','likes'), ('duration','duration'),\
+        ('createTime','createTime'), ('downloadUrl','downloadUrl'),\
+        ('downloadAacUrl','downloadAacUrl'),\
+        ('downloadedBytes','downloaded'), ('totalBytes','totalBytes'),\
+        ('filepath','filepath'), ('albumId','albumId'),\
+        ('albumName','albumName'), ('albumImage','albumImage')]
+
+FIELDS=[ff for cc,ff in COLUMNS]
+
+#-------------Lightweight record of a track-------------
+Track=namedtuple('Track',FIELDS)
+
+#-------------Record of the album of a track-------------
+AlbumRow=namedtuple('AlbumRow',['albumId','albumName'])
+
+#----------Number of rows fetched from sqlite at a time----------
+CHUNKSIZE=500
+
+#---------Seconds between saves of the incremental manifest---------
+MANIFEST_SAVE_INTERVAL=60
+
+
+def iterData(db,order=None,chunksize=CHUNKSIZE,where=None):
+    '''Iterate over rows in download_table
+
+    <db>: sqlite3 connection.
+    <order>: str or None, ORDER BY clause of the query.
+    <chunksize>: int, number of rows fetched per fetchmany() call.
+    <where>: lib.query.TrackFilter or None, rows to select. Rows filtered
+             out are skipped by sqlite, not read.
+
+    Return: <rows>: generator of tuples, fields as in FIELDS.
+
+    Only <chunksize> rows are held in memory at a time.
+
+    Update time: 2016-07-22 09:40:31.
+    '''
+
+    clause,params=whereClause(where)
+    query='SELECT %s FROM download_table %s'\
+            %(', '.join(['download_table.%s' %cc for cc,ff in COLUMNS]),clause)
+    if order is not None:
+        query='%s ORDER BY %s' %(query,order)
+
+    ret=db.execute(query,params)
+    while True:
+        rows=ret.fetchmany(chunksize)
+        if not rows:
+            break
+        for rr in rows:
+            yield rr
+
+
+def iterAlbumTracks(db,chunksize=CHUNKSIZE,where=None):
+    '''Iterate over albums in download_table, without pandas
+
+    <db>: sqlite3 connection.
+    <chunksize>: int, number of rows fetched per fetchmany() call.
+    <where>: lib.query.TrackFilter or None, rows to select.
+
+    Return: <albums>: generator of (albumId, tracks), where <tracks> is
+            a list of Track records of one album, in rowid order.
+
+    Rows are streamed from sqlite sorted by album, so peak memory is
+    proportional to the largest album, not to the whole library.
+
+    Update time: 2016-09-16 09:31:27.
+    '''
+
+    rows=iterData(db,'download_table.albumId, download_table.rowid',\
+            chunksize,where)
+    idx=FIELDS.index('albumId')
+    for albumid,group in groupby(rows,key=lambda x: x[idx]):
+        yield albumid,[Track._make(rr) for rr in group]
+
+
+def getAlbumRows(db,where=None):
+    '''Get album ids and names of all rows, without the bulky url columns
+
+    <where>: lib.query.TrackFilter or None, rows to select.
+
+    Return: <rows>: list of AlbumRow, suitable for getAlbumList().
+    '''
+
+    clause,params=whereClause(where)
+    ret=db.execute('SELECT albumId, albumName FROM download_table %s'\
+            %clause,params)
+
+    return [AlbumRow._make(rr) for rr in ret]
+
+
+def getAlbumSizes(db,where=None):
+    '''Get number of tracks and total bytes of each album
+
+    <where>: lib.query.TrackFilter or None, rows to count.
+
+    Return: <sizes>: dict, albumId -> (number of tracks, total bytes).
+    '''
+
+    clause,params=whereClause(where)
+    ret=db.execute('SELECT albumId, COUNT(*), SUM(totalBytes) '\
+            'FROM download_table %s GROUP BY albumId' %clause,params)
+    sizes=dict([(rr[0],(rr[1],rr[2] or 0)) for rr in ret])
+
+    return sizes
+
+
+def dbFiles(dbfile):
+    '''List of the database files in <dbfile>, a str or list of str'''
+    if isinstance(dbfile,(list,tuple)):
+        return list(dbfile)
+    return [dbfile]
+
+
+def openLibrary(dbfile,where=None,immutable=True):
+    '''Open the library of one or several devices, read-only
+
+    <dbfile>: str or list of str, path(s) to "ting.sqlite" database files.
+              Several databases are merged into one library, see
+              lib.merge.mergeDatabases().
+    <where>: lib.query.TrackFilter or None, if several databases, only
+             the selected rows are merged.
+    <immutable>: bool, open the databases as immutable, False if they may
+                 change while open. See lib.query.connectDB().
+
+    Return: (db, indir, dlindex): sqlite3 connection, folder of the
+            (first) database, and index of the "Download" folder(s). In a
+            merged library, the filepath of rows is absolute.
+    '''
+
+    dbfiles=dbFiles(dbfile)
+    indir=os.path.split(os.path.abspath(dbfiles[0]))[0]
+    if len(dbfiles)>1:
+        db,dlindex=mergeDatabases(dbfiles,where,immutable)
+    else:
+        db=connectDB(dbfiles[0],immutable)
+        dlindex=DownloadIndex(os.path.join(indir,'Download'))
+
+    return db,indir,dlindex
+
+
+def getTrackList(db,where=None):
+    '''Read the rows of download_table into a list of Track records
+
+    <where>: lib.query.TrackFilter or None, rows to read. If None, read
+             the whole table.
+    '''
+
+    return [Track._make(rr) for rr in iterData(db,where=where)]
+
+
+def rowFilter(album,filters=None):
+    '''Filter of the rows to export
+
+    <album>: str, list of str or None, names of the albums to export.
+    <filters>: lib.query.TrackFilter or None, other criteria.
+
+    Return: <where>: lib.query.TrackFilter.
+    '''
+
+    if filters is None:
+        filters=TrackFilter()
+    if album is not None:
+        filters=filters.withAlbums(album)
+    return filters
+
+
 def getData(db,verbose=True):
+    '''Read the whole download_table into a dataframe
 
-    query=\
-    '''SELECT download_table.rowid,
-          download_table.title,
-          download_table.trackId,
-          download_table.artist,
-          download_table.likes,
-          download_table.duration,
-          download_table.createTime,
-          download_table.downloadUrl,
-          download_table.downloadAacUrl,
-          download_table.downloadedBytes,
-          download_table.totalBytes,
-          download_table.filepath,
-          download_table.albumId,
-          download_table.albumName,
-          download_table.albumImage
-       FROM download_table
+    Prefer iterAlbumTracks() for exporting, which does not load all rows,
+    nor need pandas.
     '''
 
-    ret=db.execute(query)
-    data=ret.fetchall()
-    df=pd.DataFrame(data=data,columns=['rowid','title','trackId',\
-        'artist','likes','duration','createTime','downloadUrl',\
-        'downloadAacUrl','downloaded','totalBytes','filepath','albumId',\
-        'albumName','albumImage'])
+    import pandas as pd
+
+    with timer('load'):
+        df=pd.DataFrame(data=list(iterData(db)),columns=FIELDS)
 
     return df
 
 
 
+#-------------------Load cover image to embed in tags-------------------
+def loadCover(imgfile):
+    '''Load a cover image to embed in the metadata of audio files
+
+    <imgfile>: str, path to the image file.
+
+    Return: <cover>: MP4Cover, to be reused for all tracks of an album.
+    '''
+
+    from mutagen.mp4 import MP4Cover
+
+    with open(imgfile,'rb') as fin:
+        data=fin.read()
+    if data.startswith(b'\x89PNG'):
+        imageformat=MP4Cover.FORMAT_PNG
+    else:
+        imageformat=MP4Cover.FORMAT_JPEG
+
+    return MP4Cover(data,imageformat=imageformat)
+
+
+
 #-------------------Write ID3 metadata to audio file-------------------
 def writeMeta(filename,meta,verbose=True):
     '''Write ID3 metadata to audio file
 
     <filename>: str, abspath to audio file.
-    <meta>: dict, metadata dict.
+    <meta>: dict, metadata dict. The 'cover' value is either a MP4Cover
+            (preferably built once per album by loadCover()) or a path to
+            the image file.
 
     Write metadata into the .mp3 audio file using ID3
 
     Update time: 2016-07-12 14:09:27.
     '''
 
+    import mutagen
+
+    with timer('tag'):
+        audio=mutagen.File(filename)
+        setMeta(audio,meta)
+        audio.save()
+
+    return
+
+
+def setMeta(audio,meta):
+    '''Set metadata in a loaded mutagen file object, without saving'''
+
     from mutagen.mp3 import MP3
     from mutagen.mp4 import MP4, MP4Cover
     from mutagen.id3 import ID3, APIC, error
 
-    audio=mutagen.File(filename)
-
     #------------Add ID3 tag if not exists------------
     try:
         audio.add_tags()
@@ -168,32 +448,640 @@ def writeMeta(filename,meta,verbose=True):
             #audio.tags.add(ap)
 
             #------------------For mp4 format------------------
-            ap2=MP4Cover(open(vv,'rb').read(),\
-                imageformat=MP4Cover.FORMAT_JPEG)
-            audio['covr']=[ap2]
+            if not isinstance(vv,MP4Cover):
+                vv=loadCover(vv)
+            audio['covr']=[vv]
         else:
             audio[kk]=tools.deu(vv)
-    
-    audio.save()
 
     return
 
 
+
+#----------------Export a file and write metadata in one go----------------
+def streamTagFunc(meta):
+    '''Get the function writing <meta> in lib.mp4stream.tagStream()
+
+    Return: <tagfunc>: callable, or None if mutagen is too old to tag file
+            objects (before 1.33).
+    '''
+
+    import mutagen
+
+    if getattr(mutagen,'version',(0,))<(1,33):
+        return None
+
+    def tagfunc(fobj,extra):
+        from mutagen import PaddingInfo
+
+        #----Pad as mutagen would for the complete file----
+        padding=lambda info: PaddingInfo(info.padding,\
+                info.size+extra).get_default_padding()
+        with timer('tag'):
+            audio=mutagen.File(fobj)
+            setMeta(audio,meta)
+            audio.save(fobj,padding=padding)
+
+    return tagfunc
+
+
+def exportTagged(src,dst,meta,exportmode='copy',onchunk=None):
+    '''Export an audio file and write metadata, writing <dst> only once
+
+    <src>: str, abspath to source audio file.
+    <dst>: str, abspath to exported file.
+    <meta>: dict or None, metadata dict as in writeMeta(). If None, the
+            file is exported as is.
+    <exportmode>: str, one of lib.fileops.EXPORT_MODES.
+    <onchunk>: callable or None, called with the number of bytes of each
+               chunk of data copied, see lib.fileops.copyFile().
+
+    In 'copy' mode, and in 'auto' mode when reflink is not possible, the
+    tags are written while streaming the source to <dst> (see
+    lib.mp4stream), so <dst> is written once, instead of copied and then
+    re-written when saving the tags. Non-MP4 files, or an old mutagen
+    that can't tag file objects, fall back to copying then tagging in place.
+    With reflink the clone is tagged in place, as its data is shared
+    with the source until modified.
+
+    Return: <usedmode>: str, export mode actually used.
+            <tagged>: bool, True if metadata was written.
+
+    Raise: IOError or OSError if the file could not be exported.
+           Failing to write metadata does not raise.
+
+    Update time: 2016-08-16 09:55:17.
+    '''
+
+    if meta is None or exportmode in LINK_MODES:
+        return exportFile(src,dst,exportmode,onchunk),False
+
+    #---------------Clone, then tag in place---------------
+    if exportmode in ('reflink','auto'):
+        try:
+            if os.path.lexists(dst):
+                os.remove(dst)
+            reflinkFile(src,dst)
+            usedmode='reflink'
+        except (IOError,OSError):
+            usedmode=None
+        if usedmode is not None:
+            try:
+                writeMeta(dst,meta)
+                return usedmode,True
+            except:
+                return usedmode,False
+
+    #---------------Tag while copying, write once---------------
+    tagfunc=streamTagFunc(meta)
+
+    if tagfunc is not None:
+
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            tagStream(src,dst,tagfunc,onchunk)
+            return 'copy',True
+        except MP4StreamError:
+            pass
+        except (IOError,OSError,Cancelled):
+            raise
+        except:
+            # source can't be tagged, export it as is
+            return exportFile(src,dst,'copy',onchunk),False
+
+    #---------------Copy, then tag in place---------------
+    usedmode=exportFile(src,dst,'copy',onchunk)
+    try:
+        writeMeta(dst,meta)
+        return usedmode,True
+    except:
+        return usedmode,False
+
+
+	
+
+
+#-------------Add an audio to an archive, with metadata-------------
+def archiveTagged(src,arcname,meta,archive,onchunk=None):
+    '''Add an audio file to an archive, writing metadata on the way
+
+    <src>: str, abspath to source audio file.
+    <arcname>: str, name of the file in the archive.
+    <meta>: dict or None, metadata dict as in writeMeta(). If None, the
+            file is added as is.
+    <archive>: lib.archive.Archive, archive to add the file to.
+    <onchunk>: callable or None, see exportTagged().
+
+    The tagged file is streamed into the archive (see
+    lib.mp4stream.TaggedStream), without being written to disk. Non-MP4
+    files, MP4 files with an mdat before moov, or an old mutagen that
+    can't tag file objects, are copied to a temp file and tagged there.
+
+    Return: <tagged>: bool, True if metadata was written.
+
+    Raise: IOError or OSError if the file could not be added.
+           Failing to write metadata does not raise.
+    '''
+
+    if meta is None:
+        archive.addFile(src,arcname,onchunk)
+        return False
+
+    #---------------Stream the tagged file---------------
+    tagfunc=streamTagFunc(meta)
+    if tagfunc is not None:
+        with open(src,'rb') as fin:
+            try:
+                stream=TaggedStream(fin,tagfunc,onchunk)
+            except MP4StreamError:
+                # not a MP4 file, or mdat before moov
+                stream=None
+            except (IOError,OSError):
+                raise
+            except:
+                # can't be tagged
+                stream=None
+            if stream is not None:
+                archive.add(arcname,stream,stream.size,\
+                        os.path.getmtime(src))
+                return True
+
+    #-----------Tag a temp copy, then add it-----------
+    fd,tmpfile=tempfile.mkstemp(dir=archive.tmpdir)
+    os.close(fd)
+    try:
+        exportFile(src,tmpfile,'copy')
+        try:
+            writeMeta(tmpfile,meta)
+            tagged=True
+        except:
+            tagged=False
+        archive.addFile(tmpfile,arcname,onchunk)
+    finally:
+        os.remove(tmpfile)
+
+    return tagged
+
+
 	
 
 
+#-----------------Get track records of an album-----------------
+def getTracks(df):
+    '''Convert rows of a dataframe to a list of Track records
+
+    <df>: dataframe with columns FIELDS, or list of Track, returned
+          as is.
+
+    Return: <tracks>: list of Track.
+
+    Columns are converted to lists in one go, which is much cheaper than
+    accessing df.iloc[ii].<field> per track and field.
+
+    Update time: 2016-07-27 10:21:05.
+    '''
+
+    if not isFrame(df):
+        return list(df)
+
+    columns=[df[ff].tolist() for ff in FIELDS]
+    tracks=[Track._make(rr) for rr in zip(*columns)]
+
+    return tracks
+
+
+def trackNames(df):
+    '''Get file names of exported tracks, vectorized over an album
+
+    <df>: dataframe with columns 'title' and 'artist', or list of Track.
+
+    Return: <names>: list of str, "<title>-<artist>.mp4", with invalid
+            path symbols replaced by a space.
+    '''
+
+    if not isFrame(df):
+        return [REPATTERN.sub(u' ',u'%s-%s.mp4' %(tt.title,tt.artist))\
+                for tt in df]
+
+    names=df.title.astype(unicode)+u'-'+df.artist.astype(unicode)+u'.mp4'
+    # regex=True, as pandas 2 replaces literal strings by default
+    names=names.str.replace(REPATTERN,u' ',regex=True)
+
+    return names.tolist()
+
+
+
+
+#--------------------Job of the tag stage--------------------
+def tagJob(src,dst,meta,exportmode='copy',onchunk=None):
+    '''Export a file and write its metadata
+
+    <src>: str, abspath to the source. If same as <dst>, the file is
+           already in place and only tagged.
+    <dst>: str, abspath to exported file.
+    <meta>: dict or None, metadata to write, see writeMeta().
+    <exportmode>: str, one of lib.fileops.EXPORT_MODES.
+    <onchunk>: callable or None, see exportTagged(). Can't be used in the
+               TagStage.
+
+    Return: (usedmode, tagged, error), where <error> is None, or the
+            message of the error if the file could not be exported.
+
+    This is run in a worker process of the TagStage, so it must not
+    raise, and its arguments and result must be picklable.
+
+    Update time: 2016-08-19 17:20:48.
+    '''
+
+    try:
+        if src==dst:
+            if meta is None:
+                return exportmode,False,None
+            try:
+                writeMeta(dst,meta)
+                return exportmode,True,None
+            except:
+                return exportmode,False,None
+
+        usedmode,tagged=exportTagged(src,dst,meta,exportmode,onchunk)
+        return usedmode,tagged,None
+    except Exception as e:
+        return exportmode,False,'%s' %e
+
+
+
+
+#----------------------Export a single track----------------------
+def exportTrack(track,newname,indir,subfolder,albumname,cover,faillist,\
+        metafaillist,verbose=True,manifest=None,exportmode='copy',\
+        downloader=None,tagstage=None,dlindex=None,journal=None,\
+        progress=None,cancel=None,dedup=None,archive=None,iosched=None):
+    '''Export a single track of an album
+
+    <track>: Track, record of the track.
+    <newname>: str, file name of the exported track, see trackNames().
+    <indir>: str, folder containing the "Download" subfolder.
+    <subfolder>: str, album folder to save the exported file to.
+    <albumname>: str, name of album.
+    <cover>: MP4Cover or None, album cover image to embed.
+    <faillist>, <metafaillist>: lists, titles of failed tracks are
+                                appended to them.
+    <manifest>: Manifest or None, if given, skip the track if it is
+                unchanged since the last export, and record it once
+                exported.
+    <exportmode>: str, one of lib.fileops.EXPORT_MODES, how the file is
+                  exported. In the 'hardlink' and 'symlink' modes no
+                  metadata is written, as that would modify the source.
+    <downloader>: Downloader or None, to complete incomplete downloads,
+                  resuming from the bytes in the "Download" folder.
+    <tagstage>: TagStage or None, if given, the file is exported and
+                tagged by tagJob() in a worker process, and the result is
+                recorded once it returns. Otherwise this is done inline.
+    <dlindex>: DownloadIndex or None, index of the "Download" folder to
+               look up the source file in. If None, the file is stat'ed.
+    <journal>: Journal or None, if given, the states of the track are
+               recorded in it, and a track exported or downloaded by an
+               interrupted run is not exported again.
+    <progress>: Progress or None, to report bytes copied and tracks done.
+    <cancel>: CancelToken or None, if cancelled, the track is not
+              exported, or its copy or download is stopped. It stays
+              'planned' in the journal.
+    <dedup>: DuplicateSet or None, if the track is a duplicate in it, it
+             is not exported, but left to be linked to its original.
+    <archive>: lib.archive.Archive or None, if given, the track is
+               streamed into the archive instead, under its path relative
+               to the temp folder of the archive, see main().
+    <iosched>: lib.iosched.IOScheduler or None, if given, the file is
+               only exported once its source and destination devices
+               have a free slot.
+
+    The file is written to a temp name (see lib.journal.partName()) and
+    renamed into place once exported and tagged.
+    This is the unit of work queued into the worker pool by processAlbum().
+
+    Update time: 2016-07-20 10:02:13.
+    '''
+
+    title=track.title
+    artist=track.artist
+    downloaded=track.downloaded
+    totalBytes=track.totalBytes
+    downloadurl1=track.downloadUrl
+    downloadurl2=track.downloadAacUrl
+    filepath=track.filepath
+
+    tmpfile=False
+    gotfile=False
+
+    newname=os.path.join(tools.deu(subfolder),newname)
+    newname=convertPath(newname)
+
+    #---------Tracks still queued once cancelled are dropped---------
+    if cancel is not None and cancel.isCancelled():
+        return
+
+    #-----------Report progress, stop copies once cancelled-----------
+    streamed=[0]
+
+    def onchunk(nbytes):
+        if cancel is not None:
+            cancel.check()
+        streamed[0]+=nbytes
+        if progress is not None:
+            progress.addBytes(nbytes)
+
+    def done():
+        if progress is not None:
+            progress.trackDone(title,max(0,(totalBytes or 0)-streamed[0]))
+
+    #-------Duplicates are linked once their original is exported-------
+    if dedup is not None and dedup.add(track.rowid,newname,title):
+        if verbose:
+            printInd('Duplicate of another track: %s' %title,2)
+        done()
+        return
+
+    #-------------------Source file-------------------
+    filename=os.path.join(indir,'Download',filepath)
+    if dlindex is not None:
+        srcstat=dlindex.stat(filepath)
+    else:
+        srcstat=statFile(filename)
+    if srcstat is not None:
+        srcsize,srcmtime=srcstat[:2]
+    else:
+        srcsize,srcmtime=None,None
+    dest=None
+
+    #-----------Skip tracks unchanged since last export-----------
+    if manifest is not None:
+        dest=manifest.relpath(newname)
+
+        if manifest.isCurrent(track.trackId,filepath,srcsize,srcmtime,\
+                dest,hasMutagen() and exportmode not in LINK_MODES):
+            if verbose:
+                printInd('Skip unchanged file: %s' %title,2)
+            done()
+            return
+
+    #-----Write to a temp name, renamed into place once done-----
+    # named after the track, as other rows may export to <newname>
+    trackid=track.trackId
+    if trackid is None:
+        trackid='row%d' %track.rowid
+    partname=partName(newname,trackid)
+    state='planned'
+
+    #-------------Continue from the journal-------------
+    if journal is not None:
+        reldest=journal.relpath(newname)
+        state=journal.get(trackid,reldest) or state
+        if state=='committed' and os.path.lexists(newname):
+            if verbose:
+                printInd('Skip exported file: %s' %title,2)
+            done()
+            return
+        if state not in ('copied','tagged') or not os.path.lexists(partname):
+            state='planned'
+            journal.record(trackid,state,reldest)
+
+    if verbose:
+        #printInd('Getting file for: %s' %title, 2)
+        printInd(dgbk('ȡļ: ')+title, 2)
+
+    #-----If imcomplete download, try downloading now-----
+    # size on disk is more up to date than the database
+    if srcsize is not None:
+        downloaded=srcsize
+    if state!='planned':
+        # complete in the temp file since last run
+        tmpfile=True
+        gotfile=True
+    elif downloaded<totalBytes:
+        tmpfile=True
+        if verbose:
+            printInd('Downloading imcomplete audio:',2)
+            printInd(title,2)
+        if downloader is None:
+            downloader=Downloader()
+        partial=filename if srcstat is not None else None
+        try:
+            with timer('download') as tt:
+                downloader.resume([downloadurl1,downloadurl2],partial,\
+                        partname,totalBytes,onchunk)
+                tt.bytes=totalBytes
+            gotfile=True
+            if journal is not None:
+                state='copied'
+                journal.record(trackid,state,reldest)
+        except Cancelled:
+            if os.path.lexists(partname):
+                os.remove(partname)
+            return
+        except Exception as e:
+            if verbose:
+                printInd('Failed to download %s' %title,2)
+                printInd(e,3)
+            faillist.append(title)
+            gotfile=False
+            if os.path.lexists(partname):
+                os.remove(partname)
+    else:
+        gotfile=True
+
+    if not gotfile:
+        done()
+        return
+
+    #------------Metadata to write (optional)------------
+    meta=None
+    if hasMutagen() and exportmode not in LINK_MODES:
+
+        if verbose:
+            #printInd('Writing metadata for: %s' %title, 2)
+            printInd(dgbk('ΪƵдԪ: ')+title, 2)
+
+        #--------------------mp3 format--------------------
+        meta={'title':title, 'artist': artist, 'album': albumname,\
+              'comments': 'Exported from Ximalaya by XimaExport'}
+        #--------------------mp4 format--------------------
+        meta={'\xa9nam':title, '\xa9ART': artist, '\xa9alb': albumname,\
+              'comments': 'Exported from Ximalaya by XimaExport'}
+        if cover is not None:
+            meta['cover']=cover
+
+    #--------------Record result of the tag stage--------------
+    iotoken=[]
+
+    def finish(result,seconds=None):
+        if iosched is not None:
+            iosched.release(iotoken)
+        usedmode,tagged,error=result
+        if seconds is not None:
+            record('export',seconds,srcsize,error is not None)
+        if error is None and os.path.lexists(partname):
+            #---------Rename into place, then commit---------
+            try:
+                if journal is not None:
+                    journal.record(trackid,'tagged' if tagged else 'copied',\
+                            reldest)
+                commitFile(partname,newname)
+                if journal is not None:
+                    journal.record(trackid,'committed',reldest)
+            except (IOError,OSError) as e:
+                error='%s' %e
+        if error is not None:
+            if os.path.lexists(partname):
+                os.remove(partname)
+            if cancel is not None and cancel.isCancelled():
+                return
+            if verbose:
+                printInd('Failed to copy file %s' %title,2)
+            faillist.append(title)
+            done()
+            return
+        if meta is not None and not tagged and usedmode not in LINK_MODES:
+            metafaillist.append(title)
+        if manifest is not None and os.path.exists(newname):
+            manifest.update(track.trackId,filepath,srcsize,srcmtime,dest,\
+                    tagged)
+        done()
+
+    #------------------Export and tag------------------
+    # downloaded files are already in place, tag them there
+    if tmpfile:
+        filename=partname
+
+    if state=='tagged':
+        finish((exportmode,True,None))
+    elif not tmpfile and srcstat is None:
+        if verbose:
+            printInd('Source file not found: %s' %title,2)
+        faillist.append(title)
+        done()
+    elif cancel is not None and cancel.isCancelled():
+        return
+    elif archive is not None:
+        #-----------Stream into the archive-----------
+        if iosched is not None:
+            iotoken=iosched.acquire(filename,archive.path)
+        try:
+            with timer('export') as tt:
+                tt.bytes=srcsize
+                tagged=archiveTagged(filename,archive.relpath(newname),\
+                        meta,archive,onchunk)
+            error=None
+        except Cancelled:
+            return
+        except (IOError,OSError) as e:
+            tagged=False
+            error='%s' %e
+        finally:
+            if iosched is not None:
+                iosched.release(iotoken)
+            if tmpfile and os.path.lexists(partname):
+                os.remove(partname)
+        if error is not None:
+            if verbose:
+                printInd('Failed to copy file %s' %title,2)
+                printInd(error,3)
+            faillist.append(title)
+        elif meta is not None and not tagged:
+            metafaillist.append(title)
+        done()
+    else:
+        #-----Wait for the devices, released by finish()-----
+        if iosched is not None:
+            iotoken.extend(iosched.acquire(filename,partname))
+        if tagstage is not None and meta is not None:
+            tagstage.submit(timedCall,(tagJob,filename,partname,meta,\
+                    exportmode),lambda rr: finish(*rr))
+        else:
+            finish(*timedCall(tagJob,filename,partname,meta,exportmode,\
+                    onchunk))
+
+    return
+
+
+
+
+def exportTracks(tracks,newname,*args):
+    '''Export tracks of an album to the same file name, one after another
+
+    <tracks>: list of Track, rows of the album exported to <newname>, e.g.
+              re-downloads with the same title and artist. Exported in
+              turn as in a serial run, the last one is kept.
+
+    Other arguments are passed to exportTrack().
+    '''
+    for trackii in tracks:
+        exportTrack(trackii,newname,*args)
+
+
+
+
 #----------------------Process files in an album----------------------
-def processAlbum(df,indir,outdir,albumid,verbose=True):
+def processAlbum(df,indir,outdir,albumid,verbose=True,pool=None,index=None,\
+        manifest=None,exportmode='copy',covercache=None,downloader=None,\
+        tagstage=None,dlindex=None,plan=None,journal=None,progress=None,\
+        cancel=None,dedup=None,archive=None,iosched=None):
     '''Process files in an album
 
+    <manifest>: Manifest or None, manifest of the output folder, if given,
+                tracks unchanged since the last export are skipped.
+    <exportmode>: str, one of lib.fileops.EXPORT_MODES.
+    <covercache>: CoverCache or None, if given, the album cover is got
+                  from the cache instead of downloaded on every run.
+    <downloader>: Downloader or None, shared by tracks to complete
+                  incomplete downloads.
+    <tagstage>: TagStage or None, process pool to export and tag files in.
+    <dlindex>: DownloadIndex or None, index of the "Download" folder.
+    <plan>: dict or None, entry of the album in a plan from makePlan().
+            If given, only the planned tracks are exported, to the
+            planned files.
+    <journal>: Journal or None, journal of the export, to resume it.
+    <progress>: Progress or None, to report tracks done.
+    <cancel>: CancelToken or None, no more track is queued once cancelled.
+    <dedup>: DuplicateSet or None, duplicated tracks to link instead of
+             exporting them.
+    <archive>: lib.archive.Archive or None, archive to stream the tracks
+               and cover image into, <outdir> is then its temp folder.
+    <iosched>: lib.iosched.IOScheduler or None, if given, tracks are
+               queued in the order of the inodes of their sources, and
+               exported within its per-device limits.
+    <index>: OrderedDict or None, album index of <df> from
+             buildAlbumIndex(). Built if not given.
+    <pool>: WorkerPool or None. If given, the tracks are queued into
+            the pool and the returned lists are filled in as the jobs
+            finish: call pool.join() before reading them.
+            If None, tracks are processed serially.
+
+    The album folder and cover image are always prepared here, before any
+    track of the album is queued.
     '''
-    seldf=df[df.albumId==albumid]
-    albumname=seldf.iloc[0].albumName
-    ids=seldf.rowid
+    if index is None:
+        index=buildAlbumIndex(df)
+    entry=index[albumid]
+    seldf=takeRows(df,entry['rows'])
+    albumname=entry['name']
     faillist=[]
     metafaillist=[]
 
-    subfolder=os.path.join(outdir,albumname)
+    #-------------Tracks to export and their file names-------------
+    tracks=getTracks(seldf)
+    newnames=trackNames(seldf)
+
+    #-------------Tracks and names as planned-------------
+    if plan is not None:
+        dests=dict([(tt['trackId'],tt['dest']) for tt in plan['tracks']])
+        tracks=[tt for tt in tracks if tt.trackId in dests]
+        newnames=[os.path.basename(dests[tt.trackId]) for tt in tracks]
+
+    if plan is not None:
+        subfolder=os.path.join(outdir,plan['folder'])
+    else:
+        subfolder=os.path.join(outdir,albumname)
     subfolder=convertPath(subfolder)
     if not os.path.isdir(subfolder):
         try:
@@ -202,131 +1090,407 @@ def processAlbum(df,indir,outdir,albumid,verbose=True):
             if verbose:
                 printInd('Failed to create subfolder %s' %albumname,2)
                 printInd('Skip folder %s' %albumname,2)
-            faillist.extend(fetchField(df,'title'))
+            faillist.extend(fetchField(seldf,'title'))
+            #-------Count them done, so the progress reaches the total-------
+            if progress is not None:
+                for trackii in tracks:
+                    progress.trackDone(trackii.title,trackii.totalBytes or 0)
             return faillist,metafaillist
 
     #------------Download album cover image------------
-    albumImage=seldf.iloc[0].albumImage
-    try:
-        coverimg=os.path.join(subfolder,'cover.jpg')
-        imgfile=urlretrieve(albumImage,coverimg)[0]
-        got_cover=True
-    except:
-        got_cover=False
-
-    #----------------Loop through files----------------
-    for ii in range(len(ids)):
-        title=seldf.iloc[ii].title
-        artist=seldf.iloc[ii].artist
-        downloaded=seldf.iloc[ii].downloaded
-        totalBytes=seldf.iloc[ii].totalBytes
-        downloadurl1=seldf.iloc[ii].downloadUrl
-        downloadurl2=seldf.iloc[ii].downloadAacUrl
-        filepath=seldf.iloc[ii].filepath
-
-        tmpfile=False
-        gotfile=False
-
-        newname="%s-%s.mp4" %(title,artist)
-	newname=REPATTERN.sub(' ',newname)
-        newname=os.path.join(tools.deu(subfolder),newname)
-        newname=convertPath(newname)
-
-        if verbose:
-            #printInd('Getting file for: %s' %title, 2)
-            printInd(dgbk('ȡļ: ')+title, 2)
+    albumImage=entry['image']
+    coverimg=os.path.join(subfolder,'cover.jpg')
+    with timer('cover') as tt:
+        try:
+            if covercache is not None:
+                imgfile=covercache.get(albumImage)
+                if imgfile is not None:
+                    exportFile(imgfile,coverimg,'copy')
+                    imgfile=coverimg
+            else:
+                imgfile=urlretrieve(albumImage,coverimg)[0]
+        except:
+            imgfile=None
+        if imgfile is not None and archive is not None:
+            try:
+                archive.addFile(imgfile,archive.relpath(coverimg))
+            except (IOError,OSError):
+                pass
 
-        #-----If imcomplete download, try downloading now-----
-        if downloaded<totalBytes:
-            tmpfile=True
-            if verbose:
-                printInd('Downloading imcomplete audio:',2)
-                printInd(title,2)
+        #------Load cover once, embed the same data in all tracks------
+        cover=None
+        if imgfile is not None and hasMutagen():
             try:
-                tmpfile=urlretrieve(downloadurl1,newname)
-                gotfile=True
+                cover=loadCover(imgfile)
             except:
-                tmpfile=urlretrieve(downloadurl2,newname)
-                gotfile=True
-            finally:
-                if verbose:
-                    printInd('Failed to download %s' %title,2)
-                faillist.append(title)
-                gotfile=False
+                cover=None
+        tt.failed=imgfile is None
+
+    #----------------Loop through files----------------
+    if pool is None:
+        pool=WorkerPool(1)
+
+    #-------------Read the sources in disk order-------------
+    if iosched is not None:
+        if dlindex is not None:
+            stats=[dlindex.stat(tt.filepath) if tt.filepath else None\
+                    for tt in tracks]
         else:
-            gotfile=True
+            stats=[statFile(os.path.join(indir,'Download',tt.filepath))\
+                    if tt.filepath else None for tt in tracks]
+        order=inodeOrder(stats)
+        tracks=[tracks[ii] for ii in order]
+        newnames=[newnames[ii] for ii in order]
+
+    #-----Rows exported to the same file go to one worker, in order-----
+    groups=OrderedDict()
+    for trackii,newnameii in zip(tracks,newnames):
+        groups.setdefault(newnameii,[]).append(trackii)
+
+    for newnameii,tracksii in groups.items():
+        if cancel is not None and cancel.isCancelled():
+            break
+        pool.submit(exportTracks,tracksii,newnameii,indir,subfolder,\
+                albumname,cover,faillist,metafaillist,verbose,manifest,\
+                exportmode,downloader,tagstage,dlindex,journal,progress,\
+                cancel,dedup,archive,iosched)
 
-        if not gotfile:
-            continue
+    return faillist,metafaillist
 
-        #----------------------Export----------------------
-        if not tmpfile:
 
-            filename=os.path.join(indir,'Download')
-            filename=os.path.join(filename,filepath)
 
-            if os.path.exists(filename):
-                try:
-                    shutil.copy2(filename,newname)
-                except:
-                    if verbose:
-                        printInd('Failed to copy file %s' %title,2)
-                        faillist.append(title)
-                    continue
+	
 
-        #------------Write metadata (optional)------------
-        if HAS_MUTAGEN:
 
-            if verbose:
-                #printInd('Writing metadata for: %s' %title, 2)
-                printInd(dgbk('ΪƵдԪ: ')+title, 2)
-
-            #--------------------mp3 format--------------------
-            meta={'title':title, 'artist': artist, 'album': albumname,\
-                  'comments': 'Exported from Ximalaya by XimaExport'}
-            #--------------------mp4 format--------------------
-            meta={'\xa9nam':title, '\xa9ART': artist, '\xa9alb': albumname,\
-                  'comments': 'Exported from Ximalaya by XimaExport'}
-            if got_cover:
-                meta['cover']=imgfile
+#------------------Find duplicated source files------------------
+def findTrackDuplicates(db,dlindex,albumids,trackids=None,cache=None,\
+        where=None):
+    '''Find tracks whose source file has the same content as another's
 
-            try:
-                writeMeta(newname,meta)
-            except:
-                metafaillist.append(title)
+    <db>: sqlite3 connection.
+    <dlindex>: DownloadIndex or MultiIndex, index of the "Download"
+               folder(s).
+    <albumids>: collection of the albumIds to export.
+    <trackids>: collection of the trackIds to export, or None for all
+                tracks of <albumids>.
+    <cache>: HashCache or None, cache of the hashes of source files.
+    <where>: lib.query.TrackFilter or None, rows to export.
 
+    Return: <dups>: OrderedDict, rowid -> rowid of its original. The
+            original is the first of the duplicates in the order tracks
+            are exported in, see iterAlbumTracks().
 
-    return faillist,metafaillist
+    Missing or incomplete source files are left out, they are
+    downloaded by exportTrack().
+    '''
 
+    clause,params=whereClause(where)
+    rows=db.execute('''SELECT rowid, trackId, albumId, filepath, totalBytes
+            FROM download_table %s ORDER BY albumId, rowid''' %clause,params)
+    files=[]
+    for rowid,trackid,albumid,filepath,totalbytes in rows:
+        if albumid not in albumids or not filepath:
+            continue
+        if trackids is not None and trackid not in trackids:
+            continue
+        stat=dlindex.stat(filepath)
+        if stat is None or stat[0]<(totalbytes or 0):
+            continue
+        files.append((rowid,dlindex.path(filepath),stat[0],stat[1]))
+
+    return findDuplicates(files,cache)
+
+
+
+
+#-----------------------Plan an export-----------------------
+def makePlan(dbfile,outdir,album,exportmode='copy',filters=None):
+    '''Plan an export without writing anything to the output folder
+
+    <dbfile>: str or list of str, path(s) to "ting.sqlite" database
+              files, see openLibrary().
+    <outdir>: str, output folder.
+    <album>: str, list of str or None, select albums to plan.
+    <exportmode>: str, one of lib.fileops.EXPORT_MODES.
+    <filters>: lib.query.TrackFilter or None, rows to plan.
+
+    Return: <plan>: dict, with keys:
+                'dbfile', 'outdir', 'album', 'exportmode': arguments.
+                'albums': list of dicts, with keys 'albumId', 'name',
+                          'folder' (relative to <outdir>) and 'tracks', a
+                          list of dicts with keys 'trackId', 'title',
+                          'src' (relative to the "Download" folder),
+                          'dest' (relative to <outdir>), 'size' (bytes),
+                          'download' (True if the audio must be
+                          downloaded) and 'missing' (True if there is no
+                          source file).
+                'tracks', 'bytes': number of tracks and bytes to write.
+                'downloads', 'downloadbytes': number and bytes of audios
+                                              to download.
+                'missing': list of titles without source file.
+                'collisions': list of (dest, trackIds), tracks exported
+                              to the same file.
+                'free': free bytes on the output disk, None if unknown.
+                'throughput': measured bytes/s of copying to the output
+                              disk, None if unknown.
+                'eta': estimated seconds to export, downloads left out.
+            or None if no album to plan.
+
+    The selected rows are read with getTrackList(), the sources are looked
+    up in an index of the "Download" folder. Only a probe file, deleted right
+    after, is written to measure the throughput of the output disk.
+
+    Update time: 2016-08-30 16:12:05.
+    '''
+
+    where=rowFilter(album,filters)
+    db,indir,dlindex=openLibrary(dbfile,where)
+    df=getTrackList(db,where)
+    db.close()
+
+    index=buildAlbumIndex(df)
+    albumlist=getAlbumList(df,None,index=index)
+    if len(albumlist)==0:
+        printHeader('No track in database matches the given filters.')
+        return None
+
+    albums=[]
+    dests=[]
+    missing=[]
+    copied=[]
+    nbytes=ndownloads=downloadbytes=0
+
+    for albumid,albumname in albumlist:
+        entry=index[albumid]
+        seldf=takeRows(df,entry['rows'])
+        subfolder=convertPath(os.path.join(outdir,albumname))
+        folder=os.path.relpath(subfolder,outdir)
+
+        tracks=[]
+        for trackii,newnameii in zip(getTracks(seldf),trackNames(seldf)):
+            #------------Same checks as exportTrack()------------
+            stat=dlindex.stat(trackii.filepath)
+            ondisk=stat[0] if stat is not None else trackii.downloaded
+            download=ondisk<trackii.totalBytes
+            ismissing=stat is None and not download
+            size=int(trackii.totalBytes if download else ondisk or 0)
+            dest=os.path.join(folder,newnameii)
+
+            tracks.append({'trackId': int(trackii.trackId),\
+                    'title': trackii.title, 'src': trackii.filepath,\
+                    'dest': dest, 'size': size, 'download': download,\
+                    'missing': ismissing})
+            dests.append((int(trackii.trackId),dest))
+
+            if ismissing:
+                missing.append(trackii.title)
+                continue
+            if download:
+                ndownloads+=1
+                downloadbytes+=size
+            else:
+                copied.append((size,os.path.join(indir,'Download',\
+                        trackii.filepath)))
+            if exportmode not in LINK_MODES:
+                nbytes+=size
+
+        albums.append({'albumId': int(albumid), 'name': albumname,\
+                'folder': folder, 'tracks': tracks})
+
+    #----------Measure throughput on the largest sources----------
+    throughput=eta=None
+    copybytes=sum([aa for aa,bb in copied])
+    if exportmode not in LINK_MODES and copybytes>0:
+        copied.sort(reverse=True)
+        throughput=measureThroughput([bb for aa,bb in copied[:8]],outdir)
+        if throughput:
+            eta=copybytes/throughput
+    elif exportmode in LINK_MODES:
+        eta=0.
+
+    plan={'version': PLAN_VERSION,\
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),\
+            'dbfile': dbfile, 'outdir': os.path.abspath(outdir),\
+            'album': album, 'exportmode': exportmode, 'albums': albums,\
+            'tracks': len(dests), 'bytes': nbytes, 'downloads': ndownloads,\
+            'downloadbytes': downloadbytes, 'missing': missing,\
+            'collisions': findCollisions(dests), 'free': diskFree(outdir),\
+            'throughput': throughput, 'eta': eta}
+
+    return plan
+
+
+def printPlan(plan,verbose=True):
+    '''Print an export plan from makePlan()'''
+
+    printHeader('Export plan',1)
+    printInd('Database: %s' %', '.join(dbFiles(plan['dbfile'])),2)
+    printInd('Output folder: %s' %plan['outdir'],2)
+    printInd('Export mode: %s' %plan['exportmode'],2)
+
+    if verbose:
+        for ii,albumii in enumerate(plan['albums']):
+            printNumHeader(albumii['name'],ii+1,len(plan['albums']),2)
+            for trackjj in albumii['tracks']:
+                if trackjj['missing']:
+                    continue
+                printInd('%s -> %s' %(trackjj['src'],trackjj['dest']),3)
+
+    printHeader('Summary',2)
+    printInd('Albums: %d, tracks: %d' %(len(plan['albums']),plan['tracks']),2)
+    printInd('To write: %s' %formatSize(plan['bytes']),2)
+    printInd('To download: %d tracks, %s' %(plan['downloads'],\
+            formatSize(plan['downloadbytes'])),2)
+
+    if plan['free'] is None:
+        printInd('Free space: unknown',2)
+    else:
+        printInd('Free space: %s' %formatSize(plan['free']),2)
+        if plan['free']<plan['bytes']:
+            printHeader('Not enough free space, %s missing'\
+                    %formatSize(plan['bytes']-plan['free']),2)
+
+    if plan['throughput']:
+        printInd('Disk throughput: %s/s' %formatSize(plan['throughput']),2)
+    if plan['eta'] is not None:
+        printInd('Estimated time: %s, downloads not included'\
+                %formatTime(plan['eta']),2)
+
+    if len(plan['missing'])>0:
+        printHeader('Source files missing: %d' %len(plan['missing']),2)
+        for titleii in plan['missing']:
+            printInd(titleii,2)
+
+    if len(plan['collisions'])>0:
+        printHeader('Tracks exported to the same file: %d'\
+                %len(plan['collisions']),2)
+        for destii,idsii in plan['collisions']:
+            printInd('%s: trackId %s' %(destii,', '.join(map(str,idsii))),2)
+
+    return
 
 
-	
 
 
 #-----------------------Main-----------------------
-def main(dbfile,outdir,album,verbose):
+def main(dbfile,outdir,album,verbose,jobs=1,incremental=False,\
+        exportmode='copy',cachedir=COVER_CACHE_DIR,\
+        maxdownloads=MAX_DOWNLOADS,tagjobs=0,plan=None,resume=False,\
+        onprogress=None,cancel=None,dedup='off',archive=None,filters=None,\
+        immutable=True,devicejobs=DEVICE_JOBS):
+    '''Export audios from a ting.sqlite database
+
+    <dbfile>: str or list of str, path(s) to "ting.sqlite" database
+              files. Several databases, e.g. from several devices, are
+              merged into one library and exported in one pass, see
+              openLibrary().
+    <outdir>: str, output folder.
+    <album>: str, list of str or None, select albums to process by name.
+    <jobs>: int, number of tracks exported concurrently. Tracks from
+            different albums may be exported at the same time.
+    <incremental>: bool, if True, only export tracks that are new or
+                   changed since the last export to <outdir>, as recorded
+                   in the manifest file of <outdir>.
+    <exportmode>: str, one of lib.fileops.EXPORT_MODES, how files are
+                  exported: copied, hard/symbolic linked or reflinked.
+    <cachedir>: str or None, folder to cache album covers in.
+                If None, covers are downloaded on every run.
+    <maxdownloads>: int, max number of incomplete audios downloaded at the
+                    same time. Downloads run in the export workers, so at
+                    most <jobs> run at once.
+    <tagjobs>: int, number of worker processes to export and tag files in.
+               If 0, this is done in the export worker threads. If < 0,
+               use one process per CPU core.
+    <plan>: dict or None, plan from makePlan(), e.g. saved by an earlier
+            run. If given, only the planned albums and tracks are exported,
+            to the planned files, and <album> is ignored.
+    <resume>: bool, if True, continue an interrupted export to <outdir>
+              from its journal, skipping the tracks already exported.
+              If False, the journal is started anew.
+    <onprogress>: callable or None, called with progress event dicts,
+                  see lib.progress.
+    <cancel>: CancelToken or None, cancel it to stop the export. Tracks
+              being exported are stopped, those not finished are left in
+              the journal, to continue the export with <resume>.
+    <dedup>: str, one of lib.dedup.DEDUP_MODES, what to do with tracks
+             whose source file has the same content as another's:
+             'off': export them as the others.
+             'link': export one, hard link the others to it, so they
+                     share its metadata.
+             'report': export one, only list the others.
+             Duplicates are saved in the report file of <outdir>.
+    <archive>: str or None, path to a .zip or .tar file. If given, the
+               albums are exported into this archive instead of <outdir>,
+               which is ignored. Each track is streamed into it from the
+               "Download" folder with its metadata, without writing the
+               exported file to disk. <incremental>, <resume>,
+               <exportmode> and <tagjobs> are ignored, and duplicates are
+               reported but not linked.
+    <filters>: lib.query.TrackFilter or None, other criteria of the rows
+               to export, along with <album>. Ignored with <plan>.
+    <immutable>: bool, open the databases as immutable. Use False if they
+                 may change during the export, see watch().
+    <devicejobs>: int, max number of files exported at the same time from
+                  or to each device, e.g. to read a USB hard disk one file
+                  at a time while <jobs> tracks are processed. Tracks are
+                  then exported in the order of their sources on disk, see
+                  lib.iosched. If <=0, no limit, in database order.
+    '''
+
+    #--------Rows to export, selected by the sqlite queries--------
+    if plan is not None:
+        where=TrackFilter(albumids=[aa['albumId'] for aa in plan['albums']])
+    else:
+        where=rowFilter(album,filters)
 
     try:
-        db = sqlite3.connect(dbfile)
+        with timer('load'):
+            db,indir,dlindex=openLibrary(dbfile,where,immutable)
         if verbose:
             #printHeader('Connected to database:')
             printHeader(dgbk('ļ:'))
-            printInd(dbfile,2)
+            for dbfileii in dbFiles(dbfile):
+                printInd(dbfileii,2)
     except:
         #printHeader('Failed to connect to database:')
         printHeader(dgbk('޷ļ'))
-        printInd(dbfile)
+        for dbfileii in dbFiles(dbfile):
+            printInd(dbfileii)
         return 1
 
-    #--------------------Fetch data--------------------
-    df=getData(db)
-    indir=os.path.split(os.path.abspath(dbfile))[0]
-
     #----------------Get album list----------------
-    albumlist=getAlbumList(df,album)
+    if plan is not None:
+        albumlist=[(aa['albumId'],aa['name']) for aa in plan['albums']]
+        albumplans=dict([(aa['albumId'],aa) for aa in plan['albums']])
+        free=diskFree(outdir if archive is None else\
+                os.path.dirname(os.path.abspath(archive)))
+        if free is not None and free<plan['bytes']:
+            printHeader('Not enough free space for the plan, %s missing'\
+                    %formatSize(plan['bytes']-free))
+    else:
+        with timer('load'):
+            albumrows=getAlbumRows(db,where)
+        with timer('albums'):
+            albumlist=getAlbumList(albumrows,None)
+        albumplans={}
+        if len(albumlist)==0 and not where.isEmpty():
+            printHeader('No track in database matches the given filters.')
     if len(albumlist)==0:
         return 1
 
+    #-------Export to an archive, through its temp folder-------
+    arc=None
+    if archive is not None:
+        try:
+            arc=Archive(archive)
+        except (IOError,OSError,ValueError) as e:
+            printHeader('Failed to create archive: %s' %e)
+            return 1
+        outdir=arc.tmpdir
+        incremental=resume=False
+        exportmode='copy'
+        tagjobs=0
+
     #----------Create output dir if not exist----------
     if not os.path.isdir(outdir):
         try:
@@ -338,17 +1502,141 @@ def main(dbfile,outdir,album,verbose):
     #---------------Loop through albums---------------
     faillist=[]
     metafaillist=[]
+    results=[]
 
-    for ii,albumii in enumerate(albumlist):
-        idii,albumnameii=albumii
+    #------------Count tracks and bytes to export------------
+    progress=Progress(onprogress)
+    if plan is not None:
+        sizes=[tt['size'] for aa in plan['albums'] for tt in aa['tracks']]
+        progress.start(len(albumlist),len(sizes),sum(sizes))
+    else:
+        with timer('load'):
+            sizes=getAlbumSizes(db,where)
+        sizes=[sizes.get(aa,(0,0)) for aa,bb in albumlist]
+        progress.start(len(albumlist),sum([aa for aa,bb in sizes]),\
+                sum([bb for aa,bb in sizes]))
+
+    #---------Download folder, indexed in one walk---------
+    if verbose:
+        printInd('Files in Download folder: %d' %len(dlindex),2)
+
+    #-----------Find duplicated sources, before any export-----------
+    dupset=None
+    if dedup!='off':
+        hashcache=HashCache()
+        if plan is not None:
+            trackids=set([tt['trackId'] for aa in plan['albums']\
+                    for tt in aa['tracks']])
+        else:
+            trackids=None
+        with timer('dedup'):
+            dupset=DuplicateSet(findTrackDuplicates(db,dlindex,\
+                    set([aa for aa,bb in albumlist]),trackids,hashcache,\
+                    where))
+            hashcache.save()
+        if verbose:
+            printInd('Duplicated tracks: %d' %len(dupset),2)
+
+    #----Start tag processes before any thread is started----
+    tagstage=None
+    if tagjobs!=0 and hasMutagen():
+        tagstage=TagStage(tagjobs if tagjobs>0 else None)
+
+    pool=WorkerPool(jobs)
+    iosched=IOScheduler(devicejobs) if devicejobs>0 else None
+    manifest=Manifest(outdir) if incremental else None
+    journal=Journal(outdir,resume) if arc is None else None
+    downloader=Downloader(maxdownloads)
+    covercache=None
+    if cachedir is not None:
+        try:
+            covercache=CoverCache(cachedir)
+        except OSError:
+            printHeader('Failed to create cover cache folder: %s' %cachedir)
+    lastsave=time.time()
+
+    #-------Stream album rows, one album at a time-------
+    albumnames=dict(albumlist)
+    ii=0
+
+    #-----Files of the rows, to count the orphans in "Download"-----
+    # only if printed, and if all rows are streamed
+    countorphans=verbose and plan is None and where.isEmpty()
+    referenced=set()
+
+    for idii,dfii in timedIter('load',iterAlbumTracks(db,where=where)):
+        if cancel is not None and cancel.isCancelled():
+            break
+        if countorphans:
+            referenced.update([tt.filepath for tt in dfii])
+        if idii not in albumnames:
+            continue
+        albumnameii=albumnames[idii]
+        ii+=1
+        progress.startAlbum(ii,albumnameii)
         if verbose:
             #printNumHeader('Processing album: "%s"' %albumnameii,\
 	    printNumHeader(dgbk('ר: "')+albumnameii+'"',\
-                ii+1,len(albumlist),1)
-        failistii,metafaillistii=processAlbum(df,indir,outdir,idii,verbose)
+                ii,len(albumlist),1)
+        results.append(processAlbum(dfii,indir,outdir,idii,verbose,pool,\
+                manifest=manifest,exportmode=exportmode,\
+                covercache=covercache,downloader=downloader,\
+                tagstage=tagstage,dlindex=dlindex,\
+                plan=albumplans.get(idii),journal=journal,\
+                progress=progress,cancel=cancel,dedup=dupset,archive=arc,\
+                iosched=iosched))
+
+        #-----Save manifest now and then, in case of a crash-----
+        if manifest is not None and time.time()-lastsave>MANIFEST_SAVE_INTERVAL:
+            manifest.save()
+            lastsave=time.time()
+
+    #-----------------Wait for all tracks-----------------
+    pool.close()
+    try:
+        pool.join()
+        if tagstage is not None and not (cancel and cancel.isCancelled()):
+            tagstage.close()
+    finally:
+        if tagstage is not None:
+            tagstage.terminate()
+        downloader.close()
+        if journal is not None:
+            journal.close()
+        if manifest is not None:
+            manifest.save()
+    for failistii,metafaillistii in results:
         faillist.extend(failistii)
         metafaillist.extend(metafaillistii)
 
+    cancelled=cancel is not None and cancel.isCancelled()
+
+    #--------Link duplicates to the files of their originals--------
+    dupresults=[]
+    if dupset is not None and not cancelled:
+        dupresults=dupset.link(dedup=='report' or arc is not None)
+        faillist.extend([rr['title'] for rr in dupresults\
+                if rr['status']=='failed'])
+        if len(dupresults)>0:
+            reportfile=saveReport(dupresults,outdir)
+            if arc is not None:
+                arc.addFile(reportfile,arc.relpath(reportfile))
+
+    progress.finish(cancelled)
+
+    #-----Keep the journal to retry failed tracks with --resume-----
+    if journal is not None and len(faillist)==0 and not cancelled:
+        journal.close(remove=True)
+
+    #-------Finish the archive, an incomplete one is removed-------
+    if arc is not None:
+        arc.close(remove=cancelled)
+
+    #----------Files no row of the database refers to----------
+    orphans=[]
+    if countorphans and not cancelled:
+        orphans=dlindex.orphans(referenced)
+
     #-----------------Close connection-----------------
     if verbose:
         #printHeader('Drop connection to database:')
@@ -361,6 +1649,8 @@ def main(dbfile,outdir,album,verbose):
 
     #printHeader('Summary',1)
     printHeader(dgbk('ܽ'),1)
+    if cancelled:
+        printHeader('Export cancelled, continue it with --resume',2)
     if len(faillist)>0:
         #printHeader('Failed to export:',2)
         printHeader(dgbk('ʧ:'),2)
@@ -373,13 +1663,124 @@ def main(dbfile,outdir,album,verbose):
         for failii in metafaillist:
             printInd(failii,2)
 
-    if len(faillist)==0 and len(metafaillist)==0:
+    if len(dupresults)>0:
+        counts=OrderedDict()
+        for rr in dupresults:
+            counts[rr['status']]=counts.get(rr['status'],0)+1
+        printHeader('Duplicated tracks: %s' %', '.join(['%d %s' %(vv,kk)\
+                for kk,vv in counts.items()]),2)
+        if dedup=='report' and verbose:
+            for rr in dupresults:
+                printInd(rr['title'],2)
+
+    #-----Only counted, a library may hold many such leftovers-----
+    if len(orphans)>0:
+        printHeader('Files in Download folder not in database: %d'\
+                %len(orphans),2)
+
+    #-------------Time spent in each stage, see lib.metrics-------------
+    metrics=getMetrics()
+    if metrics is not None:
+        printHeader('Stage metrics, summed over the export threads:',2)
+        printTable(metrics.summaryLines(),2)
+
+    if arc is not None and not cancelled:
+        printHeader('Saved to archive: %s' %archive,2)
+
+    if len(faillist)==0 and len(metafaillist)==0 and not cancelled:
         #printHeader('All done.',2)
         printHeader(dgbk('ȫ'),2)
 
     return 0
 
 
+def watch(dbfile,outdir,album,verbose,interval=POLL_INTERVAL,\
+        debounce=DEBOUNCE,cancel=None,filters=None,**kwargs):
+    '''Export, then keep exporting the tracks new or changed in the library
+
+    <dbfile>, <outdir>, <album>, <verbose>, <filters>: as in main().
+    <interval>: float, seconds between two polls of the library.
+    <debounce>: float, seconds the library must be unchanged before the
+                changes are exported.
+    <cancel>: CancelToken or None, cancel it to stop watching.
+    <kwargs>: other arguments of main(). Exports are always incremental,
+              sharing the manifest of <outdir>.
+
+    The first pass exports the whole selection, then each pass only the
+    tracks whose row or source file changed since the previous one. See
+    lib.watch for how changes are detected.
+
+    Update time: 2016-10-04 14:37:52.
+    '''
+
+    where=rowFilter(album,filters)
+    watcher=LibraryWatcher(dbFiles(dbfile),interval,debounce)
+    snapshot=None
+
+    try:
+        while cancel is None or not cancel.isCancelled():
+            watcher.mark()
+
+            #-------Compare the library with the last export-------
+            try:
+                db,indir,dlindex=openLibrary(dbfile,where,False)
+                try:
+                    newsnap=trackSnapshot(db,dlindex,where)
+                finally:
+                    db.close()
+            except sqlite3.Error as e:
+                # e.g. the database being replaced, retry on next change
+                printHeader('Failed to read database: %s' %e)
+                newsnap=None
+
+            if newsnap is not None:
+                runfilter=where
+                if snapshot is not None:
+                    trackids=changedTracks(snapshot,newsnap)
+                    if trackids is not None:
+                        ranges=trackRanges(trackids)
+                        if ranges is not None:
+                            runfilter=where.withTracks(ranges)
+                if snapshot is None or trackids!=[]:
+                    main(dbfile,outdir,None,verbose,incremental=True,\
+                            cancel=cancel,filters=runfilter,immutable=False,\
+                            **kwargs)
+                snapshot=newsnap
+
+            if verbose:
+                printHeader('Watching for changes, Ctrl-C to stop')
+            if not watcher.wait(cancel):
+                break
+    finally:
+        watcher.close()
+
+    return 0
+
+
+def saveRunStats(metricsfile=None,profiler=None,profilefile=None):
+    '''Save the metrics and profile of the run, registered with atexit
+
+    <metricsfile>: str or None, file to save the Metrics set with
+                   lib.metrics.setMetrics() to, see Metrics.save().
+    <profiler>: lib.metrics.Profiler or None, profiler of the run, saved
+                to <profilefile>.
+    '''
+
+    metrics=getMetrics()
+    if metricsfile is not None and metrics is not None:
+        try:
+            metrics.save(metricsfile)
+        except (IOError,OSError) as e:
+            printHeader('Failed to save metrics: %s' %e)
+    if profiler is not None:
+        profiler.stop()
+        try:
+            profiler.save(profilefile)
+            printHeader('Profile saved to %s' %profilefile)
+        except (IOError,OSError) as e:
+            printHeader('Failed to save profile: %s' %e)
+
+
 
 
 #-----------------------Main-----------------------
@@ -387,25 +1788,225 @@ if __name__=='__main__':
 
     parser=argparse.ArgumentParser(description='Export audios from Ximalaya.')
 
-    parser.add_argument('dbfile',type=str,\
-            help='Path to the "ting.sqlite" database file.')
-    parser.add_argument('outdir',type=str,\
-            help='Output folder to save exported files.')
+    parser.add_argument('paths',type=str,nargs='*',metavar='PATH',\
+            help='''Path to the "ting.sqlite" database file, then the output
+            folder to save exported files. Several database files, e.g.
+            from several devices, are merged into one library.''')
     parser.add_argument('-a','--album',dest='album',\
-            type=str, default=None,\
-            help='''Select one album to process.
-            If not given, process all albums in the library.''')
+            type=str, action='append', default=None,\
+            help='''Select an album to process, by name. Can be given
+            several times. If no album is selected, process all albums
+            in the library.''')
+    parser.add_argument('--album-id',dest='albumids',type=int,\
+            action='append',default=None,\
+            help='''Select an album to process, by albumId. Can be given
+            several times.''')
+    parser.add_argument('--complete',action='store_true',default=False,\
+            help='''Only process tracks completely downloaded, according to
+            the database.''')
+    parser.add_argument('--track-id',dest='trackids',type=parseRange,\
+            action='append',default=None,\
+            help='''Only process tracks with trackId in this range: "N",
+            "N-M", "N-" or "-M". Can be given several times.''')
+    parser.add_argument('--since',dest='since',type=parseSince,default=None,\
+            help='''Only process tracks created since this date, given as
+            YYYY-MM-DD or as a createTime value (ms since epoch).''')
+
+    parser.add_argument('-j','--jobs',dest='jobs',\
+            type=int, default=1,\
+            help='''Number of tracks to export concurrently.
+            Default to 1 (serial).''')
+    parser.add_argument('--device-jobs',dest='devicejobs',type=int,\
+            default=DEVICE_JOBS,\
+            help='''Max number of files exported at the same time from or
+            to each disk, e.g. 1 for a USB hard disk or SD card reader, so
+            it is read sequentially while other disks are busy, and the
+            tracks of an album are read in the order of their files on
+            disk. Default to 0, no limit, in database order.''')
+
+    parser.add_argument('-i','--incremental',action='store_true',\
+            default=False,\
+            help='''Only export tracks that are new or changed since the
+            last export to the same output folder.''')
+
+    parser.add_argument('-m','--export-mode',dest='exportmode',\
+            choices=EXPORT_MODES, default='copy',\
+            help='''How to export files from the "Download" folder.
+            "copy": copy data (default). "hardlink"/"symlink": link to
+            the source, no metadata is written. "reflink": copy-on-write
+            clone (btrfs, xfs). "auto": reflink if possible, else copy.
+            Unsupported modes fall back to copy.''')
+
+    parser.add_argument('--cache-dir',dest='cachedir',type=str,\
+            default=COVER_CACHE_DIR,\
+            help='''Folder to cache album covers in.
+            Default to %s.''' %COVER_CACHE_DIR)
+    parser.add_argument('--no-cache',dest='cachedir',action='store_const',\
+            const=None, help='''Download album covers on every run.''')
+
+    parser.add_argument('--downloads',dest='maxdownloads',type=int,\
+            default=MAX_DOWNLOADS,\
+            help='''Max number of incomplete audios to download at the
+            same time. Default to %d.''' %MAX_DOWNLOADS)
+
+    parser.add_argument('-t','--tag-jobs',dest='tagjobs',type=int,\
+            default=0,\
+            help='''Number of processes to write metadata in. Default to
+            0, write metadata in the export threads. Use -1 for one process
+            per CPU core.''')
+
+    parser.add_argument('-r','--resume',action='store_true',\
+            default=False,\
+            help='''Continue an interrupted export to the same output
+            folder, without exporting again the tracks already done.''')
+
+    parser.add_argument('--dedup',dest='dedup',choices=DEDUP_MODES,\
+            default='off',\
+            help='''Find tracks whose audio file has the same content as
+            another's. "link": export one of them, hard link the others to
+            it (they share its metadata). "report": export one of them,
+            list the others. Default to "off".''')
+
+    parser.add_argument('--archive',dest='archive',type=str,default=None,\
+            help='''Export into this .zip or .tar archive instead of an
+            output folder, which is then not given. Tracks are streamed
+            into it with their metadata, without compression.''')
+
+    parser.add_argument('-w','--watch',action='store_true',default=False,\
+            help='''After the export, keep running and export the tracks
+            new or changed in the library, as the database and "Download"
+            folder change. Exports are incremental.''')
+    parser.add_argument('--watch-interval',dest='watchinterval',type=float,\
+            default=POLL_INTERVAL,\
+            help='''Seconds between two checks of the library in --watch
+            mode. Default to %g.''' %POLL_INTERVAL)
+    parser.add_argument('--debounce',dest='debounce',type=float,\
+            default=DEBOUNCE,\
+            help='''Seconds the library must be unchanged before exporting
+            the changes in --watch mode. Default to %g.''' %DEBOUNCE)
+
+    parser.add_argument('--plan',dest='plan',type=str,default=None,\
+            help='''Dry run: plan the export, print it and save it to this
+            file, without exporting anything.''')
+    parser.add_argument('--run-plan',dest='runplan',type=str,default=None,\
+            help='''Execute a plan saved by --plan as-is. The database,
+            output folder and export mode are those of the plan.''')
+
+    parser.add_argument('--metrics',action='store_true',default=False,\
+            help='''Count the calls, seconds, bytes and failures of each
+            stage of the export (database, covers, copies, metadata,
+            printing...), and print them in the summary.''')
+    parser.add_argument('--metrics-file',dest='metricsfile',type=str,\
+            default=None,\
+            help='''Save the metrics of --metrics to this file when done:
+            in the Prometheus text format if it ends with .prom, e.g. for
+            the textfile collector of node_exporter, else in json.''')
+    parser.add_argument('--profile',dest='profile',type=str,default=None,\
+            help='''Profile the run with cProfile, and save the stats to
+            this file, to read with pstats or snakeviz.''')
 
     parser.add_argument('-v','--verbose',action='store_true',\
         default=True, help='Print some texts.')
+    parser.add_argument('-q','--quiet',dest='logformat',\
+            action='store_const',const='quiet',default='text',\
+            help='''Print nothing.''')
+    parser.add_argument('--json',dest='logformat',action='store_const',\
+            const='json',\
+            help='''Print messages as json lines, for other programs to
+            read.''')
     try:
         args = parser.parse_args()
     except:
         #parser.print_help()
         sys.exit(1)
 
-    dbfile = os.path.abspath(args.dbfile)
-    outdir = os.path.abspath(args.outdir)
+    tools.setFormatter(args.logformat)
+
+    #----------Count the stages, profile, save them on exit----------
+    if args.metrics or args.metricsfile is not None:
+        setMetrics(Metrics())
+    profiler=None
+    if args.profile is not None:
+        profiler=Profiler()
+        profiler.start()
+    if args.metricsfile is not None or profiler is not None:
+        atexit.register(saveRunStats,args.metricsfile,profiler,args.profile)
+
+    #------Python 2 gives arguments as bytes, names are unicode------
+    if args.album is not None:
+        args.album=[tools.decodeArg(aa) for aa in args.album]
+    filters=TrackFilter(args.album,args.albumids,args.complete,\
+            args.trackids,args.since)
+
+    if args.watch and (args.archive is not None or args.resume or\
+            args.plan is not None or args.runplan is not None):
+        printHeader('--archive, --resume, --plan and --run-plan can not be '\
+                'used with --watch')
+        sys.exit(1)
+
+    #------------------Execute a saved plan------------------
+    if args.runplan is not None:
+        try:
+            plan=loadPlan(args.runplan)
+        except (IOError,ValueError) as e:
+            printHeader('Failed to load plan: %s' %e)
+            sys.exit(1)
+        main(plan['dbfile'],plan['outdir'],None,args.verbose,args.jobs,\
+                args.incremental,plan['exportmode'],args.cachedir,\
+                args.maxdownloads,args.tagjobs,plan,args.resume,\
+                dedup=args.dedup,archive=args.archive,\
+                devicejobs=args.devicejobs)
+        sys.exit(0)
+
+    #-----------No output folder with --archive-----------
+    if args.archive is not None:
+        try:
+            archiveFormat(args.archive)
+        except ValueError as e:
+            printHeader(str(e))
+            sys.exit(1)
+        if args.incremental or args.resume or args.plan is not None:
+            printHeader('--incremental, --resume and --plan can not be '\
+                    'used with --archive')
+            sys.exit(1)
+        dbpaths,outdir=args.paths,None
+    else:
+        dbpaths,outdir=args.paths[:-1],args.paths[-1:]
+
+    if len(dbpaths)==0:
+        parser.print_usage()
+        sys.exit(1)
 
-    main(dbfile,outdir,args.album,args.verbose)
+    dbfile = [os.path.abspath(ii) for ii in dbpaths]
+    if len(dbfile)==1:
+        dbfile=dbfile[0]
+    if outdir is not None:
+        outdir = os.path.abspath(outdir[0])
+
+    #-------------------Plan only-------------------
+    if args.plan is not None:
+        plan=makePlan(dbfile,outdir,None,args.exportmode,filters)
+        if plan is None:
+            sys.exit(1)
+        printPlan(plan,args.verbose)
+        savePlan(plan,args.plan)
+        printHeader('Plan saved to %s' %args.plan)
+        sys.exit(0)
+
+    #------------Export, then export the changes as they come------------
+    if args.watch:
+        try:
+            watch(dbfile,outdir,None,args.verbose,args.watchinterval,\
+                    args.debounce,filters=filters,jobs=args.jobs,\
+                    exportmode=args.exportmode,cachedir=args.cachedir,\
+                    maxdownloads=args.maxdownloads,tagjobs=args.tagjobs,\
+                    dedup=args.dedup,devicejobs=args.devicejobs)
+        except KeyboardInterrupt:
+            printHeader('Watch stopped')
+        sys.exit(0)
+
+    main(dbfile,outdir,None,args.verbose,args.jobs,args.incremental,\
+            args.exportmode,args.cachedir,args.maxdownloads,args.tagjobs,\
+            None,args.resume,dedup=args.dedup,archive=args.archive,\
+            filters=filters,devicejobs=args.devicejobs)
 